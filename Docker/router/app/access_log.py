@@ -0,0 +1,194 @@
+# app/access_log.py
+"""
+Log de acceso estructurado y no bloqueante.
+
+Los workers solo hacen AccessLog.record(dict): el registro entra en una
+cola acotada y un hilo escritor lo serializa como una línea JSON y escribe
+por lotes (un write + flush por lote) en stdout o en un archivo con
+rotación por tamaño (<archivo>.1 ... <archivo>.N). Si la cola está llena el
+registro se descarta y se cuenta en dropped: un stdout lento nunca retrasa
+una respuesta.
+
+Muestreo: las respuestas correctas (status < 400) de las rutas con una
+tasa configurada (prefijo de ruta -> fracción, p. ej. /static/=0.1) solo se
+registran con esa probabilidad; el registro lleva "sample" para poder
+reponderar. Los errores se registran siempre.
+"""
+
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_BATCH_MAX = 512
+
+
+def parse_sample_rules(spec: str) -> List[Tuple[str, float]]:
+    """ "/status.json=0.1,/static/=0.05" -> [("/status.json", 0.1), ("/static/", 0.05)]."""
+    rules = []
+    for item in spec.split(","):
+        prefix, sep, rate = item.strip().partition("=")
+        if not sep or not prefix:
+            continue
+        try:
+            rules.append((prefix.strip(), min(1.0, max(0.0, float(rate)))))
+        except ValueError:
+            print(f"ACCESS_LOG_SAMPLE: tasa inválida en {item!r}, se ignora")
+    # El prefijo más largo gana
+    rules.sort(key=lambda r: len(r[0]), reverse=True)
+    return rules
+
+
+class AccessLog:
+    def __init__(self, *, path: Optional[str] = None, max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 3, queue_size: int = 10000,
+                 sample: Sequence[Tuple[str, float]] = (), enabled: bool = True):
+        self.path = path or None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = enabled
+        self.sample = list(sample)
+        self._q: "queue.Queue[Optional[Dict[str, object]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._fh = None
+        self._ino: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._count_lock = threading.Lock()  # dropped y sampled_out los suman varios workers
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    # -- productores (workers) -------------------------------------------
+
+    def _rate(self, path: str) -> float:
+        for prefix, rate in self.sample:
+            if path.startswith(prefix):
+                return rate
+        return 1.0
+
+    def record(self, entry: Dict[str, object]) -> None:
+        """Encola un registro sin bloquear (se descarta si la cola está llena)."""
+        if not self.enabled:
+            return
+        status = entry.get("status") or 0
+        if status < 400:
+            rate = self._rate(str(entry.get("path") or ""))
+            if rate < 1.0:
+                if random.random() >= rate:
+                    with self._count_lock:
+                        self.sampled_out += 1
+                    return
+                entry["sample"] = rate
+        if self._thread is None:
+            self._start()
+        try:
+            self._q.put_nowait(entry)
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="access-log", daemon=True)
+                self._thread.start()
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Escribe lo pendiente y para el hilo escritor (al salir; admite varias llamadas)."""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._q.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._count_lock:
+            dropped, sampled_out = self.dropped, self.sampled_out
+        return {
+            "written": self.written,
+            "dropped": dropped,
+            "sampled_out": sampled_out,
+            "queued": self._q.qsize(),
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+        }
+
+    # -- escritor ----------------------------------------------------------
+
+    def _loop(self) -> None:
+        while True:
+            entry = self._q.get()
+            batch = [entry]
+            while len(batch) < _BATCH_MAX:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = [json.dumps(e, ensure_ascii=False, separators=(",", ":")) for e in batch if e is not None]
+            if lines:
+                self._write(("\n".join(lines) + "\n").encode("utf-8"), len(lines))
+            if stop:
+                return
+
+    def _write(self, data: bytes, count: int) -> None:
+        try:
+            if self.path is None:
+                out = sys.stdout.buffer
+                out.write(data)
+                out.flush()
+            else:
+                self._write_file(data)
+            self.written += count
+        except (OSError, ValueError) as e:
+            self.write_errors += 1
+            print(f"Error escribiendo el log de acceso: {e}", file=sys.stderr)
+
+    def _write_file(self, data: bytes) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        # Otro proceso (pre-fork) rotó o borró el archivo: reabrir
+        if self._fh is None or st is None or st.st_ino != self._ino:
+            self._open()
+            st = os.fstat(self._fh.fileno())
+        if self.max_bytes > 0 and st.st_size > 0 and st.st_size + len(data) > self.max_bytes:
+            self._rotate()
+        self._fh.write(data)
+        self._fh.flush()
+
+    def _open(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self._fh = open(self.path, "ab")
+        self._ino = os.fstat(self._fh.fileno()).st_ino
+
+    def _rotate(self) -> None:
+        self._fh.close()
+        self._fh = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.truncate(self.path, 0)
+        self.rotations += 1
+        self._open()
+
+
+def now_iso() -> str:
+    """Hora UTC con milisegundos para el campo "ts"."""
+    t = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + f".{int(t % 1 * 1000):03d}Z"
@@ -3,17 +3,22 @@
 Panel de administración de usuarios sin FastAPI, usando solo librerías estándar.
 """
 
-from typing import Optional, List, Dict
+from typing import Optional, List
+from urllib.parse import urlencode
 import html
 
-from .users import load_users, create_user, delete_user
-from .config import AUTH_TIMEOUT
+from .users import page_users, create_user, delete_user
+from .config import ADMIN_PAGE_SIZE, AUTH_TIMEOUT
+from .sessions import SESSIONS, Session
+from .templating import TEMPLATES, Template
 
 
-def _render_users_table(users: List[Dict[str, str]]) -> str:
+MAX_PAGE_SIZE = 500
+
+
+def _render_users_table(usernames: List[str], searching: bool) -> str:
     rows = []
-    for u in users:
-        username = str(u.get("u", ""))
+    for username in usernames:
         username_esc = html.escape(username)
 
         if username == "admin":
@@ -41,90 +46,125 @@ def _render_users_table(users: List[Dict[str, str]]) -> str:
         )
 
     if not rows:
-        return """
+        empty = "Ningún usuario empieza así." if searching else "No hay usuarios definidos."
+        return f"""
         <div style="padding:6px 0;font-size:0.78rem;color:var(--muted);">
-          No hay usuarios definidos.
+          {empty}
         </div>
         """
 
     return "\n".join(rows)
 
 
-def render_admin_page(admin_user: str, message: Optional[str]) -> str:
-    users_list, _ = load_users()
-    users_html = _render_users_table(users_list)
-    msg_block = ""
-    if message:
-        msg_block = f"""
-        <div class="helper" style="margin-top:10px;">
-          {html.escape(message)}
+def _users_href(query: str, page: int, order: str, per_page: int, *,
+                after: Optional[str] = None, before: Optional[str] = None) -> str:
+    params = {}
+    if query:
+        params["q"] = query
+    if order != "asc":
+        params["order"] = order
+    if per_page != ADMIN_PAGE_SIZE:
+        params["per_page"] = per_page
+    if page > 1:
+        params["page"] = page
+        # Cursor de la página vecina: se busca por clave, sin saltar filas
+        if after is not None:
+            params["after"] = after
+        elif before is not None:
+            params["before"] = before
+    return "/admin/users" + ("?" + urlencode(params) if params else "")
+
+
+def _render_pager(query: str, page: int, pages: int, order: str, per_page: int, total: int,
+                  usernames: List[str]) -> str:
+    prev_html = next_html = "<span></span>"
+    if page > 1:
+        href = html.escape(_users_href(query, page - 1, order, per_page,
+                                       before=usernames[0] if usernames else None))
+        prev_html = f'<a href="{href}">« Anterior</a>'
+    if page < pages:
+        href = html.escape(_users_href(query, page + 1, order, per_page,
+                                       after=usernames[-1] if usernames else None))
+        next_html = f'<a href="{href}">Siguiente »</a>'
+    label = "usuario" if total == 1 else "usuarios"
+    return f"""
+        <div class="pager">
+          {prev_html}
+          <span>Página {page} de {pages} · {total} {label}</span>
+          {next_html}
         </div>
         """
 
-    return f"""<!doctype html>
-<html lang="es">
-<head>
-    <meta charset="utf-8" />
-    <title>Gestión de usuarios · Portal cautivo</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1" />
-    <link href="/static/base.css" rel="stylesheet" />
-</head>
-<body>
-  <div class="shell">
-    <div class="card">
-      <div class="card-inner">
-        <h1>
-          <span class="logo">CP</span>
-          Gestión de usuarios
-        </h1>
-        <div class="subtitle">
-          Crea o elimina cuentas que pueden autenticarse en el portal cautivo.
-        </div>
 
-        <div class="helper">
-          Estás autenticado como <strong>{html.escape(admin_user)}</strong>.
-          Las credenciales se validan con HTTP Basic (usuario/contraseña).
+def _render_sessions_table(sessions: List[Session]) -> str:
+    if not sessions:
+        return """
+        <div style="padding:6px 0;font-size:0.78rem;color:var(--muted);">
+          No hay sesiones activas.
         </div>
+        """
 
-        <div class="users">
-          <div class="users-header">
-            <div>Usuario</div>
-            <div>Rol</div>
-            <div class="user-actions">Acciones</div>
+    rows = []
+    for s in sessions:
+        user_html = html.escape(s.user) if s.user else '<span style="color:var(--muted);">—</span>'
+        rows.append(
+            f"""
+          <div class="user-row">
+            <div>{html.escape(s.ip)}</div>
+            <div>{user_html}</div>
+            <div class="user-actions">{s.remaining()} s</div>
           </div>
-          {users_html}
-        </div>
-
-        <div class="create-box">
-          <h2>Nueva cuenta</h2>
-          <form method="post" action="/admin/users/create">
-            <div>
-              <label for="new_username">Usuario</label>
-              <input id="new_username" name="username"
-                     placeholder="p.ej. estudiante1" required />
-            </div>
-            <div>
-              <label for="new_password">Contraseña</label>
-              <input id="new_password" name="password" placeholder="••••••••" required />
-            </div>
-            <div>
-              <button type="submit">Crear</button>
-            </div>
-          </form>
-        </div>
+        """
+        )
+    return "\n".join(rows)
 
-        {msg_block}
 
-        <div class="meta">
-          <span><a href="/login">Volver al portal</a></span>
-          <span>Tiempo de sesión: {AUTH_TIMEOUT} s</span>
+_MESSAGE_BLOCK = Template("""
+        <div class="helper" style="margin-top:10px;">
+          {{message}}
         </div>
-      </div>
-    </div>
-  </div>
-</body>
-</html>
-"""
+        """)
+
+
+def render_admin_page(admin_user: str, message: Optional[str], *, query: str = "", page: int = 1,
+                      order: str = "asc", per_page: int = ADMIN_PAGE_SIZE,
+                      after: Optional[str] = None, before: Optional[str] = None) -> bytes:
+    """
+    HTML (UTF-8) del panel de administración. La lista de usuarios se
+    muestra por páginas: solo se renderizan los per_page usuarios de la
+    página pedida entre los que empiezan por query. Los enlaces Anterior /
+    Siguiente llevan el primer / último nombre de la página (before /
+    after) para que la vecina se busque por clave y no por posición.
+    """
+    query = query.strip()
+    order = "desc" if order == "desc" else "asc"
+    per_page = min(MAX_PAGE_SIZE, max(1, per_page))
+    _, total = page_users(query, 0, 0)
+    pages = max(1, -(-total // per_page))
+    page = min(max(1, page), pages)
+    descending = order == "desc"
+    usernames: List[str] = []
+    if page > 1 and (after or before):
+        usernames, total = page_users(query, 0, per_page, descending, after=after or None,
+                                      before=None if after else before)
+    if not usernames:
+        # Primera página, enlace directo o cursor que ya no tiene vecinos: por posición
+        usernames, total = page_users(query, (page - 1) * per_page, per_page, descending)
+    users_html = _render_users_table(usernames, bool(query))
+    pager_html = _render_pager(query, page, pages, order, per_page, total, usernames)
+    sessions_html = _render_sessions_table(SESSIONS.active())
+    message_block = _MESSAGE_BLOCK.render(message=message).decode("utf-8") if message else ""
+    return TEMPLATES.get("admin.html").render(
+        admin_user=admin_user,
+        users_html=users_html,
+        pager_html=pager_html,
+        query=query,
+        sort_href=_users_href(query, 1, "desc" if order == "asc" else "asc", per_page),
+        sort_arrow="▲" if order == "asc" else "▼",
+        sessions_html=sessions_html,
+        message_block=message_block,
+        auth_timeout=AUTH_TIMEOUT,
+    )
 
 
 def handle_create_user(username: str, password: str) -> str:
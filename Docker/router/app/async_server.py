@@ -0,0 +1,224 @@
+# app/async_server.py
+"""
+Servidor HTTP manual sobre asyncio (un único bucle de eventos).
+
+Alternativa a ManualThreadPoolHTTPServer: el bucle multiplexa miles de
+sockets (accept, lectura de la petición y envío de la respuesta) sin atar
+un hilo a cada conexión, ni siquiera a las keep-alive ociosas. El handler
+(route_request) hace trabajo bloqueante (ipset, carga de users.json), así
+que se ejecuta en un ThreadPoolExecutor. Los bodies que se leen por
+trozos (subidas, ver http_parser.BodyStream) los pide el handler desde su
+hilo al bucle de eventos, trozo a trozo.
+"""
+
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+
+from .http_parser import MAX_HEADER_BYTES, BodyStream, StreamedBody, content_length, parse_request_head, wants_keep_alive
+from .http_utils import (
+    ChunkedResponse,
+    FileResponse,
+    StreamResponse,
+    build_response,
+    encode_chunk,
+    error_response,
+    log,
+    set_connection_header,
+)
+
+# (method, path, headers, body, peer_ip) -> bytes, FileResponse (body con
+# sendfile), StreamResponse (stream de eventos) o ChunkedResponse
+Handler = Callable[[str, str, dict, "bytes | BodyStream", str], "bytes | FileResponse | StreamResponse | ChunkedResponse"]
+
+
+def _read_chunks(reader: asyncio.StreamReader, loop: asyncio.AbstractEventLoop, n: int,
+                 timeout: float, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Body de n bytes leído desde un hilo del executor, trozo a trozo, en el bucle."""
+    remaining = n
+    while remaining > 0:
+        fut = asyncio.run_coroutine_threadsafe(reader.read(min(chunk_size, remaining)), loop)
+        chunk = fut.result(timeout)
+        if not chunk:
+            raise ValueError("incomplete body")
+        remaining -= len(chunk)
+        yield chunk
+
+
+class AsyncioHTTPServer:
+    """
+    Servidor TCP(HTTP) sobre asyncio:
+    - accept y E/S de sockets en el bucle de eventos (no bloqueante)
+    - parseo de la petición en el bucle
+    - handler en un executor de N hilos
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        handler: Handler,
+        workers: int = 10,
+        backlog: int = 128,
+        read_timeout: float = 5.0,
+        keepalive_timeout: float = 15.0,
+        keepalive_max_requests: int = 100,
+        sock: socket.socket | None = None,
+        streamed: StreamedBody | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.workers = workers
+        self.backlog = backlog
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max_requests = keepalive_max_requests
+        # Socket de escucha ya creado (modo pre-fork) o None para crearlo al arrancar
+        self._sock = sock
+        # Rutas cuyo body lee el handler por trozos (ver http_parser.StreamedBody)
+        self.streamed = streamed
+        self._executor: ThreadPoolExecutor | None = None
+
+    def start(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            log("Servidor detenido por KeyboardInterrupt")
+
+    async def _serve(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cp-exec")
+        try:
+            if self._sock is not None:
+                server = await asyncio.start_server(
+                    self._handle_conn, sock=self._sock, limit=MAX_HEADER_BYTES
+                )
+            else:
+                server = await asyncio.start_server(
+                    self._handle_conn,
+                    self.host,
+                    self.port,
+                    backlog=self.backlog,
+                    reuse_address=True,
+                    limit=MAX_HEADER_BYTES,
+                )
+            log(f"Servidor asyncio(HTTP) manual escuchando en {self.host}:{self.port} (executor={self.workers})")
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, str, dict, "bytes | BodyStream"] | None:
+        """
+        Lee la siguiente petición de la conexión. El StreamReader conserva
+        los bytes sobrantes, así que las peticiones encadenadas (pipelining)
+        se atienden en orden. Devuelve None si el cliente cerró entre peticiones.
+        """
+        try:
+            raw = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise ValueError("header too large")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise ValueError("incomplete headers")
+
+        # RFC 9112: se ignoran líneas vacías antes de la request line
+        method, path, version, headers = parse_request_head(raw[:-4].lstrip(b"\r\n"))
+
+        limit = self.streamed(method, path.split("?", 1)[0]) if self.streamed is not None else None
+        if limit is not None:
+            n = content_length(headers, limit)
+            loop = asyncio.get_running_loop()
+            return method, path, version, headers, BodyStream(_read_chunks(reader, loop, n, self.read_timeout), n)
+
+        body = b""
+        n = content_length(headers)
+        if n:
+            try:
+                body = await reader.readexactly(n)
+            except asyncio.IncompleteReadError as e:
+                # Igual que el parser bloqueante: nos quedamos con lo recibido
+                body = e.partial
+        return method, path, version, headers, body
+
+    async def _handle_conn(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        peer_ip = peer[0] if peer else ""
+        loop = asyncio.get_running_loop()
+        served = 0
+
+        try:
+            while True:
+                # Primera petición: read_timeout; siguientes: tiempo ocioso de keep-alive
+                timeout = self.read_timeout if served == 0 else self.keepalive_timeout
+                try:
+                    req = await asyncio.wait_for(self._read_request(reader), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if served:
+                        break  # conexión ociosa: se cierra sin respuesta
+                    req, resp = None, build_response(400, {}, b"Bad Request")
+                except Exception as e:
+                    req, resp = None, error_response(e)
+                else:
+                    if req is None:
+                        break
+
+                keep_alive = False
+                if req is not None:
+                    method, path, version, headers, body = req
+                    served += 1
+                    keep_alive = (
+                        self.keepalive_timeout > 0
+                        and served < self.keepalive_max_requests
+                        and wants_keep_alive(version, headers)
+                    )
+                    try:
+                        resp = await loop.run_in_executor(
+                            self._executor, self.handler, method, path, headers, body, peer_ip
+                        )
+                    except Exception as e:
+                        resp, keep_alive = error_response(e), False
+                    if isinstance(body, BodyStream) and body.remaining:
+                        keep_alive = False  # quedan bytes del body sin leer
+
+                resp = set_connection_header(resp, keep_alive)
+                if isinstance(resp, StreamResponse):
+                    writer.write(resp.head + resp.first)
+                    await writer.drain()
+                    await resp.serve_async(reader, writer)
+                    break
+                if isinstance(resp, ChunkedResponse):
+                    writer.write(resp.head)
+                    chunks = iter(resp.chunks)
+                    while True:
+                        # El iterador puede bloquear (lecturas del almacén): en el executor
+                        data = await loop.run_in_executor(self._executor, next, chunks, None)
+                        if data is None:
+                            break
+                        if data:
+                            writer.write(encode_chunk(data))
+                            await writer.drain()
+                    writer.write(encode_chunk(b""))
+                    await writer.drain()
+                elif isinstance(resp, FileResponse):
+                    writer.write(resp.head)
+                    await writer.drain()
+                    if resp.count:
+                        with open(resp.path, "rb") as f:
+                            await loop.sendfile(writer.transport, f, resp.offset, resp.count)
+                else:
+                    writer.write(resp)
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except Exception:
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
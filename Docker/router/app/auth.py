@@ -7,7 +7,8 @@ sin dependencias externas (solo librerías estándar).
 import base64
 from typing import Optional, Tuple
 
-from .users import load_users
+from .passwords import verify_password
+from .users import get_password
 
 
 def parse_basic_auth(header_value: Optional[str]) -> Optional[Tuple[str, str]]:
@@ -36,6 +37,6 @@ def is_admin(username: str, password: str) -> bool:
     Comprueba si las credenciales corresponden al usuario 'admin'
     definido en users.json o en USERS_JSON.
     """
-    _, mapping = load_users()
-    stored = mapping.get(username)
-    return username == "admin" and stored is not None and stored == password
+    if username != "admin":
+        return False
+    return verify_password(username, password, get_password(username))
@@ -0,0 +1,126 @@
+# app/compression.py
+"""
+Compresión gzip/deflate negociada de las respuestas.
+
+ResponseCompressor.apply() recibe la respuesta ya construida y las
+cabeceras de la petición. Comprime el body si:
+  - el cliente acepta gzip o deflate (Accept-Encoding, respetando q=0),
+  - la respuesta es 200 con un Content-Type de texto y sin Content-Encoding,
+  - el body tiene al menos min_bytes.
+
+Las respuestas con ETag (cacheables: /status, estáticos) guardan su body
+comprimido en una caché LRU por (ETag, codificación), así que no se
+vuelven a comprimir. Como hace nginx, el ETag de una respuesta comprimida
+pasa a ser débil (W/"..."): If-None-Match sigue funcionando con la
+comparación débil de etag_matches.
+
+Toda respuesta comprimible lleva "Vary: Accept-Encoding", se comprima o no.
+"""
+
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from .http_utils import accepts_encoding
+
+_COMPRESSIBLE = (
+    b"text/",
+    b"application/json",
+    b"application/javascript",
+    b"image/svg+xml",
+)
+
+
+def _compress(body: bytes, coding: str, level: int) -> bytes:
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    return zlib.compress(body, level)  # "deflate" en HTTP = formato zlib
+
+
+def _choose_coding(accept_encoding: Optional[str]) -> Optional[str]:
+    if accepts_encoding(accept_encoding, "gzip"):
+        return "gzip"
+    if accepts_encoding(accept_encoding, "deflate"):
+        return "deflate"
+    return None
+
+
+class ResponseCompressor:
+    def __init__(self, *, enabled: bool, min_bytes: int, level: int, cache_entries: int = 256):
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.level = level
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict = OrderedDict()  # (etag, coding) -> body comprimido
+        self._lock = threading.Lock()
+
+    def _cached(self, etag: str, coding: str, body: bytes) -> bytes:
+        key = (etag, coding)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+        compressed = _compress(body, coding, self.level)
+        with self._lock:
+            self._cache[key] = compressed
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return compressed
+
+    def apply(self, resp, request_headers):
+        """resp: bytes, FileResponse o StreamResponse; solo se comprimen los bytes."""
+        if not self.enabled or not isinstance(resp, bytes):
+            return resp
+        end = resp.find(b"\r\n\r\n")
+        if end < 0 or not resp.startswith(b"HTTP/1.1 200 "):
+            return resp
+        body = resp[end + 4:]
+        if len(body) < self.min_bytes:
+            return resp
+
+        lines = resp[:end].split(b"\r\n")
+        ctype = etag = None
+        for ln in lines[1:]:
+            name, _, value = ln.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-encoding" or name == b"content-range":
+                return resp
+            if name == b"content-type":
+                ctype = value.strip().lower()
+            elif name == b"etag":
+                etag = value.strip()
+        if ctype is None or not ctype.startswith(_COMPRESSIBLE):
+            return resp
+
+        coding = _choose_coding(request_headers.get("Accept-Encoding"))
+        if coding is None:
+            if any(ln.lower().startswith(b"vary:") for ln in lines):
+                return resp
+            return resp[:end] + b"\r\nVary: Accept-Encoding" + resp[end:]
+
+        if etag is not None:
+            compressed = self._cached(etag.decode("latin-1"), coding, body)
+        else:
+            compressed = _compress(body, coding, self.level)
+        if len(compressed) >= len(body):
+            return resp
+
+        out = [lines[0]]
+        has_vary = False
+        for ln in lines[1:]:
+            lower = ln.lower()
+            if lower.startswith(b"content-length:"):
+                continue
+            if lower.startswith(b"etag:") and not etag.startswith(b"W/"):
+                ln = b"ETag: W/" + etag
+            elif lower.startswith(b"vary:"):
+                has_vary = True
+            out.append(ln)
+        if not has_vary:
+            out.append(b"Vary: Accept-Encoding")
+        out.append(b"Content-Encoding: " + coding.encode("ascii"))
+        out.append(b"Content-Length: " + str(len(compressed)).encode("ascii"))
+        return b"\r\n".join(out) + b"\r\n\r\n" + compressed
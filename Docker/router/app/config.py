@@ -27,3 +27,142 @@ def _detect_users_file() -> Path:
 
 # Ubicación del archivo de usuarios (detección automática)
 USERS_FILE = _detect_users_file()
+
+# Journal de cambios de usuarios (ver user_journal): archivo, tamaño a partir
+# del cual se compacta en USERS_FILE (0 = nunca automáticamente) y fsync por lote
+USERS_JOURNAL_FILE = Path(os.getenv("USERS_JOURNAL_FILE") or f"{USERS_FILE}.journal")
+USERS_JOURNAL_MAX_BYTES = int(os.getenv("USERS_JOURNAL_MAX_BYTES", str(1024 * 1024)))
+USERS_JOURNAL_FSYNC = os.getenv("USERS_JOURNAL_FSYNC", "1").strip().lower() in ("1", "true", "yes")
+
+# Almacén de usuarios: "file" (USERS_FILE + journal) o "sqlite" (USERS_DB, ver
+# user_sqlite; si la base está vacía se llena con los usuarios de USERS_FILE)
+USERS_BACKEND = os.getenv("USERS_BACKEND", "file").strip().lower()
+USERS_DB = Path(os.getenv("USERS_DB") or USERS_FILE.with_suffix(".db"))
+
+# ----------------------------
+# Servidor HTTP
+# ----------------------------
+
+# Modo del servidor: "threadpool" (ManualThreadPoolHTTPServer) o "asyncio"
+# (bucle de eventos). Se puede sobrescribir con --mode en la línea de comandos.
+SERVER_MODE = os.getenv("SERVER_MODE", "threadpool").strip().lower()
+
+# Hilos del pool (modo threadpool) o del executor de trabajo bloqueante (modo asyncio)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "10"))
+
+# Cola de trabajo del modo threadpool por clase de petición (ver scheduler):
+# conexiones máximas en cola (0 = sin límite) y segundos máximos de espera
+# antes de responder 503
+QUEUE_MAX_FAST = int(os.getenv("QUEUE_MAX_FAST", "512"))
+QUEUE_MAX_AUTH = int(os.getenv("QUEUE_MAX_AUTH", "128"))
+QUEUE_MAX_ADMIN = int(os.getenv("QUEUE_MAX_ADMIN", "32"))
+QUEUE_DEADLINE_FAST = float(os.getenv("QUEUE_DEADLINE_FAST", "2"))
+QUEUE_DEADLINE_AUTH = float(os.getenv("QUEUE_DEADLINE_AUTH", "5"))
+QUEUE_DEADLINE_ADMIN = float(os.getenv("QUEUE_DEADLINE_ADMIN", "10"))
+
+# Backlog de listen() del socket servidor
+LISTEN_BACKLOG = int(os.getenv("LISTEN_BACKLOG", "128"))
+
+# Conexiones persistentes (HTTP/1.1 keep-alive)
+# Segundos que una conexión ociosa espera su siguiente petición (0 = sin keep-alive)
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", "15"))
+# Máximo de peticiones servidas por conexión antes de cerrarla
+KEEPALIVE_MAX_REQUESTS = int(os.getenv("KEEPALIVE_MAX_REQUESTS", "100"))
+
+# Procesos del modo pre-fork (1 = un único proceso, 0 = uno por núcleo).
+# Se puede sobrescribir con --processes en la línea de comandos.
+PORTAL_PROCESSES = int(os.getenv("PORTAL_PROCESSES", "1"))
+
+# Compresión gzip/deflate de las respuestas según Accept-Encoding (0 = desactivada,
+# p. ej. si la hace nginx), tamaño mínimo del body y nivel de compresión
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1").strip().lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+
+# Archivos estáticos (/static): max-age de Cache-Control (segundos) y tamaño a
+# partir del cual se envían con sendfile en lugar de guardarse en memoria
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+STATIC_SENDFILE_MIN_BYTES = int(os.getenv("STATIC_SENDFILE_MIN_BYTES", str(256 * 1024)))
+
+# Desarrollo: recompilar las plantillas HTML (app/templates) cuando cambian
+TEMPLATE_RELOAD = os.getenv("TEMPLATE_RELOAD", "0").strip().lower() in ("1", "true", "yes")
+
+# Usuarios por página en /admin/users (se puede cambiar con ?per_page=, hasta 500)
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+
+# Tamaño máximo del archivo subido a /admin/users/import (se lee por trozos)
+USERS_IMPORT_MAX_BYTES = int(os.getenv("USERS_IMPORT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# ----------------------------
+# Contraseñas
+# ----------------------------
+
+# Procesos dedicados a calcular hashes de contraseña (0 = en el hilo de la petición)
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+# Máximo de verificaciones/hash en vuelo en el pool; el resto espera
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "32"))
+# Caché de verificaciones correctas recientes (entradas y segundos de validez; 0 = sin caché)
+PASSWORD_CACHE_SIZE = int(os.getenv("PASSWORD_CACHE_SIZE", "1024"))
+PASSWORD_CACHE_TTL = float(os.getenv("PASSWORD_CACHE_TTL", "300"))
+
+# ----------------------------
+# ipset
+# ----------------------------
+
+# Backend del set de IPs autenticadas: "ipset" (ipset + iptables), "nft"
+# (set de nftables; entrypoint.sh crea las reglas equivalentes) o "memory"
+# (en memoria, sin tocar el kernel: pruebas y benchmarks)
+FIREWALL_BACKEND = os.getenv("FIREWALL_BACKEND", "ipset").strip().lower()
+# Familia y tabla nftables que contienen el set 'authed' (backend nft)
+NFT_FAMILY = os.getenv("NFT_FAMILY", "inet").strip()
+NFT_TABLE = os.getenv("NFT_TABLE", "portal").strip()
+
+# Backend para hablar con ipset: "auto" (netlink si está disponible, si no el
+# binario ipset), "netlink" o "subprocess" (fork/exec de ipset en cada operación)
+IPSET_BACKEND = os.getenv("IPSET_BACKEND", "auto").strip().lower()
+
+# Agrupación de altas/bajas en ipset: ventana en milisegundos desde la primera
+# operación pendiente (0 = sin agrupar) y máximo de operaciones por lote
+IPSET_BATCH_WINDOW_MS = float(os.getenv("IPSET_BATCH_WINDOW_MS", "5"))
+IPSET_BATCH_MAX = int(os.getenv("IPSET_BATCH_MAX", "64"))
+
+# Antigüedad máxima (segundos) de la instantánea del set 'authed' usada para
+# calcular el tiempo restante de cada IP
+IPSET_SNAPSHOT_MAX_AGE = float(os.getenv("IPSET_SNAPSHOT_MAX_AGE", "2"))
+
+# Segundos entre resincronizaciones de la tabla de sesiones con el set 'authed'
+# (recoge cambios externos y sesiones de otros procesos; 0 = desactivado)
+SESSION_RECONCILE_INTERVAL = float(os.getenv("SESSION_RECONCILE_INTERVAL", "30"))
+
+# Instantánea de las sesiones en disco (ver session_store): archivo (vacío =
+# desactivada) y segundos entre escrituras (0 = solo al parar). Al arrancar se
+# restauran en el set las sesiones que no han expirado.
+SESSIONS_FILE = os.getenv("SESSIONS_FILE", str(USERS_FILE.with_name("sessions.json"))).strip()
+SESSION_CHECKPOINT_INTERVAL = float(os.getenv("SESSION_CHECKPOINT_INTERVAL", "30"))
+
+# Eventos de estado (/status/events, Server-Sent Events): máximo de streams
+# abiertos por proceso (0 = desactivado; la página vuelve a consultar
+# /status.json), segundos entre heartbeats y aviso previo a la expiración
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "1000"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_WARNING_SECONDS = int(os.getenv("SSE_WARNING_SECONDS", "300"))
+
+# Límite de peticiones por IP (token bucket): peticiones por minuto y ráfaga
+# máxima de POST /login y GET /status.json (0 peticiones/min = sin límite),
+# y número máximo de IPs seguidas por proceso (LRU)
+LOGIN_RATE_LIMIT = float(os.getenv("LOGIN_RATE_LIMIT", "10"))
+LOGIN_RATE_BURST = int(os.getenv("LOGIN_RATE_BURST", "5"))
+STATUS_RATE_LIMIT = float(os.getenv("STATUS_RATE_LIMIT", "120"))
+STATUS_RATE_BURST = int(os.getenv("STATUS_RATE_BURST", "20"))
+RATE_LIMIT_TABLE_SIZE = int(os.getenv("RATE_LIMIT_TABLE_SIZE", "10000"))
+
+# Log de acceso (una línea JSON por petición, escrito por un hilo aparte):
+# activado, archivo (vacío = stdout), tamaño de rotación y copias, tamaño de
+# la cola (los registros que no caben se descartan) y muestreo de las
+# respuestas correctas por prefijo de ruta ("prefijo=fracción,...")
+ACCESS_LOG = os.getenv("ACCESS_LOG", "1").strip().lower() in ("1", "true", "yes")
+ACCESS_LOG_FILE = os.getenv("ACCESS_LOG_FILE", "").strip()
+ACCESS_LOG_MAX_BYTES = int(os.getenv("ACCESS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+ACCESS_LOG_BACKUPS = int(os.getenv("ACCESS_LOG_BACKUPS", "3"))
+ACCESS_LOG_QUEUE = int(os.getenv("ACCESS_LOG_QUEUE", "10000"))
+ACCESS_LOG_SAMPLE = os.getenv("ACCESS_LOG_SAMPLE", "/status.json=0.1,/static/=0.1")
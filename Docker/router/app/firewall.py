@@ -0,0 +1,108 @@
+# app/firewall.py
+"""
+Interfaz de los backends del set de IPs autenticadas.
+
+ipset_utils elige el backend con FIREWALL_BACKEND:
+    ipset   set 'authed' de ipset (netlink o binario ipset), con iptables
+    nft     set de nftables (ver nft_backend), con lotes atómicos
+    memory  en memoria, sin tocar el kernel (pruebas y benchmarks)
+y encima de él añade lo que es común: lotes (ipset_batch), instantánea
+del set (ipset_snapshot) y métricas.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from .ipset_batch import Op
+
+
+class FirewallBackend(ABC):
+    """
+    Operaciones sobre el set de IPs autenticadas. Los errores no se propagan:
+    add/remove devuelven False, test None y list_entries None (distinto de
+    un set vacío); ipset_utils los cuenta en las métricas. Un backend que
+    no implemente add/test/remove/list_entries falla al instanciarse.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def add(self, ip: str, timeout: int) -> bool:
+        """Añade ip con timeout segundos (si ya está, renueva el timeout)."""
+
+    @abstractmethod
+    def test(self, ip: str) -> Optional[bool]:
+        """True/False según si ip está en el set; None si no se pudo comprobar."""
+
+    @abstractmethod
+    def remove(self, ip: str) -> bool:
+        """Elimina ip; False si no estaba o hubo error."""
+
+    @abstractmethod
+    def list_entries(self) -> Optional[Dict[str, int]]:
+        """Contenido del set como {ip: segundos restantes}."""
+
+    def remaining(self, ip: str) -> int:
+        """Segundos restantes de ip (0 si no está). Hace un volcado completo: mejor usar la instantánea."""
+        entries = self.list_entries() or {}
+        return entries.get(ip, 0)
+
+    def apply_batch(self, ops: List[Op]) -> List[bool]:
+        """Aplica un lote de operaciones ("add"/"del", ip, timeout); un resultado por operación."""
+        return [self.add(ip, timeout) if kind == "add" else self.remove(ip) for kind, ip, timeout in ops]
+
+    def reset(self) -> None:
+        """
+        Cierra los sockets/contextos abiertos; se vuelven a abrir al usarse.
+        Se llama antes de un fork para que los hijos no compartan los del padre.
+        """
+
+
+class MemoryBackend(FirewallBackend):
+    """Set en memoria con expiración (pruebas, benchmarks, desarrollo sin privilegios)."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._entries: Dict[str, float] = {}  # ip -> monotonic de expiración
+        self._lock = threading.Lock()
+
+    def _alive(self, ip: str, now: float) -> bool:
+        expires = self._entries.get(ip)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._entries[ip]
+            return False
+        return True
+
+    def add(self, ip: str, timeout: int) -> bool:
+        with self._lock:
+            self._entries[ip] = time.monotonic() + timeout
+        return True
+
+    def test(self, ip: str) -> Optional[bool]:
+        with self._lock:
+            return self._alive(ip, time.monotonic())
+
+    def remove(self, ip: str) -> bool:
+        with self._lock:
+            alive = self._alive(ip, time.monotonic())
+            self._entries.pop(ip, None)
+        return alive
+
+    def list_entries(self) -> Optional[Dict[str, int]]:
+        now = time.monotonic()
+        with self._lock:
+            for ip in [ip for ip, exp in self._entries.items() if exp <= now]:
+                del self._entries[ip]
+            return {ip: int(exp - now) for ip, exp in self._entries.items()}
+
+    def remaining(self, ip: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if not self._alive(ip, now):
+                return 0
+            return int(self._entries[ip] - now)
@@ -0,0 +1,326 @@
+# app/http_parser.py
+"""
+Parser HTTP/1.1 incremental (solo librerías estándar).
+
+RequestParser lee de un socket con recv_into sobre un bytearray
+preasignado (sin concatenar bytes en cada lectura):
+- la búsqueda de \r\n\r\n continúa desde donde se quedó la anterior,
+  en lugar de reescanear todo el buffer tras cada recv;
+- los bytes sobrantes de una petición quedan en el buffer para la
+  siguiente (keep-alive / pipelining);
+- el body puede leerse completo o por trozos (iter_body) sin tenerlo
+  entero en memoria; read_request entrega un BodyStream en lugar de los
+  bytes para las rutas que procesan el body a medida que llega (subidas).
+"""
+
+import socket
+from typing import Callable, Iterator, Optional
+
+# Límites del parser
+MAX_HEADER_BYTES = 128 * 1024
+MAX_BODY_BYTES = 2 * 1024 * 1024
+
+_CRLF2 = b"\r\n\r\n"
+
+
+class Headers(dict):
+    """
+    dict de headers que conserva el nombre original de cada header pero
+    permite buscarlo sin distinguir mayúsculas (get("content-length")
+    encuentra "Content-Length"). El índice en minúsculas se construye una
+    sola vez, al parsear.
+    """
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._lower: dict[str, str] = {k.lower(): k for k in self}
+
+    def __setitem__(self, key: str, value: str):
+        super().__setitem__(key, value)
+        self._lower[key.lower()] = key
+
+    def _real_key(self, key: str):
+        if dict.__contains__(self, key):
+            return key
+        return self._lower.get(key.lower())
+
+    def __getitem__(self, key: str) -> str:
+        real = self._real_key(key)
+        if real is None:
+            raise KeyError(key)
+        return dict.__getitem__(self, real)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._real_key(key) is not None
+
+    def get(self, key: str, default=None):
+        real = self._real_key(key)
+        if real is None:
+            return default
+        return dict.__getitem__(self, real)
+
+
+def parse_request_head(head: bytes) -> tuple[str, str, str, Headers]:
+    """
+    Parsea la request line y los headers (sin el \r\n\r\n final).
+    Devuelve: (method, path, version, headers)
+    """
+    lines = bytes(head).split(b"\r\n")
+    if not lines:
+        raise ValueError("empty request")
+
+    # Request line: METHOD SP PATH SP HTTP/1.1
+    req_line = lines[0].decode("iso-8859-1", errors="replace")
+    parts = req_line.split()
+    if len(parts) < 2:
+        raise ValueError("bad request line")
+
+    method = parts[0].upper()
+    path = parts[1]
+    version = parts[2].upper() if len(parts) > 2 else "HTTP/1.0"
+
+    pairs = []
+    for ln in lines[1:]:
+        s = ln.decode("iso-8859-1", errors="replace")
+        if ":" in s:
+            k, v = s.split(":", 1)
+            pairs.append((k.strip(), v.strip()))
+
+    return method, path, version, Headers(pairs)
+
+
+def wants_keep_alive(version: str, headers: dict) -> bool:
+    """
+    ¿El cliente acepta reutilizar la conexión?
+    HTTP/1.1 es persistente salvo "Connection: close";
+    HTTP/1.0 solo si pide "Connection: keep-alive".
+    """
+    conn = headers.get("Connection") or headers.get("connection") or ""
+    tokens = {t.strip().lower() for t in conn.split(",")}
+    if version == "HTTP/1.1":
+        return "close" not in tokens
+    return "keep-alive" in tokens
+
+
+def content_length(headers: dict, max_bytes: int = MAX_BODY_BYTES) -> int:
+    """
+    Devuelve el Content-Length validado (0 si no viene). Las peticiones con
+    Transfer-Encoding se rechazan (411): no se decodifica chunked, y sin
+    esto sus chunks se leerían como la siguiente petición del keep-alive.
+    """
+    if headers.get("Transfer-Encoding") or headers.get("transfer-encoding"):
+        raise ValueError("length required")
+    value = headers.get("Content-Length") or headers.get("content-length")
+    if not value:
+        return 0
+    try:
+        n = int(value)
+    except ValueError:
+        raise ValueError("bad content-length")
+    if n < 0:
+        raise ValueError("bad content-length")
+    if n > max_bytes:
+        # evita DoS tonto
+        raise ValueError("payload too large")
+    return n
+
+
+# (method, path) -> tamaño máximo del body si la ruta lo lee por trozos
+# (BodyStream), o None para leerlo completo (hasta MAX_BODY_BYTES)
+StreamedBody = Callable[[str, str], Optional[int]]
+
+
+class BodyStream:
+    """
+    Body de una petición que el handler lee por trozos, a medida que llega
+    (iterando: memoryviews válidas hasta el siguiente trozo). remaining
+    son los bytes aún sin leer: si el handler no lo consume entero, la
+    conexión no puede reutilizarse.
+    """
+
+    def __init__(self, chunks: Iterator[memoryview], length: int):
+        self._chunks = chunks
+        self.length = length
+        self.remaining = length
+
+    def __iter__(self) -> Iterator[memoryview]:
+        for chunk in self._chunks:
+            self.remaining -= len(chunk)
+            yield chunk
+
+
+class RequestParser:
+    """
+    Lee peticiones HTTP sucesivas de un mismo socket.
+
+    El buffer es un bytearray preasignado; los datos válidos están en
+    [_start, _end) y _scan marca hasta dónde ya se buscó el fin de headers.
+    Tras cada petición los bytes sobrantes se quedan en el buffer.
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = 8 * 1024, max_header: int = MAX_HEADER_BYTES):
+        self.sock = sock
+        self.requests = 0
+        self.max_header = max_header
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._scan = 0
+
+    # -- buffer --------------------------------------------------------
+
+    def has_buffered(self) -> bool:
+        """True si ya hay bytes de la siguiente petición en el buffer."""
+        return self._end > self._start
+
+    def _fill(self) -> int:
+        """recv_into al final del buffer; compacta o crece si no hay sitio."""
+        if self._end == len(self._buf):
+            pending = self._end - self._start
+            if self._start > 0:
+                # Compactar: mover los datos pendientes al principio
+                # (copia intermedia: origen y destino pueden solaparse)
+                self._buf[:pending] = bytes(self._view[self._start:self._end])
+                self._scan -= self._start
+                self._start, self._end = 0, pending
+            else:
+                # Buffer lleno con una sola cabecera: duplicar (acotado por max_header)
+                self._view.release()
+                self._buf.extend(bytes(len(self._buf)))
+                self._view = memoryview(self._buf)
+        n = self.sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    # -- cabeceras -----------------------------------------------------
+
+    def read_head(self) -> tuple[str, str, str, Headers] | None:
+        """
+        Lee y parsea la request line + headers de la siguiente petición.
+        Devuelve None si el cliente cerró la conexión limpiamente entre peticiones.
+        """
+        buf = self._buf
+        while True:
+            # RFC 9112: se ignoran líneas vacías antes de la request line
+            while self._start < self._end and buf[self._start] in (13, 10):
+                self._start += 1
+            self._scan = max(self._scan, self._start)
+
+            idx = buf.find(_CRLF2, self._scan, self._end)
+            if idx >= 0:
+                break
+            # Reanudar la búsqueda sin perder un \r\n\r\n partido entre lecturas
+            self._scan = max(self._start, self._end - 3)
+            if self._end - self._start > self.max_header:
+                raise ValueError("header too large")
+            if self._fill() == 0:
+                if self._end == self._start:
+                    return None
+                raise ValueError("incomplete headers")
+            buf = self._buf
+
+        if idx - self._start > self.max_header:
+            raise ValueError("header too large")
+        head = self._view[self._start:idx]
+        self._start = idx + 4
+        self._scan = self._start
+        try:
+            return parse_request_head(head)
+        finally:
+            head.release()
+
+    # -- body ----------------------------------------------------------
+
+    def iter_body(self, n: int, chunk_size: int = 64 * 1024) -> Iterator[memoryview]:
+        """
+        Entrega el body de n bytes por trozos (memoryview de solo lectura
+        válida hasta el siguiente trozo). Primero lo que ya está en el
+        buffer; luego recv_into directamente sobre el buffer.
+        """
+        remaining = n
+        while remaining > 0:
+            if self._end == self._start:
+                self._start = self._end = self._scan = 0
+                want = min(len(self._buf), chunk_size, remaining)
+                got = self.sock.recv_into(self._view[:want])
+                if got == 0:
+                    raise ValueError("incomplete body")
+                self._end = got
+            take = min(self._end - self._start, remaining, chunk_size)
+            chunk = self._view[self._start:self._start + take].toreadonly()
+            self._start += take
+            self._scan = self._start
+            remaining -= take
+            yield chunk
+
+    def read_body(self, n: int) -> bytes | bytearray:
+        """
+        Lee el body completo de n bytes. Se preasigna un bytearray de n
+        bytes y se rellena con recv_into (sin concatenaciones); si el body
+        ya está en el buffer se devuelve una única copia en bytes.
+        Como el parser original, si el cliente cierra antes se devuelve
+        lo recibido.
+        """
+        if n <= 0:
+            return b""
+        buffered = self._end - self._start
+        if buffered >= n:
+            body = bytes(self._view[self._start:self._start + n])
+            self._start += n
+            self._scan = self._start
+            return body
+
+        body = bytearray(n)
+        out = memoryview(body)
+        out[:buffered] = self._view[self._start:self._end]
+        self._start = self._end = self._scan = 0
+        got = buffered
+        while got < n:
+            r = self.sock.recv_into(out[got:])
+            if r == 0:
+                break
+            got += r
+        out.release()
+        if got < n:
+            del body[got:]
+        return body
+
+    # -- petición completa ----------------------------------------------
+
+    def read_request(self, streamed: StreamedBody | None = None) -> tuple[str, str, str, Headers, "bytes | BodyStream"] | None:
+        """
+        Lee la siguiente petición completa.
+        Devuelve (method, path, version, headers, body), o None si el
+        cliente cerró la conexión limpiamente entre peticiones. Si
+        streamed(method, path) devuelve un límite, body es un BodyStream
+        que se lee después, desde el handler.
+        """
+        head = self.read_head()
+        if head is None:
+            return None
+        method, path, version, headers = head
+        limit = streamed(method, path.split("?", 1)[0]) if streamed is not None else None
+        if limit is None:
+            body = self.read_body(content_length(headers))
+        else:
+            n = content_length(headers, limit)
+            body = BodyStream(self.iter_body(n), n)
+        self.requests += 1
+        return method, path, version, headers, body
+
+
+def parse_http_request(sock: socket.socket) -> tuple[str, str, dict, bytes]:
+    """
+    Parseo de una única petición:
+    - Lee headers hasta \r\n\r\n
+    - Parsea request line
+    - Parsea headers
+    - Si hay Content-Length, lee el body completo
+    Devuelve: (method, path, headers_dict, body_bytes)
+    """
+    req = RequestParser(sock).read_request()
+    if req is None:
+        raise ValueError("incomplete headers")
+    method, path, _, headers, body = req
+    return method, path, headers, body
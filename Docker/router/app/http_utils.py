@@ -0,0 +1,285 @@
+# app/http_utils.py
+"""
+Utilidades HTTP manuales compartidas por los distintos modos de servidor
+(pool de hilos y bucle de eventos). Solo librerías estándar.
+El parseo de peticiones está en http_parser.
+"""
+
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qs
+
+
+def log(msg: str) -> None:
+    print(msg, flush=True)
+
+
+# ----------------------------
+# Respuestas
+# ----------------------------
+
+_REASON = {
+    200: "OK",
+    204: "No Content",
+    206: "Partial Content",
+    302: "Found",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
+    422: "Unprocessable Content",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def _reason(status: int) -> str:
+    return _REASON.get(status, "OK")
+
+
+def _http_date_stub() -> str:
+    # Opcional (no obligatorio). Para tu caso podemos omitir Date.
+    return ""
+
+
+def build_response(status: int, headers: dict | None, body: bytes | None) -> bytes:
+    headers = dict(headers or {})
+    if body is None:
+        body = b""
+
+    # Si no hay Content-Type y hay body, ponemos text/html por defecto
+    if body and not any(k.lower() == "content-type" for k in headers.keys()):
+        headers["Content-Type"] = "text/html; charset=utf-8"
+
+    if status != 304:
+        # 304 no lleva body ni describe su longitud
+        headers["Content-Length"] = str(len(body))
+    # El header Connection lo decide el servidor (keep-alive o close),
+    # ver set_connection_header.
+
+    status_line = f"HTTP/1.1 {status} {_reason(status)}\r\n"
+    head = status_line + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return head.encode("utf-8") + body
+
+
+class FileResponse:
+    """
+    Respuesta cuyo body es un rango de un archivo en disco: el servidor
+    envía head (status line + headers) y después el archivo con sendfile,
+    sin leerlo a memoria.
+    """
+
+    __slots__ = ("head", "path", "offset", "count")
+
+    def __init__(self, head: bytes, path, offset: int, count: int):
+        self.head = head
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+
+def build_file_response(status: int, headers: dict | None, path, offset: int, count: int) -> FileResponse:
+    """Como build_response, pero el body (count bytes de path desde offset) se envía con sendfile."""
+    headers = dict(headers or {})
+    headers["Content-Length"] = str(count)
+    status_line = f"HTTP/1.1 {status} {_reason(status)}\r\n"
+    head = status_line + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return FileResponse(head.encode("utf-8"), path, offset, count)
+
+
+class StreamResponse:
+    """
+    Respuesta sin longitud que sigue abierta tras enviarse (text/event-stream).
+    El servidor envía head + first y después entrega la conexión:
+      - pool de hilos: attach(sock) recibe un duplicado del socket y el
+        worker queda libre;
+      - asyncio: se espera serve_async(reader, writer) hasta que termine.
+    head lleva "Connection: close": la conexión no vuelve al keep-alive.
+    """
+
+    __slots__ = ("head", "first", "attach", "serve_async")
+
+    def __init__(self, head: bytes, first: bytes, attach, serve_async):
+        self.head = head
+        self.first = first
+        self.attach = attach
+        self.serve_async = serve_async
+
+
+class ChunkedResponse:
+    """
+    Respuesta cuyo body genera un iterador de bytes a medida que se envía
+    (Transfer-Encoding: chunked), sin construirlo entero en memoria. Si el
+    iterador falla a medias la conexión se cierra sin el chunk final, y el
+    cliente ve la respuesta incompleta.
+    """
+
+    __slots__ = ("head", "chunks")
+
+    def __init__(self, head: bytes, chunks):
+        self.head = head
+        self.chunks = chunks
+
+
+def build_chunked_response(status: int, headers: dict | None, chunks) -> ChunkedResponse:
+    """Como build_response, pero el body son los bytes que va entregando chunks."""
+    headers = dict(headers or {})
+    headers["Transfer-Encoding"] = "chunked"
+    status_line = f"HTTP/1.1 {status} {_reason(status)}\r\n"
+    head = status_line + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    return ChunkedResponse(head.encode("utf-8"), chunks)
+
+
+def encode_chunk(data: bytes) -> bytes:
+    """Un chunk de Transfer-Encoding: chunked (vacío = chunk final)."""
+    return b"%x\r\n" % len(data) + data + b"\r\n"
+
+
+def send_response(sock, resp: "bytes | FileResponse | StreamResponse | ChunkedResponse") -> None:
+    """Envía una respuesta (bytes, FileResponse, StreamResponse o ChunkedResponse) por un socket bloqueante."""
+    if isinstance(resp, ChunkedResponse):
+        sock.sendall(resp.head)
+        for data in resp.chunks:
+            if data:
+                sock.sendall(encode_chunk(data))
+        sock.sendall(encode_chunk(b""))
+        return
+    if isinstance(resp, StreamResponse):
+        sock.sendall(resp.head + resp.first)
+        resp.attach(sock.dup())
+        return
+    if isinstance(resp, FileResponse):
+        sock.sendall(resp.head)
+        if resp.count:
+            with open(resp.path, "rb") as f:
+                sock.sendfile(f, resp.offset, resp.count)
+        return
+    sock.sendall(resp)
+
+
+def head_only(resp: "bytes | FileResponse | StreamResponse | ChunkedResponse") -> bytes:
+    """Status line + headers de una respuesta, sin body (para HEAD)."""
+    if isinstance(resp, (FileResponse, StreamResponse, ChunkedResponse)):
+        return resp.head
+    end = resp.find(b"\r\n\r\n")
+    return resp if end < 0 else resp[:end + 4]
+
+
+def set_connection_header(resp: "bytes | FileResponse | StreamResponse | ChunkedResponse", keep_alive: bool) -> "bytes | FileResponse | StreamResponse | ChunkedResponse":
+    """
+    Añade el header Connection a una respuesta ya construida, salvo que
+    el handler lo haya fijado explícitamente.
+    """
+    if isinstance(resp, StreamResponse):
+        return resp  # siempre "Connection: close"
+    if isinstance(resp, FileResponse):
+        return FileResponse(set_connection_header(resp.head, keep_alive), resp.path, resp.offset, resp.count)
+    if isinstance(resp, ChunkedResponse):
+        return ChunkedResponse(set_connection_header(resp.head, keep_alive), resp.chunks)
+    end = resp.find(b"\r\n\r\n")
+    if end < 0:
+        return resp
+    if b"\r\nconnection:" in resp[:end].lower():
+        return resp
+    value = b"keep-alive" if keep_alive else b"close"
+    return resp[:end] + b"\r\nConnection: " + value + resp[end:]
+
+
+def make_etag(data: bytes) -> str:
+    """ETag fuerte (entre comillas) derivado del contenido."""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """True si el header If-None-Match incluye etag (comparación débil, RFC 9110)."""
+    if not if_none_match:
+        return False
+    value = if_none_match.strip()
+    if value == "*":
+        return True
+    tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in value.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def http_date(timestamp: float) -> str:
+    """Fecha HTTP (IMF-fixdate) de un timestamp Unix."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: str | None) -> float | None:
+    """Timestamp Unix de una fecha HTTP, o None si falta o es inválida."""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def accepts_encoding(accept_encoding: str | None, coding: str) -> bool:
+    """True si el header Accept-Encoding acepta coding (con q > 0, o vía "*")."""
+    if not accept_encoding:
+        return False
+    star = False
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name == coding:
+            return q > 0
+        if name == "*":
+            star = q > 0
+    return star
+
+
+def error_response(exc: Exception) -> bytes:
+    """
+    Traduce un error de parseo (ValueError) a la respuesta HTTP adecuada.
+    Cualquier otra excepción se considera error interno.
+    """
+    if isinstance(exc, ValueError):
+        # headers demasiado grandes / malformado / payload grande
+        if "payload too large" in str(exc):
+            return build_response(413, {}, b"Payload Too Large")
+        if "length required" in str(exc):
+            return build_response(411, {}, b"Length Required")
+        return build_response(400, {}, b"Bad Request")
+    return build_response(500, {}, b"Internal Server Error")
+
+
+# ----------------------------
+# Peticiones
+# ----------------------------
+
+def client_ip_from_headers(headers: dict, peer_ip: str) -> str:
+    # Si viene de nginx, usa X-Real-IP / X-Forwarded-For; si no, peer_ip
+    real_ip = headers.get("X-Real-IP") or headers.get("x-real-ip")
+    if real_ip:
+        return real_ip.strip()
+    fwd = headers.get("X-Forwarded-For") or headers.get("x-forwarded-for")
+    if fwd:
+        return fwd.split(",")[0].strip()
+    return peer_ip
+
+
+def parse_form_urlencoded(body: bytes) -> dict:
+    # body: b"username=...&password=..."
+    raw = body.decode("utf-8", errors="ignore")
+    return parse_qs(raw)
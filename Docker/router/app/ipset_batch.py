@@ -0,0 +1,125 @@
+# app/ipset_batch.py
+"""
+Agrupación de altas/bajas en el ipset.
+
+En un pico de logins cada petición hacía su propia operación ipset. El
+IpsetBatcher junta las operaciones que llegan en una ventana corta
+(window segundos desde la primera, o max_ops) y las aplica de una vez con
+apply_fn; cada petición espera solo el resultado de su operación.
+
+apply_fn recibe la lista de (tipo, ip, timeout) y devuelve un bool por
+operación. stats() da tamaños de lote y latencias recientes para ajustar
+la ventana.
+"""
+
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional, Tuple
+
+Op = Tuple[str, str, Optional[int]]  # ("add" | "del", ip, timeout)
+
+
+class _Pending:
+    __slots__ = ("op", "queued", "done", "ok")
+
+    def __init__(self, op: Op):
+        self.op = op
+        self.queued = time.monotonic()
+        self.done = threading.Event()
+        self.ok = False
+
+
+class IpsetBatcher:
+    def __init__(self, apply_fn: Callable[[List[Op]], List[bool]], *, window: float, max_ops: int,
+                 samples: int = 1024):
+        self.apply_fn = apply_fn
+        self.window = window
+        self.max_ops = max(1, max_ops)
+        self._queue: List[_Pending] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._ops = 0
+        self._failed = 0
+        self._batch_sizes: deque = deque(maxlen=samples)
+        self._latencies: deque = deque(maxlen=samples)   # cola + aplicación, por operación
+        self._apply_times: deque = deque(maxlen=samples)  # aplicación, por lote
+
+    def _ensure_thread(self) -> None:
+        # Se arranca en el primer uso: en modo pre-fork, dentro de cada hijo
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="ipset-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, kind: str, ip: str, timeout: Optional[int] = None, wait: float = 10.0) -> bool:
+        """Encola la operación y espera su resultado (False si no llega en wait segundos)."""
+        pending = _Pending((kind, ip, timeout))
+        with self._cond:
+            self._ensure_thread()
+            self._queue.append(pending)
+            self._cond.notify()
+        if not pending.done.wait(wait):
+            print(f"Timeout esperando el lote ipset para {kind} {ip}")
+            return False
+        return pending.ok
+
+    def _take_batch(self) -> List[_Pending]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0].queued + self.window
+            while len(self._queue) < self.max_ops:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_ops]
+            del self._queue[:self.max_ops]
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take_batch()
+            t0 = time.monotonic()
+            try:
+                results = self.apply_fn([p.op for p in batch])
+            except Exception as e:
+                print(f"Error aplicando lote ipset: {e}")
+                results = [False] * len(batch)
+            now = time.monotonic()
+            for p, ok in zip(batch, results):
+                p.ok = ok
+                p.done.set()
+            with self._stats_lock:
+                self._batches += 1
+                self._ops += len(batch)
+                self._failed += sum(1 for ok in results if not ok)
+                self._batch_sizes.append(len(batch))
+                self._apply_times.append(now - t0)
+                self._latencies.extend(now - p.queued for p in batch)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            lat = sorted(self._latencies)
+            apply_times = list(self._apply_times)
+            out = {
+                "batches": self._batches,
+                "ops": self._ops,
+                "failed": self._failed,
+                "window_ms": self.window * 1000,
+                "max_ops": self.max_ops,
+            }
+        if sizes:
+            out["batch_size_avg"] = round(statistics.fmean(sizes), 2)
+            out["batch_size_max"] = max(sizes)
+            out["apply_ms_avg"] = round(statistics.fmean(apply_times) * 1000, 3)
+        if lat:
+            out["latency_ms_p50"] = round(lat[len(lat) // 2] * 1000, 3)
+            out["latency_ms_p95"] = round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000, 3)
+            out["latency_ms_max"] = round(lat[-1] * 1000, 3)
+        return out
@@ -0,0 +1,283 @@
+# app/ipset_netlink.py
+"""
+Cliente ipset en Python puro sobre netlink (NFNL_SUBSYS_IPSET).
+
+Habla directamente con el kernel por un socket AF_NETLINK/NETLINK_NETFILTER
+en lugar de hacer fork/exec del binario ipset en cada operación. Solo cubre
+lo que usa el portal: add/del/test de una IPv4 (con timeout) y el listado
+de un set para leer el tiempo restante de cada entrada.
+
+Requiere CAP_NET_ADMIN (root en el contenedor). ipset_utils lo usa como
+backend preferente y cae al binario ipset si no está disponible.
+"""
+
+import socket
+import struct
+import threading
+
+# Netlink
+NETLINK_NETFILTER = 12
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_EXCL = 0x200
+NLM_F_DUMP = 0x300
+NLA_F_NESTED = 0x8000
+NLA_F_NET_BYTEORDER = 0x4000
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER) & 0xFFFF
+
+# nfnetlink / ipset (linux/netfilter/ipset/ip_set.h)
+NFNL_SUBSYS_IPSET = 6
+IPSET_PROTOCOL = 6
+
+IPSET_CMD_LIST = 7
+IPSET_CMD_ADD = 9
+IPSET_CMD_DEL = 10
+IPSET_CMD_TEST = 11
+
+IPSET_ATTR_PROTOCOL = 1
+IPSET_ATTR_SETNAME = 2
+IPSET_ATTR_DATA = 7
+IPSET_ATTR_ADT = 8
+
+IPSET_ATTR_IP = 1
+IPSET_ATTR_TIMEOUT = 6
+IPSET_ATTR_IPADDR_IPV4 = 1
+
+IPSET_ERR_EXIST = 4103  # el elemento no está (test/del) o ya está (add sin -exist)
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_NLATTR = struct.Struct("=HH")
+_NFGENMSG = struct.pack("=BBH", socket.AF_INET, 0, 0)
+
+
+class IpsetNetlinkError(OSError):
+    """Error devuelto por el kernel (errno positivo) para una operación ipset."""
+
+
+# ----------------------------
+# Codificación de atributos
+# ----------------------------
+
+def nl_attr(atype: int, payload: bytes) -> bytes:
+    length = _NLATTR.size + len(payload)
+    return _NLATTR.pack(length, atype) + payload + b"\0" * (-length % 4)
+
+
+def nl_nested(atype: int, *children: bytes) -> bytes:
+    return nl_attr(atype | NLA_F_NESTED, b"".join(children))
+
+
+def ip_attr(ip: str) -> bytes:
+    return nl_nested(IPSET_ATTR_IP, nl_attr(IPSET_ATTR_IPADDR_IPV4 | NLA_F_NET_BYTEORDER, socket.inet_aton(ip)))
+
+
+def timeout_attr(seconds: int) -> bytes:
+    return nl_attr(IPSET_ATTR_TIMEOUT | NLA_F_NET_BYTEORDER, struct.pack(">I", seconds))
+
+
+def setname_attr(name: str) -> bytes:
+    return nl_attr(IPSET_ATTR_SETNAME, name.encode("ascii") + b"\0")
+
+
+def build_message(cmd: int, flags: int, seq: int, attrs: bytes) -> bytes:
+    """Mensaje nfnetlink de ipset: nlmsghdr + nfgenmsg + IPSET_ATTR_PROTOCOL + attrs."""
+    payload = _NFGENMSG + nl_attr(IPSET_ATTR_PROTOCOL, bytes([IPSET_PROTOCOL])) + attrs
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), (NFNL_SUBSYS_IPSET << 8) | cmd, flags, seq, 0) + payload
+
+
+def parse_attrs(data: bytes, offset: int = 0, end: int | None = None) -> dict[int, list[bytes]]:
+    """Atributos netlink en [offset, end) → {tipo: [payloads]} (tipo sin flags)."""
+    end = len(data) if end is None else end
+    out: dict[int, list[bytes]] = {}
+    while offset + _NLATTR.size <= end:
+        length, atype = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        out.setdefault(atype & NLA_TYPE_MASK, []).append(data[offset + _NLATTR.size:offset + length])
+        offset += (length + 3) & ~3
+    return out
+
+
+def iter_messages(data: bytes):
+    """Itera (tipo, flags, seq, payload) de un datagrama netlink."""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, mtype, flags, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield mtype, flags, seq, data[offset + _NLMSGHDR.size:offset + length]
+        offset += (length + 3) & ~3
+
+
+def parse_list_entries(payload: bytes) -> dict[str, int]:
+    """De un mensaje IPSET_CMD_LIST, {ip: timeout restante} de sus entradas."""
+    entries: dict[str, int] = {}
+    attrs = parse_attrs(payload, 4)  # saltar nfgenmsg
+    for adt in attrs.get(IPSET_ATTR_ADT, []):
+        for data in parse_attrs(adt).get(IPSET_ATTR_DATA, []):
+            elem = parse_attrs(data)
+            ip_nested = elem.get(IPSET_ATTR_IP)
+            if not ip_nested:
+                continue
+            ipv4 = parse_attrs(ip_nested[0]).get(IPSET_ATTR_IPADDR_IPV4)
+            if not ipv4:
+                continue
+            timeout = 0
+            if IPSET_ATTR_TIMEOUT in elem:
+                timeout = struct.unpack(">I", elem[IPSET_ATTR_TIMEOUT][0])[0]
+            entries[socket.inet_ntoa(ipv4[0])] = timeout
+    return entries
+
+
+# ----------------------------
+# Cliente
+# ----------------------------
+
+def _default_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER)
+    sock.bind((0, 0))
+    return sock
+
+
+class IpsetNetlink:
+    """
+    Cliente netlink de ipset. Usa un socket por hilo (sin lock global entre
+    workers). sock_factory permite inyectar otro socket (p. ej. el kernel
+    falso de bench/fake_netlink.py para probar sin root).
+    """
+
+    def __init__(self, sock_factory=_default_socket, timeout: float = 2.0):
+        self._sock_factory = sock_factory
+        self._timeout = timeout
+        self._local = threading.local()
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._sock_factory()
+            sock.settimeout(self._timeout)
+            self._local.sock = sock
+        return sock
+
+    def close(self) -> None:
+        """Cierra el socket de este hilo (el siguiente uso abre otro)."""
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.sock = None
+            sock.close()
+
+    def _next_seq(self) -> int:
+        with self._seq_lock:
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            return self._seq
+
+    def _request(self, cmd: int, flags: int, attrs: bytes) -> list[bytes]:
+        """
+        Envía un mensaje y recoge la respuesta. Devuelve los payloads de los
+        mensajes de datos (dump); lanza IpsetNetlinkError si el kernel
+        devuelve error.
+        """
+        sock = self._socket()
+        seq = self._next_seq()
+        try:
+            sock.send(build_message(cmd, flags, seq, attrs))
+            results: list[bytes] = []
+            while True:
+                data = sock.recv(65536)
+                for mtype, _, mseq, payload in iter_messages(data):
+                    if mseq != seq:
+                        continue  # respuesta atrasada de otra operación
+                    if mtype == NLMSG_ERROR:
+                        err = -struct.unpack_from("=i", payload)[0]
+                        if err:
+                            raise IpsetNetlinkError(err, f"ipset netlink error {err}")
+                        return results  # ACK
+                    if mtype == NLMSG_DONE:
+                        return results
+                    results.append(payload)
+        except (OSError, struct.error):
+            # Socket en estado desconocido: se recrea en la próxima llamada
+            self._local.sock = None
+            try:
+                sock.close()
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _add_args(setname: str, ip: str, timeout: int | None, exist_ok: bool) -> tuple[int, int, bytes]:
+        data = ip_attr(ip) + (timeout_attr(timeout) if timeout is not None else b"")
+        flags = NLM_F_REQUEST | NLM_F_ACK | (0 if exist_ok else NLM_F_EXCL)
+        return IPSET_CMD_ADD, flags, setname_attr(setname) + nl_nested(IPSET_ATTR_DATA, data)
+
+    @staticmethod
+    def _del_args(setname: str, ip: str) -> tuple[int, int, bytes]:
+        return (
+            IPSET_CMD_DEL, NLM_F_REQUEST | NLM_F_ACK | NLM_F_EXCL,
+            setname_attr(setname) + nl_nested(IPSET_ATTR_DATA, ip_attr(ip)),
+        )
+
+    def add(self, setname: str, ip: str, timeout: int | None = None, exist_ok: bool = True) -> None:
+        self._request(*self._add_args(setname, ip, timeout, exist_ok))
+
+    def delete(self, setname: str, ip: str) -> None:
+        self._request(*self._del_args(setname, ip))
+
+    def batch(self, setname: str, ops: list[tuple[str, str, int | None]]) -> list[int]:
+        """
+        Aplica varias altas/bajas en un único send: ops es una lista de
+        ("add" | "del", ip, timeout). Cada mensaje lleva su propio ACK, así
+        que devuelve el errno de cada operación (0 = correcta). Lanza
+        OSError si falla el socket.
+        """
+        sock = self._socket()
+        seqs: dict[int, int] = {}
+        parts = []
+        for i, (kind, ip, timeout) in enumerate(ops):
+            args = self._add_args(setname, ip, timeout, True) if kind == "add" else self._del_args(setname, ip)
+            seq = self._next_seq()
+            seqs[seq] = i
+            parts.append(build_message(*args[:2], seq, args[2]))
+        results = [-1] * len(ops)
+        pending = len(ops)
+        try:
+            sock.send(b"".join(parts))
+            while pending:
+                data = sock.recv(65536)
+                for mtype, _, mseq, payload in iter_messages(data):
+                    i = seqs.get(mseq)
+                    if i is None or mtype != NLMSG_ERROR or results[i] != -1:
+                        continue
+                    results[i] = -struct.unpack_from("=i", payload)[0]
+                    pending -= 1
+        except (OSError, struct.error):
+            self._local.sock = None
+            try:
+                sock.close()
+            except OSError:
+                pass
+            raise
+        return results
+
+    def test(self, setname: str, ip: str) -> bool:
+        try:
+            self._request(
+                IPSET_CMD_TEST, NLM_F_REQUEST | NLM_F_ACK,
+                setname_attr(setname) + nl_nested(IPSET_ATTR_DATA, ip_attr(ip)),
+            )
+            return True
+        except IpsetNetlinkError as e:
+            if e.errno == IPSET_ERR_EXIST:
+                return False
+            raise
+
+    def list_entries(self, setname: str) -> dict[str, int]:
+        """{ip: segundos restantes} de todas las entradas del set."""
+        entries: dict[str, int] = {}
+        for payload in self._request(IPSET_CMD_LIST, NLM_F_REQUEST | NLM_F_DUMP, setname_attr(setname)):
+            entries.update(parse_list_entries(payload))
+        return entries
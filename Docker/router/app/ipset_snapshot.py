@@ -0,0 +1,106 @@
+# app/ipset_snapshot.py
+"""
+Instantánea indexada del set 'authed': {ip: expiración}.
+
+Leer el set completo cuesta O(tamaño del set) (un dump netlink o un
+`ipset save`). IpsetSnapshot lo lee como mucho una vez cada max_age
+segundos aunque lo necesiten muchas peticiones a la vez (single-flight:
+una sola lectura en curso, el resto espera y reutiliza su resultado) y
+responde por IP exacta en O(1).
+
+Las expiraciones se guardan como instante time.monotonic(), así que el
+tiempo restante sigue siendo correcto aunque la instantánea tenga unos
+segundos. Las altas y bajas hechas por este proceso se anotan al momento
+(note_add/note_remove); las de otros procesos se ven en la siguiente
+lectura.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class IpsetSnapshot:
+    def __init__(self, load_fn: Callable[[], Optional[Dict[str, int]]], max_age: float):
+        self.load_fn = load_fn
+        self.max_age = max_age
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._entries: Dict[str, float] = {}
+        self._notes: Optional[Dict[str, Optional[float]]] = None  # anotaciones durante una lectura
+        self._taken = float("-inf")
+        self._generation = 0
+        self._last_ok = True  # resultado de la última lectura (para quien la esperó)
+        self.refreshes = 0
+        self.failures = 0
+
+    def _refresh(self, generation: int) -> bool:
+        """
+        Relee el set salvo que otra lectura haya terminado desde que se vio
+        generation (en ese caso se devuelve su resultado). Devuelve False
+        si la lectura falló; se conserva la instantánea anterior.
+        """
+        with self._refresh_lock:
+            if self._generation != generation:
+                return self._last_ok
+            with self._lock:
+                self._notes = {}
+            started = time.monotonic()
+            entries = self.load_fn()
+            with self._lock:
+                notes, self._notes = self._notes, None
+                self._taken = started  # también en error: no reintentar hasta max_age
+                self._generation += 1
+                self._last_ok = entries is not None
+                if entries is None:
+                    self.failures += 1
+                    return False
+                new = {ip: started + remaining for ip, remaining in entries.items()}
+                # Altas/bajas de este proceso posteriores al inicio de la lectura
+                for ip, expires in notes.items():
+                    if expires is None:
+                        new.pop(ip, None)
+                    else:
+                        new[ip] = expires
+                self._entries = new
+                self.refreshes += 1
+            return True
+
+    def _current(self) -> Dict[str, float]:
+        if time.monotonic() - self._taken > self.max_age:
+            self._refresh(self._generation)
+        return self._entries
+
+    def remaining(self, ip: str) -> Optional[int]:
+        """Segundos restantes de ip, o None si no está en la instantánea."""
+        expires = self._current().get(ip)
+        if expires is None:
+            return None
+        return max(0, int(expires - time.monotonic()))
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self._current()
+
+    def note_add(self, ip: str, timeout: int) -> None:
+        expires = time.monotonic() + timeout
+        with self._lock:
+            self._entries[ip] = expires
+            if self._notes is not None:
+                self._notes[ip] = expires
+
+    def note_remove(self, ip: str) -> None:
+        with self._lock:
+            self._entries.pop(ip, None)
+            if self._notes is not None:
+                self._notes[ip] = None
+
+    def refresh(self) -> Optional[Dict[str, int]]:
+        """
+        Fuerza una lectura (compartida con las que estén en curso) y
+        devuelve el set como {ip: segundos restantes}, o None si falló.
+        """
+        if not self._refresh(self._generation):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            return {ip: max(0, int(exp - now)) for ip, exp in self._entries.items()}
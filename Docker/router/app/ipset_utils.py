@@ -1,12 +1,105 @@
 # app/ipset_utils.py
+"""
+Operaciones sobre el set 'authed' de IPs autenticadas.
+
+El set lo gestiona el backend de FIREWALL_BACKEND (ver firewall):
+    ipset   IpsetBackend, definido aquí
+    nft     NftBackend (ver nft_backend)
+    memory  MemoryBackend, sin tocar el kernel
+Este módulo mantiene la API de siempre (add_to_ipset, check_ipset, ...)
+encima del backend, con los lotes, la instantánea y las métricas.
+
+Con el backend ipset se habla con el kernel por netlink (ver
+ipset_netlink), sin fork/exec por petición. Si netlink no está disponible
+(sin CAP_NET_ADMIN, kernel sin nfnetlink ipset, IPSET_BACKEND=subprocess)
+o una operación netlink falla de forma inesperada, se usa el binario ipset
+como antes.
+
+Con IPSET_BATCH_WINDOW_MS > 0 las altas y bajas se agrupan en lotes
+(ver ipset_batch): un único send netlink, una única llamada a
+`ipset restore` o una única transacción nft por lote.
+"""
+
+import re
 import subprocess
-from .config import AUTH_TIMEOUT
+import threading
+from typing import Dict, List, Optional
 
-def add_to_ipset(ip: str) -> bool:
-    """Añade la IP al conjunto 'authed' con timeout."""
+from .config import (
+    AUTH_TIMEOUT,
+    FIREWALL_BACKEND,
+    IPSET_BACKEND,
+    IPSET_BATCH_MAX,
+    IPSET_BATCH_WINDOW_MS,
+    IPSET_SNAPSHOT_MAX_AGE,
+    NFT_FAMILY,
+    NFT_TABLE,
+)
+from .firewall import FirewallBackend, MemoryBackend
+from .ipset_batch import IpsetBatcher, Op
+from .ipset_netlink import IPSET_ERR_EXIST, IpsetNetlink, IpsetNetlinkError
+from .ipset_snapshot import IpsetSnapshot
+from .metrics import REGISTRY
+
+IPSET_NAME = "authed"
+
+_OP_SECONDS = REGISTRY.histogram(
+    "portal_ipset_operation_seconds", "Duración de las operaciones sobre el ipset 'authed'", ("op",)
+)
+_OP_FAILURES = REGISTRY.counter("portal_ipset_failures_total", "Operaciones ipset fallidas", ("op",))
+
+_netlink: Optional[IpsetNetlink] = None
+_netlink_checked = False
+_netlink_lock = threading.Lock()
+
+
+def _probe_netlink(client: IpsetNetlink) -> bool:
+    """Comprueba que el kernel responde (permisos, módulo ipset, set existente)."""
+    try:
+        client.test(IPSET_NAME, "0.0.0.0")
+        return True
+    except OSError as e:
+        print(f"ipset netlink no disponible ({e}); usando el binario ipset")
+        return False
+
+
+def _get_netlink() -> Optional[IpsetNetlink]:
+    global _netlink, _netlink_checked
+    if _netlink_checked:
+        return _netlink
+    with _netlink_lock:
+        if not _netlink_checked:
+            if IPSET_BACKEND in ("auto", "netlink"):
+                try:
+                    client = IpsetNetlink()
+                    _netlink = client if _probe_netlink(client) else None
+                except OSError as e:
+                    print(f"No se pudo abrir el socket netlink ({e}); usando el binario ipset")
+            _netlink_checked = True
+    return _netlink
+
+
+def use_netlink_client(client: Optional[IpsetNetlink]) -> None:
+    """
+    Fija el cliente netlink (None = solo binario ipset) y pasa al backend
+    ipset. Útil con un kernel falso.
+    """
+    global _netlink, _netlink_checked
+    with _netlink_lock:
+        _netlink = client
+        _netlink_checked = True
+    if not isinstance(_BACKEND, IpsetBackend):
+        use_backend(IpsetBackend())
+
+
+# ----------------------------
+# Binario ipset (fallback)
+# ----------------------------
+
+def _subprocess_add(ip: str, timeout: int) -> bool:
     try:
         subprocess.run(
-            ["ipset", "add", "authed", ip, "timeout", str(AUTH_TIMEOUT), "-exist"],
+            ["ipset", "add", IPSET_NAME, ip, "timeout", str(timeout), "-exist"],
             check=True,
         )
         return True
@@ -15,24 +108,22 @@ def add_to_ipset(ip: str) -> bool:
         return False
 
 
-def check_ipset(ip: str) -> bool:
-    """Devuelve True si la IP está actualmente en el ipset 'authed'."""
+def _subprocess_check(ip: str) -> Optional[bool]:
     try:
         res = subprocess.run(
-            ["ipset", "test", "authed", ip],
+            ["ipset", "test", IPSET_NAME, ip],
             capture_output=True,
         )
         return res.returncode == 0
     except Exception as e:
         print(f"Error comprobando ipset para {ip}: {e}")
-        return False
+        return None
 
 
-def remove_from_ipset(ip: str) -> bool:
-    """Elimina la IP del conjunto 'authed' (logout)."""
+def _subprocess_remove(ip: str) -> bool:
     try:
         subprocess.run(
-            ["ipset", "del", "authed", ip],
+            ["ipset", "del", IPSET_NAME, ip],
             check=True,
         )
         return True
@@ -41,30 +132,308 @@ def remove_from_ipset(ip: str) -> bool:
         return False
 
 
-def get_remaining_timeout(ip: str) -> int:
+def parse_ipset_save(text: str, setname: str = IPSET_NAME) -> Dict[str, int]:
     """
-    Obtiene el tiempo restante en segundos para una IP en el ipset.
-    Devuelve 0 si la IP no está en el conjunto o hay error.
+    Salida de `ipset save` → {ip: segundos restantes} de setname.
+    Formato de cada elemento: "add authed 192.168.100.2 timeout 3542".
     """
+    entries: Dict[str, int] = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or parts[0] != "add" or parts[1] != setname:
+            continue
+        timeout = 0
+        if "timeout" in parts:
+            try:
+                timeout = int(parts[parts.index("timeout") + 1])
+            except (ValueError, IndexError):
+                pass
+        entries[parts[2]] = timeout
+    return entries
+
+
+def _subprocess_list() -> Optional[Dict[str, int]]:
     try:
         res = subprocess.run(
-            ["ipset", "list", "authed"],
+            ["ipset", "save", IPSET_NAME],
             capture_output=True,
             text=True,
         )
         if res.returncode != 0:
-            return 0
-        # Buscar línea con la IP y extraer timeout
-        # Formato: "192.168.100.2 timeout 3542"
-        for line in res.stdout.splitlines():
-            if ip in line and "timeout" in line:
-                parts = line.split()
-                try:
-                    idx = parts.index("timeout")
-                    return int(parts[idx + 1])
-                except (ValueError, IndexError):
-                    pass
-        return 0
+            return None
+        return parse_ipset_save(res.stdout)
+    except Exception as e:
+        print(f"Error listando ipset: {e}")
+        return None
+
+
+def _restore_line(op: Op) -> str:
+    kind, ip, timeout = op
+    if kind == "add":
+        return f"add {IPSET_NAME} {ip} timeout {timeout} -exist"
+    return f"del {IPSET_NAME} {ip}"
+
+
+def _subprocess_restore(ops: List[Op]) -> List[bool]:
+    """
+    Aplica el lote con `ipset restore`. restore se detiene en la primera
+    línea que falla ("Error in line N"): las anteriores ya están aplicadas,
+    esa se marca como fallida y el resto se reenvía en otra llamada.
+    """
+    results = [False] * len(ops)
+    start = 0
+    try:
+        while start < len(ops):
+            res = subprocess.run(
+                ["ipset", "restore"],
+                input="".join(_restore_line(op) + "\n" for op in ops[start:]),
+                capture_output=True,
+                text=True,
+            )
+            if res.returncode == 0:
+                results[start:] = [True] * (len(ops) - start)
+                break
+            m = re.search(r"line (\d+)", res.stderr)
+            if not m:
+                print(f"Error aplicando lote ipset: {res.stderr.strip()}")
+                break
+            failed = start + int(m.group(1)) - 1
+            results[start:failed] = [True] * (failed - start)
+            print(f"Error en ipset para {ops[failed][0]} {ops[failed][1]}: {res.stderr.strip()}")
+            start = failed + 1
     except Exception as e:
-        print(f"Error obteniendo timeout para {ip}: {e}")
-        return 0
+        print(f"Error aplicando lote ipset: {e}")
+    return results
+
+
+# ----------------------------
+# Backend ipset
+# ----------------------------
+
+class IpsetBackend(FirewallBackend):
+    """Set 'authed' de ipset: netlink y, si falla, el binario ipset."""
+
+    name = "ipset"
+
+    def add(self, ip: str, timeout: int) -> bool:
+        client = _get_netlink()
+        if client is not None:
+            try:
+                client.add(IPSET_NAME, ip, timeout)
+                return True
+            except OSError as e:
+                print(f"Error netlink añadiendo {ip} a ipset: {e}; reintentando con el binario")
+        return _subprocess_add(ip, timeout)
+
+    def test(self, ip: str) -> Optional[bool]:
+        client = _get_netlink()
+        if client is not None:
+            try:
+                return client.test(IPSET_NAME, ip)
+            except OSError as e:
+                print(f"Error netlink comprobando ipset para {ip}: {e}; reintentando con el binario")
+        return _subprocess_check(ip)
+
+    def remove(self, ip: str) -> bool:
+        client = _get_netlink()
+        if client is not None:
+            try:
+                client.delete(IPSET_NAME, ip)
+                return True
+            except IpsetNetlinkError as e:
+                if e.errno == IPSET_ERR_EXIST:
+                    print(f"Error eliminando {ip} de ipset: no está en el conjunto")
+                    return False
+                print(f"Error netlink eliminando {ip} de ipset: {e}; reintentando con el binario")
+            except OSError as e:
+                print(f"Error netlink eliminando {ip} de ipset: {e}; reintentando con el binario")
+        return _subprocess_remove(ip)
+
+    def list_entries(self) -> Optional[Dict[str, int]]:
+        client = _get_netlink()
+        if client is not None:
+            try:
+                return client.list_entries(IPSET_NAME)
+            except OSError as e:
+                print(f"Error netlink listando ipset: {e}; reintentando con el binario")
+        return _subprocess_list()
+
+    def apply_batch(self, ops: List[Op]) -> List[bool]:
+        client = _get_netlink()
+        if client is not None:
+            try:
+                errors = client.batch(IPSET_NAME, ops)
+                for (kind, ip, _), err in zip(ops, errors):
+                    if err:
+                        print(f"Error netlink en ipset para {kind} {ip}: errno {err}")
+                return [err == 0 for err in errors]
+            except OSError as e:
+                print(f"Error netlink aplicando lote ipset: {e}; reintentando con el binario")
+        return _subprocess_restore(ops)
+
+    def reset(self) -> None:
+        global _netlink, _netlink_checked
+        with _netlink_lock:
+            if _netlink is not None:
+                _netlink.close()
+            _netlink = None
+            _netlink_checked = False
+
+
+# ----------------------------
+# Backend activo
+# ----------------------------
+
+def _make_backend(name: str) -> FirewallBackend:
+    if name == "nft":
+        from .nft_backend import NftBackend
+
+        return NftBackend(NFT_FAMILY, NFT_TABLE, IPSET_NAME)
+    if name == "memory":
+        return MemoryBackend()
+    if name != "ipset":
+        print(f"FIREWALL_BACKEND desconocido: {name!r}; usando ipset")
+    return IpsetBackend()
+
+
+_BACKEND: FirewallBackend = _make_backend(FIREWALL_BACKEND)
+
+
+def use_backend(backend: FirewallBackend) -> None:
+    """Sustituye el backend activo (pruebas y benchmarks)."""
+    global _BACKEND
+    _BACKEND = backend
+    _SNAPSHOT.refresh()
+
+
+def backend_name() -> str:
+    return _BACKEND.name
+
+
+def _load_authed() -> Optional[Dict[str, int]]:
+    with _OP_SECONDS.time("list"):
+        entries = _BACKEND.list_entries()
+    if entries is None:
+        _OP_FAILURES.inc("list")
+    return entries
+
+
+_SNAPSHOT = IpsetSnapshot(_load_authed, IPSET_SNAPSHOT_MAX_AGE)
+
+
+def _apply_batch(ops: List[Op]) -> List[bool]:
+    return _BACKEND.apply_batch(ops)
+
+
+_BATCHER: Optional[IpsetBatcher] = None
+if IPSET_BATCH_WINDOW_MS > 0:
+    _BATCHER = IpsetBatcher(_apply_batch, window=IPSET_BATCH_WINDOW_MS / 1000, max_ops=IPSET_BATCH_MAX)
+
+
+def batch_stats() -> Optional[dict]:
+    """Estadísticas del agrupador de operaciones (None si está desactivado)."""
+    return _BATCHER.stats() if _BATCHER is not None else None
+
+
+@REGISTRY.collector
+def _batch_metrics():
+    stats = batch_stats()
+    backend = [("portal_firewall_backend", "gauge", "Backend del set de IPs autenticadas",
+                [({"backend": _BACKEND.name}, 1)])]
+    if stats is None:
+        return backend
+    return backend + [
+        ("portal_ipset_batches_total", "counter", "Lotes de altas/bajas aplicados", [({}, stats["batches"])]),
+        ("portal_ipset_batched_ops_total", "counter", "Operaciones aplicadas en lotes", [({}, stats["ops"])]),
+        ("portal_ipset_batched_failed_total", "counter", "Operaciones fallidas dentro de lotes",
+         [({}, stats["failed"])]),
+    ]
+
+
+# ----------------------------
+# API pública
+# ----------------------------
+
+def add_to_ipset(ip: str) -> bool:
+    """Añade la IP al conjunto 'authed' con timeout (AUTH_TIMEOUT)."""
+    with _OP_SECONDS.time("add"):
+        ok = _add(ip)
+    if ok:
+        _SNAPSHOT.note_add(ip, AUTH_TIMEOUT)
+    else:
+        _OP_FAILURES.inc("add")
+    return ok
+
+
+def _add(ip: str) -> bool:
+    if _BATCHER is not None:
+        return _BATCHER.submit("add", ip, AUTH_TIMEOUT)
+    return _BACKEND.add(ip, AUTH_TIMEOUT)
+
+
+def check_ipset(ip: str) -> bool:
+    """Devuelve True si la IP está actualmente en el ipset 'authed'."""
+    with _OP_SECONDS.time("test"):
+        found = _BACKEND.test(ip)
+    if found is None:
+        _OP_FAILURES.inc("test")
+        return False
+    return found
+
+
+def remove_from_ipset(ip: str) -> bool:
+    """Elimina la IP del conjunto 'authed' (logout)."""
+    _SNAPSHOT.note_remove(ip)
+    with _OP_SECONDS.time("del"):
+        ok = _remove(ip)
+    if not ok:
+        _OP_FAILURES.inc("del")
+    return ok
+
+
+def _remove(ip: str) -> bool:
+    if _BATCHER is not None:
+        return _BATCHER.submit("del", ip)
+    return _BACKEND.remove(ip)
+
+
+def get_remaining_timeout(ip: str) -> int:
+    """
+    Obtiene el tiempo restante en segundos para una IP en el set.
+    Devuelve 0 si la IP no está en el conjunto o hay error.
+    Se responde desde la instantánea compartida del set (ver
+    ipset_snapshot), buscando la IP exacta.
+    """
+    return _SNAPSHOT.remaining(ip) or 0
+
+
+def list_authed() -> Optional[Dict[str, int]]:
+    """
+    Contenido del conjunto 'authed' como {ip: segundos restantes}, leído
+    ahora (y refrescando la instantánea compartida).
+    Devuelve None si no se pudo leer (distinto de un set vacío).
+    """
+    return _SNAPSHOT.refresh()
+
+
+def restore_authed(entries: Dict[str, int]) -> List[bool]:
+    """
+    Vuelve a añadir entries ({ip: segundos restantes}) al conjunto 'authed'
+    en un único lote del backend (lote netlink, `ipset restore` o una
+    transacción nft), sin pasar por el agrupador. Un resultado por IP.
+    """
+    if not entries:
+        return []
+    with _OP_SECONDS.time("restore"):
+        results = _BACKEND.apply_batch([("add", ip, timeout) for ip, timeout in entries.items()])
+    for (ip, timeout), ok in zip(entries.items(), results):
+        if ok:
+            _SNAPSHOT.note_add(ip, timeout)
+        else:
+            _OP_FAILURES.inc("restore")
+    return results
+
+
+def reset_backend() -> None:
+    """Cierra los sockets/contextos del backend (antes de un fork, ver FirewallBackend.reset)."""
+    _BACKEND.reset()
@@ -2,211 +2,325 @@
 import os
 import sys
 import json
+import math
 import socket
-import mimetypes
-import queue
+import argparse
+import atexit
+import selectors
+import signal
 import threading
+import time
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import parse_qs, urlparse
 
 from . import portal
 from . import admin as admin_module
 from . import auth
-from .config import AUTH_TIMEOUT
+from . import user_bulk
+from .compression import ResponseCompressor
+from .access_log import AccessLog, now_iso, parse_sample_rules
+from .config import (
+    ACCESS_LOG,
+    ACCESS_LOG_BACKUPS,
+    ACCESS_LOG_FILE,
+    ACCESS_LOG_MAX_BYTES,
+    ACCESS_LOG_QUEUE,
+    ACCESS_LOG_SAMPLE,
+    ADMIN_PAGE_SIZE,
+    AUTH_TIMEOUT,
+    COMPRESSION_LEVEL,
+    COMPRESSION_MIN_BYTES,
+    KEEPALIVE_MAX_REQUESTS,
+    KEEPALIVE_TIMEOUT,
+    LISTEN_BACKLOG,
+    LOGIN_RATE_BURST,
+    LOGIN_RATE_LIMIT,
+    PORTAL_PROCESSES,
+    QUEUE_DEADLINE_ADMIN,
+    QUEUE_DEADLINE_AUTH,
+    QUEUE_DEADLINE_FAST,
+    QUEUE_MAX_ADMIN,
+    QUEUE_MAX_AUTH,
+    QUEUE_MAX_FAST,
+    RATE_LIMIT_TABLE_SIZE,
+    RESPONSE_COMPRESSION,
+    SERVER_MODE,
+    SERVER_WORKERS,
+    STATIC_MAX_AGE,
+    STATIC_SENDFILE_MIN_BYTES,
+    STATUS_RATE_BURST,
+    STATUS_RATE_LIMIT,
+    USERS_IMPORT_MAX_BYTES,
+)
+from .http_parser import BodyStream, RequestParser, wants_keep_alive
+from .ipset_utils import reset_backend
+from .http_utils import (
+    ChunkedResponse,
+    FileResponse,
+    StreamResponse,
+    build_chunked_response,
+    build_response,
+    client_ip_from_headers,
+    error_response,
+    etag_matches,
+    head_only,
+    log,
+    parse_form_urlencoded,
+    send_response,
+    set_connection_header,
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from .passwords import PasswordBusyError
+from .prefork import PreforkSupervisor, create_listen_socket
+from .ratelimit import TokenBucketLimiter
+from .scheduler import PriorityScheduler, RequestClass, classify
+from .static_cache import StaticCache
 
 APP_ROOT = Path(__file__).resolve().parent
 STATIC_ROOT = APP_ROOT / "static"
 
 
-def log(msg: str) -> None:
-    print(msg, flush=True)
+# ----------------------------
+# Handlers
+# ----------------------------
+
+STATIC = StaticCache(STATIC_ROOT, max_age=STATIC_MAX_AGE, sendfile_min_bytes=STATIC_SENDFILE_MIN_BYTES)
+
+
+def handle_static(path: str, headers: dict, method: str = "GET") -> "bytes | FileResponse":
+    """Sirve /static/<rel> desde la caché de archivos (ETag, 304, gzip, Range, sendfile)."""
+    return STATIC.respond(path[len("/static/") :], headers, method)
+
+
+def require_admin(headers: dict) -> tuple[bool, bytes]:
+    auth_header = headers.get("Authorization") or headers.get("authorization")
+    creds = auth.parse_basic_auth(auth_header)
+    try:
+        allowed = bool(creds) and auth.is_admin(*creds)
+    except PasswordBusyError:
+        return False, build_response(503, {"Retry-After": "5"}, b"Service Unavailable")
+    if not allowed:
+        body = b"Administracion - autenticacion requerida"
+        resp = build_response(
+            401,
+            {
+                "WWW-Authenticate": 'Basic realm="Admin"',
+                "Content-Type": "text/plain; charset=utf-8",
+            },
+            body,
+        )
+        return False, resp
+    return True, b""
 
 
 # ----------------------------
-# HTTP helpers (manual)
+# Router (manual)
 # ----------------------------
 
-_REASON = {
-    200: "OK",
-    204: "No Content",
-    302: "Found",
-    400: "Bad Request",
-    401: "Unauthorized",
-    404: "Not Found",
-    405: "Method Not Allowed",
-    413: "Payload Too Large",
-    500: "Internal Server Error",
+COMPRESSOR = ResponseCompressor(
+    enabled=RESPONSE_COMPRESSION,
+    min_bytes=COMPRESSION_MIN_BYTES,
+    level=COMPRESSION_LEVEL,
+)
+
+
+def _limiter(per_minute: float, burst: int) -> TokenBucketLimiter | None:
+    if per_minute <= 0:
+        return None
+    return TokenBucketLimiter(per_minute / 60.0, burst, RATE_LIMIT_TABLE_SIZE)
+
+
+# (método, ruta) -> limitador por IP; se consulta antes de cualquier trabajo
+RATE_LIMITS = {
+    key: limiter
+    for key, limiter in (
+        (("POST", "/login"), _limiter(LOGIN_RATE_LIMIT, LOGIN_RATE_BURST)),
+        (("GET", "/status.json"), _limiter(STATUS_RATE_LIMIT, STATUS_RATE_BURST)),
+    )
+    if limiter is not None
 }
 
 
-def _reason(status: int) -> str:
-    return _REASON.get(status, "OK")
+def rate_limit_stats() -> dict:
+    """Contadores de cada limitador: {"POST /login": {...}, ...}."""
+    return {f"{method} {path}": limiter.stats() for (method, path), limiter in RATE_LIMITS.items()}
+
+
+@REGISTRY.collector
+def _rate_limit_metrics():
+    rejected, tracked = [], []
+    for route, stats in rate_limit_stats().items():
+        rejected.append(({"route": route}, stats["rejected"]))
+        tracked.append(({"route": route}, stats["tracked"]))
+    return [
+        ("portal_rate_limited_total", "counter", "Peticiones rechazadas con 429 por ruta", rejected),
+        ("portal_rate_limit_tracked_ips", "gauge", "IPs en la tabla del limitador por ruta", tracked),
+    ]
+
+
+def _rate_limited(method: str, path: str, client_ip: str) -> bytes | None:
+    """Respuesta 429 si client_ip ha agotado su cuota para esta ruta; None si pasa."""
+    limiter = RATE_LIMITS.get((method, path))
+    if limiter is None:
+        return None
+    wait = limiter.check(client_ip)
+    if not wait:
+        return None
+    headers = {"Retry-After": str(max(1, math.ceil(wait)))}
+    if path == "/login":
+        # Formulario con el error (la plantilla no toca usuarios ni ipset)
+        html_body = portal.render_login_page(
+            client_ip=client_ip,
+            auth_timeout=AUTH_TIMEOUT,
+            error="Demasiados intentos. Espera un momento antes de volver a intentarlo.",
+        )
+        return build_response(429, {"Content-Type": "text/html; charset=utf-8", **headers}, html_body)
+    return build_response(429, headers, b"Too Many Requests")
 
 
-def _http_date_stub() -> str:
-    # Opcional (no obligatorio). Para tu caso podemos omitir Date.
-    return ""
+_REQUEST_SECONDS = REGISTRY.histogram(
+    "portal_request_duration_seconds",
+    "Duración del procesamiento de cada petición (sin el envío), por ruta, método y status",
+    ("route", "method", "status"),
+)
 
+# Rutas con etiqueta propia en las métricas; el resto cuenta como "other"
+_METRIC_ROUTES = {
+    "/", "/login", "/logout", "/status", "/status.json", "/status/events", "/metrics",
+    "/admin", "/admin/", "/admin/users", "/admin/users/create", "/admin/users/delete",
+    "/admin/users/import", "/admin/users/export",
+}
 
-def build_response(status: int, headers: dict | None, body: bytes | None) -> bytes:
-    headers = dict(headers or {})
-    if body is None:
-        body = b""
 
-    # Si no hay Content-Type y hay body, ponemos text/html por defecto
-    if body and not any(k.lower() == "content-type" for k in headers.keys()):
-        headers["Content-Type"] = "text/html; charset=utf-8"
+def _route_label(raw_path: str) -> str:
+    path = raw_path.split("?", 1)[0]
+    if path in _METRIC_ROUTES:
+        return path
+    return "/static/*" if path.startswith("/static/") else "other"
 
-    headers["Content-Length"] = str(len(body))
-    # Cerramos conexión para simplificar HTTP/1.1 (sin keep-alive)
-    headers["Connection"] = "close"
 
-    status_line = f"HTTP/1.1 {status} {_reason(status)}\r\n"
-    head = status_line + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
-    return head.encode("utf-8") + body
+def _status_of(resp: "bytes | FileResponse | StreamResponse | ChunkedResponse") -> str:
+    head = resp if isinstance(resp, bytes) else resp.head
+    return head[9:12].decode("ascii", "replace")
 
 
-def _recv_until(sock: socket.socket, marker: bytes, max_bytes: int = 64 * 1024) -> bytes:
-    """
-    Lee del socket hasta encontrar marker o llegar al límite.
-    """
-    data = b""
-    while marker not in data:
-        chunk = sock.recv(4096)
-        if not chunk:
-            break
-        data += chunk
-        if len(data) > max_bytes:
-            raise ValueError("header too large")
-    return data
-
-
-def parse_http_request(sock: socket.socket) -> tuple[str, str, dict, bytes]:
-    """
-    Parseo HTTP MUY simple:
-    - Lee headers hasta \r\n\r\n
-    - Parsea request line
-    - Parsea headers
-    - Si hay Content-Length, lee el body completo
-    Devuelve: (method, path, headers_dict, body_bytes)
-    """
-    raw = _recv_until(sock, b"\r\n\r\n", max_bytes=128 * 1024)
-    if b"\r\n\r\n" not in raw:
-        raise ValueError("incomplete headers")
-
-    head, rest = raw.split(b"\r\n\r\n", 1)
-    lines = head.split(b"\r\n")
-    if not lines:
-        raise ValueError("empty request")
-
-    # Request line: METHOD SP PATH SP HTTP/1.1
-    req_line = lines[0].decode("iso-8859-1", errors="replace")
-    parts = req_line.split()
-    if len(parts) < 2:
-        raise ValueError("bad request line")
-
-    method = parts[0].upper()
-    path = parts[1]
-
-    headers: dict[str, str] = {}
-    for ln in lines[1:]:
-        s = ln.decode("iso-8859-1", errors="replace")
-        if ":" in s:
-            k, v = s.split(":", 1)
-            headers[k.strip()] = v.strip()
-
-    # Body
-    body = b""
-    content_length = headers.get("Content-Length") or headers.get("content-length")
-    if content_length:
-        try:
-            n = int(content_length)
-        except ValueError:
-            raise ValueError("bad content-length")
-
-        if n > 2 * 1024 * 1024:
-            # evita DoS tonto
-            raise ValueError("payload too large")
-
-        body = rest
-        while len(body) < n:
-            chunk = sock.recv(min(4096, n - len(body)))
-            if not chunk:
-                break
-            body += chunk
-        body = body[:n]
+def _is_local_scrape(headers: dict, peer_ip: str) -> bool:
+    """Petición directa desde el propio host (no pasa por nginx, que añade X-Real-IP)."""
+    if headers.get("X-Real-IP") or headers.get("X-Forwarded-For"):
+        return False
+    return peer_ip in ("127.0.0.1", "::1") or peer_ip.startswith("127.")
 
-    return method, path, headers, body
 
+def _int_param(params: dict, name: str, default: int) -> int:
+    try:
+        return int((params.get(name) or [default])[0])
+    except ValueError:
+        return default
 
-def client_ip_from_headers(headers: dict, peer_ip: str) -> str:
-    # Si viene de nginx, usa X-Real-IP / X-Forwarded-For; si no, peer_ip
-    real_ip = headers.get("X-Real-IP") or headers.get("x-real-ip")
-    if real_ip:
-        return real_ip.strip()
-    fwd = headers.get("X-Forwarded-For") or headers.get("x-forwarded-for")
-    if fwd:
-        return fwd.split(",")[0].strip()
-    return peer_ip
 
+def _streamed_body(method: str, path: str) -> int | None:
+    """Rutas cuyo body se procesa por trozos (ver http_parser.BodyStream) y su tamaño máximo."""
+    if method == "POST" and path == "/admin/users/import":
+        return USERS_IMPORT_MAX_BYTES
+    return None
 
-def parse_form_urlencoded(body: bytes) -> dict:
-    # body: b"username=...&password=..."
-    raw = body.decode("utf-8", errors="ignore")
-    return parse_qs(raw)
 
+def _text_response(status: int, text: str) -> bytes:
+    return build_response(status, {"Content-Type": "text/plain; charset=utf-8"}, text.encode("utf-8"))
 
-def handle_static(path: str) -> tuple[int, dict, bytes]:
-    rel = path[len("/static/") :]
-    # Evita traversal básico
-    if ".." in rel or "\\" in rel:
-        return 404, {}, b"Not Found"
 
-    file_path = STATIC_ROOT / rel
-    if not file_path.is_file():
-        return 404, {}, b"Not Found"
+def _import_users(params: dict, headers: dict, body: "bytes | BodyStream") -> bytes:
+    """POST /admin/users/import: CSV/JSONL en el body; responde el informe en JSON."""
+    fmt = (params.get("format") or [user_bulk.content_format(headers.get("Content-Type"))])[0]
+    mode = (params.get("mode") or ["create"])[0]
+    on_error = (params.get("on_error") or ["abort"])[0]
+    if fmt not in user_bulk.FORMATS or mode not in ("create", "upsert") or on_error not in ("abort", "skip"):
+        return _text_response(400, "Parámetros: format=csv|jsonl, mode=create|upsert, on_error=abort|skip, dry_run=1")
+    report = user_bulk.import_users(
+        body if isinstance(body, BodyStream) else [body],
+        fmt=fmt,
+        mode=mode,
+        on_error=on_error,
+        dry_run=_int_param(params, "dry_run", 0) == 1,
+    )
+    status = 422 if report.error_count and not report.applied else 200
+    return build_response(status, {"Content-Type": "application/json; charset=utf-8"}, report.to_json())
 
-    ctype, _ = mimetypes.guess_type(str(file_path))
-    if not ctype:
-        ctype = "application/octet-stream"
-    data = file_path.read_bytes()
-    return 200, {"Content-Type": ctype}, data
 
+ACCESS = AccessLog(
+    enabled=ACCESS_LOG,
+    path=ACCESS_LOG_FILE,
+    max_bytes=ACCESS_LOG_MAX_BYTES,
+    backups=ACCESS_LOG_BACKUPS,
+    queue_size=ACCESS_LOG_QUEUE,
+    sample=parse_sample_rules(ACCESS_LOG_SAMPLE),
+)
+atexit.register(ACCESS.close)
 
-def require_admin(headers: dict) -> tuple[bool, bytes]:
-    auth_header = headers.get("Authorization") or headers.get("authorization")
-    creds = auth.parse_basic_auth(auth_header)
-    if not creds or not auth.is_admin(*creds):
-        body = b"Administracion - autenticacion requerida"
-        resp = build_response(
-            401,
-            {
-                "WWW-Authenticate": 'Basic realm="Admin"',
-                "Content-Type": "text/plain; charset=utf-8",
-            },
-            body,
-        )
-        return False, resp
-    return True, b""
 
+@REGISTRY.collector
+def _access_log_metrics():
+    stats = ACCESS.stats()
+    return [
+        ("portal_access_log_records_total", "counter", "Registros del log de acceso por resultado",
+         [({"result": r}, stats[r]) for r in ("written", "dropped", "sampled_out")]),
+        ("portal_access_log_queued", "gauge", "Registros pendientes de escribir", [({}, stats["queued"])]),
+    ]
 
-# ----------------------------
-# Router (manual)
-# ----------------------------
 
-def route_request(method: str, raw_path: str, headers: dict, body: bytes, peer_ip: str) -> bytes:
+def _body_bytes(resp: "bytes | FileResponse | StreamResponse | ChunkedResponse") -> int | None:
+    if isinstance(resp, bytes):
+        end = resp.find(b"\r\n\r\n")
+        return len(resp) - end - 4 if end >= 0 else 0
+    if isinstance(resp, FileResponse):
+        return resp.count
+    return None  # stream / chunked
+
+
+def route_request(method: str, raw_path: str, headers: dict, body: "bytes | BodyStream", peer_ip: str) -> "bytes | FileResponse | StreamResponse | ChunkedResponse":
+    """
+    Enruta la petición, aplica la compresión negociada (ver compression) y
+    registra su duración (métricas) y su línea de log de acceso.
+    """
+    start = time.perf_counter()
+    status = "500"
+    resp = None
+    try:
+        resp = _respond(method, raw_path, headers, body, peer_ip)
+        status = _status_of(resp)
+        return resp
+    finally:
+        elapsed = time.perf_counter() - start
+        _REQUEST_SECONDS.observe(elapsed, _route_label(raw_path), method, status)
+        ACCESS.record({
+            "ts": now_iso(),
+            "ip": client_ip_from_headers(headers, peer_ip),
+            "method": method,
+            "path": raw_path.split("?", 1)[0],
+            "status": int(status) if status.isdigit() else 0,
+            "ms": round(elapsed * 1000, 3),
+            "bytes": _body_bytes(resp) if resp is not None else None,
+            "pid": os.getpid(),
+        })
+
+
+def _respond(method: str, raw_path: str, headers: dict, body: "bytes | BodyStream", peer_ip: str) -> "bytes | FileResponse | StreamResponse | ChunkedResponse":
+    return COMPRESSOR.apply(_route(method, raw_path, headers, body, peer_ip), headers)
+
+
+def _route(method: str, raw_path: str, headers: dict, body: "bytes | BodyStream", peer_ip: str) -> "bytes | FileResponse | StreamResponse | ChunkedResponse":
     parsed = urlparse(raw_path)
     path = parsed.path
     client_ip = client_ip_from_headers(headers, peer_ip)
 
-    log(f"{method} {path} from {client_ip}")
+    limited = _rate_limited(method, path, client_ip)
+    if limited is not None:
+        return limited
 
     # STATIC
     if path.startswith("/static/") and method in ("GET", "HEAD"):
-        st, h, b = handle_static(path)
-        if method == "HEAD":
-            b = b""
-        return build_response(st, h, b)
+        resp = handle_static(path, headers, method)
+        return head_only(resp) if method == "HEAD" else resp
 
     # GET
     if method == "GET":
@@ -215,18 +329,36 @@ def route_request(method: str, raw_path: str, headers: dict, body: bytes, peer_i
                 client_ip=client_ip,
                 auth_timeout=AUTH_TIMEOUT,
                 error=None,
-            ).encode("utf-8")
+            )
             return build_response(200, {"Content-Type": "text/html; charset=utf-8"}, html_body)
 
         if path == "/status":
-            html_body = portal.render_status_page().encode("utf-8")
-            return build_response(200, {"Content-Type": "text/html; charset=utf-8"}, html_body)
+            # Página estática precompilada: bytes en caché + ETag fuerte
+            page = portal.status_page()
+            cache_headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+            if etag_matches(headers.get("If-None-Match"), page.etag):
+                return build_response(304, cache_headers, b"")
+            return build_response(200, {"Content-Type": "text/html; charset=utf-8", **cache_headers}, page.static)
+
+        if path == "/status/events":
+            stream = portal.open_status_stream(client_ip)
+            if stream is None:
+                return build_response(503, {"Retry-After": "30"}, b"Too many event streams")
+            return stream
 
         if path == "/status.json":
             data = portal.get_status_json(client_ip)
             out = json.dumps(data).encode("utf-8")
             return build_response(200, {"Content-Type": "application/json; charset=utf-8"}, out)
 
+        if path == "/metrics":
+            if not _is_local_scrape(headers, peer_ip):
+                ok, resp = require_admin(headers)
+                if not ok:
+                    return resp
+            return build_response(200, {"Content-Type": METRICS_CONTENT_TYPE, "Cache-Control": "no-store"},
+                                  REGISTRY.render())
+
         if path in ("/admin", "/admin/"):
             return build_response(302, {"Location": "/admin/users"}, b"")
 
@@ -236,42 +368,48 @@ def route_request(method: str, raw_path: str, headers: dict, body: bytes, peer_i
                 return resp
             # usuario admin para mostrar
             admin_user = "admin"
-            html_body = admin_module.render_admin_page(admin_user=admin_user, message=None).encode("utf-8")
+            params = parse_qs(parsed.query)
+            html_body = admin_module.render_admin_page(
+                admin_user=admin_user,
+                message=None,
+                query=(params.get("q") or [""])[0],
+                page=_int_param(params, "page", 1),
+                order=(params.get("order") or ["asc"])[0],
+                per_page=_int_param(params, "per_page", ADMIN_PAGE_SIZE),
+                after=(params.get("after") or [None])[0],
+                before=(params.get("before") or [None])[0],
+            )
             return build_response(200, {"Content-Type": "text/html; charset=utf-8"}, html_body)
 
+        if path == "/admin/users/export":
+            ok, resp = require_admin(headers)
+            if not ok:
+                return resp
+            fmt = (parse_qs(parsed.query).get("format") or ["csv"])[0]
+            if fmt not in user_bulk.FORMATS:
+                return _text_response(400, "format=csv|jsonl")
+            content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+            return build_chunked_response(200, {
+                "Content-Type": f"{content_type}; charset=utf-8",
+                "Content-Disposition": f'attachment; filename="users.{fmt}"',
+                "Cache-Control": "no-store",
+            }, user_bulk.export_chunks(fmt))
+
         return build_response(404, {}, b"Not Found")
 
-    # HEAD (reusa lógica GET pero sin body)
+    # HEAD: los mismos headers que GET (Content-Length incluido), sin body
     if method == "HEAD":
-        resp = route_request("GET", raw_path, headers, b"", peer_ip)
-        # quitar body manteniendo headers/content-length correcto (0)
-        # reconstruimos: parsear hasta \r\n\r\n
-        head = resp.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
-        # Ajustar Content-Length a 0 (por seguridad)
-        # Más simple: volver a construir desde status line+headers no es trivial sin parseo.
-        # Para tu portal no hace falta perfecto; pero lo dejamos consistente:
-        # hack: reemplazar Content-Length: N por 0 si aparece.
-        head = head.replace(b"Content-Length: ", b"Content-Length: ")
-        if b"Content-Length:" in head:
-            lines = head.split(b"\r\n")
-            new_lines = []
-            for ln in lines:
-                if ln.lower().startswith(b"content-length:"):
-                    new_lines.append(b"Content-Length: 0")
-                else:
-                    new_lines.append(ln)
-            head = b"\r\n".join(new_lines)
-        return head  # sin body
+        return head_only(_respond("GET", raw_path, headers, b"", peer_ip))
 
     # POST
     if method == "POST":
         if path == "/login":
             form = parse_form_urlencoded(body)
-            status, hdrs, body_text = portal.process_login(client_ip, form)
+            status, hdrs, html_body = portal.process_login(client_ip, form)
             hdrs = dict(hdrs or {})
             if status == 302 and "Location" not in hdrs:
                 hdrs["Location"] = "/status"
-            return build_response(status, hdrs, (body_text or "").encode("utf-8"))
+            return build_response(status, hdrs, html_body)
 
         if path in ("/admin/users/create", "/admin/users/delete"):
             ok, resp = require_admin(headers)
@@ -288,12 +426,18 @@ def route_request(method: str, raw_path: str, headers: dict, body: bytes, peer_i
                 username = (form.get("username") or [""])[0]
                 msg = admin_module.handle_delete_user(username)
 
-            html_body = admin_module.render_admin_page(admin_user="admin", message=msg).encode("utf-8")
+            html_body = admin_module.render_admin_page(admin_user="admin", message=msg)
             return build_response(200, {"Content-Type": "text/html; charset=utf-8"}, html_body)
 
+        if path == "/admin/users/import":
+            ok, resp = require_admin(headers)
+            if not ok:
+                return resp
+            return _import_users(parse_qs(parsed.query), headers, body)
+
         if path == "/logout":
-            status, hdrs, body_text = portal.process_logout(client_ip)
-            return build_response(status, dict(hdrs or {}), (body_text or "").encode("utf-8"))
+            status, hdrs, html_body = portal.process_logout(client_ip)
+            return build_response(status, dict(hdrs or {}), html_body)
 
         return build_response(404, {}, b"Not Found")
 
@@ -304,36 +448,206 @@ def route_request(method: str, raw_path: str, headers: dict, body: bytes, peer_i
 # Thread pool server (manual)
 # ----------------------------
 
+# Bytes leídos con MSG_PEEK para clasificar una petición, y cada cuánto se
+# vuelve a mirar una línea de petición incompleta
+_PEEK_BYTES = 512
+_PARTIAL_RETRY = 0.005
+
+
+class _Connection:
+    """Estado de una conexión cliente entre peticiones (keep-alive)."""
+
+    __slots__ = ("sock", "peer_ip", "reader", "deadline", "partial")
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.peer_ip = addr[0]
+        self.reader = RequestParser(sock)
+        self.deadline = 0.0
+        self.partial = False  # esperando el resto de la línea de petición
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class _IdleConnections:
+    """
+    Conexiones keep-alive ociosas, a la espera de su siguiente petición.
+
+    Un único hilo las vigila con selectors: cuando llegan datos la conexión
+    vuelve a la cola de trabajo, y si pasan idle_timeout segundos sin datos
+    se cierra. Así una conexión ociosa no ocupa ningún worker. También
+    esperan aquí las conexiones recién aceptadas que aún no han enviado
+    su petición, y las que solo han enviado parte de la línea de petición
+    (park_partial): esas ya son legibles, así que en lugar del selector se
+    reintentan cada _PARTIAL_RETRY segundos hasta su plazo.
+    """
+
+    def __init__(self, on_ready, idle_timeout: float):
+        self._on_ready = on_ready
+        self._idle_timeout = idle_timeout
+        self._sel = selectors.DefaultSelector()
+        self._pending: list[_Connection] = []
+        self._partial: list[tuple[float, _Connection]] = []  # (reintento, conexión)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._loop, name="cp-idle", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def park(self, conn: _Connection, timeout: float | None = None):
+        conn.deadline = time.monotonic() + (self._idle_timeout if timeout is None else timeout)
+        with self._lock:
+            self._pending.append(conn)
+        self._wake()
+
+    def park_partial(self, conn: _Connection):
+        with self._lock:
+            self._partial.append((time.monotonic() + _PARTIAL_RETRY, conn))
+        self._wake()
+
+    def stop(self):
+        self._stop.set()
+        self._wake()
+        self._thread.join(timeout=1.0)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                timeout = min([1.0] + [max(0.0, t - time.monotonic()) for t, _ in self._partial])
+            for key, _ in self._sel.select(timeout=timeout):
+                conn = key.data
+                if conn is None:
+                    try:
+                        self._wake_r.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self._sel.unregister(conn.sock)
+                self._on_ready(conn)
+
+            now = time.monotonic()
+            with self._lock:
+                pending, self._pending = self._pending, []
+                retry = [conn for t, conn in self._partial if t <= now]
+                self._partial = [(t, conn) for t, conn in self._partial if t > now]
+            for conn in retry:
+                if conn.deadline <= now:
+                    conn.close()  # la línea de petición no se completó a tiempo
+                else:
+                    self._on_ready(conn)
+            for conn in pending:
+                try:
+                    self._sel.register(conn.sock, selectors.EVENT_READ, conn)
+                except (ValueError, OSError):
+                    conn.close()
+
+            # Expirar conexiones ociosas
+            now = time.monotonic()
+            for key in list(self._sel.get_map().values()):
+                conn = key.data
+                if conn is not None and conn.deadline <= now:
+                    self._sel.unregister(conn.sock)
+                    conn.close()
+
+        for key in list(self._sel.get_map().values()):
+            if key.data is not None:
+                key.data.close()
+        for _, conn in self._partial:
+            conn.close()
+        self._sel.close()
+
+
+_QUEUE_WAIT = REGISTRY.histogram(
+    "portal_queue_wait_seconds", "Espera en la cola de trabajo (modo threadpool) por clase", ("class",)
+)
+_WORKERS_BUSY = REGISTRY.gauge("portal_workers_busy", "Workers del pool atendiendo una conexión")
+
+_SHED_RESPONSE = build_response(
+    503, {"Retry-After": "2", "Connection": "close"}, b"Servidor saturado, reintenta en unos segundos"
+)
+
+
+def _default_classes() -> list[RequestClass]:
+    return [
+        RequestClass("fast", QUEUE_MAX_FAST, QUEUE_DEADLINE_FAST),
+        RequestClass("auth", QUEUE_MAX_AUTH, QUEUE_DEADLINE_AUTH),
+        RequestClass("admin", QUEUE_MAX_ADMIN, QUEUE_DEADLINE_ADMIN),
+    ]
+
+
 class ManualThreadPoolHTTPServer:
     """
     Servidor TCP manual + HTTP parse manual:
     - accept() en hilo principal
-    - pone (client_socket, client_addr) en cola FIFO
-    - N workers procesan: parse HTTP -> route -> send -> close
+    - la conexión con una petición lista entra en la cola de su clase de
+      prioridad (ver scheduler); si aún no ha enviado nada espera en
+      _IdleConnections hasta read_timeout
+    - N workers procesan: parse HTTP -> route -> send, mientras el cliente
+      tenga peticiones encadenadas (pipelining) en el buffer
+    - keep-alive: la conexión ociosa pasa a _IdleConnections y vuelve a la
+      cola cuando llega la siguiente petición; si no, se cierra
+    - una conexión que no cabe en su cola o supera su plazo esperando
+      recibe un 503 inmediato (Retry-After) y se cierra
     """
 
-    def __init__(self, host: str, port: int, *, workers: int = 10, queue_size: int = 0):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        workers: int = 10,
+        classes: list[RequestClass] | None = None,
+        backlog: int = 128,
+        read_timeout: float = 5.0,
+        keepalive_timeout: float = 15.0,
+        keepalive_max_requests: int = 100,
+        sock: socket.socket | None = None,
+    ):
         self.host = host
         self.port = port
         self.workers = workers
-        self._q = queue.Queue(maxsize=queue_size) if queue_size and queue_size > 0 else queue.Queue()
+        self.backlog = backlog
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max_requests = keepalive_max_requests
+        self.scheduler = PriorityScheduler(
+            classes or _default_classes(),
+            self._shed,
+            on_wait=lambda cls, wait: _QUEUE_WAIT.observe(wait, cls),
+        )
+        REGISTRY.collector(self._queue_metrics)
         self._stop = threading.Event()
         self._threads: list[threading.Thread] = []
-        self._sock: socket.socket | None = None
+        # Socket de escucha ya creado (modo pre-fork) o None para crearlo en start()
+        self._sock: socket.socket | None = sock
+        self._idle = _IdleConnections(self._dispatch, keepalive_timeout)
 
     def start(self):
         # Crear socket servidor
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind((self.host, self.port))
-        srv.listen(128)
-        self._sock = srv
+        if self._sock is None:
+            self._sock = create_listen_socket(self.host, self.port, self.backlog)
+        srv = self._sock
 
         # Workers
         for i in range(self.workers):
             t = threading.Thread(target=self._worker_loop, name=f"cp-worker-{i+1}", daemon=True)
             t.start()
             self._threads.append(t)
+        self._idle.start()
 
         log(f"Servidor TCP(HTTP) manual escuchando en {self.host}:{self.port} (pool={self.workers})")
 
@@ -341,9 +655,7 @@ class ManualThreadPoolHTTPServer:
         try:
             while not self._stop.is_set():
                 client_sock, client_addr = srv.accept()
-                # Backpressure: si cola llena, accept sigue aceptando,
-                # pero put() bloqueará y frenará el loop.
-                self._q.put((client_sock, client_addr))
+                self._dispatch(_Connection(client_sock, client_addr), new=True)
         except KeyboardInterrupt:
             log("Servidor detenido por KeyboardInterrupt")
         finally:
@@ -356,60 +668,239 @@ class ManualThreadPoolHTTPServer:
                 self._sock.close()
             except Exception:
                 pass
+        self._idle.stop()
 
         # Despertar workers
-        for _ in self._threads:
-            self._q.put(None)
-
+        self.scheduler.close()
         for t in self._threads:
             t.join(timeout=1.0)
+        for conn in self.scheduler.drain():
+            conn.close()
+
+    def _dispatch(self, conn: _Connection, new: bool = False) -> None:
+        """
+        Encola una conexión según la clase de su siguiente petición, que se
+        lee con MSG_PEEK (queda en el socket para el parser). Si todavía no
+        hay datos espera en _IdleConnections.
+        """
+        try:
+            peek = conn.sock.recv(_PEEK_BYTES, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            self._idle.park(conn, self.read_timeout if new else None)
+            return
+        except OSError:
+            conn.close()
+            return
+        if not peek:
+            conn.close()  # el cliente cerró
+            return
+        cls = classify(peek, final=len(peek) >= _PEEK_BYTES)
+        if cls is None:
+            # Ruta incompleta: se espera al resto (como mucho read_timeout
+            # desde el primer trozo) en lugar de clasificarla mal
+            if not conn.partial:
+                conn.partial = True
+                conn.deadline = time.monotonic() + self.read_timeout
+            self._idle.park_partial(conn)
+            return
+        conn.partial = False
+        self.scheduler.put(conn, cls)
+
+    def _queue_metrics(self):
+        stats = self.scheduler.stats()
+        return [
+            ("portal_queue_depth", "gauge", "Conexiones en cola por clase",
+             [({"class": c}, st["depth"]) for c, st in stats.items()]),
+            ("portal_queue_shed_total", "counter", "Conexiones descartadas con 503 por clase y motivo",
+             [({"class": c, "reason": reason}, st[key])
+              for c, st in stats.items()
+              for reason, key in (("full", "shed_full"), ("deadline", "shed_deadline"))]),
+            ("portal_workers", "gauge", "Workers del pool", [({}, self.workers)]),
+        ]
+
+    @staticmethod
+    def _shed(conn: _Connection, cls: str, reason: str) -> None:
+        """503 inmediato para una conexión descartada por el planificador."""
+        ACCESS.record({
+            "ts": now_iso(),
+            "ip": conn.peer_ip,
+            "status": 503,
+            "shed": cls,
+            "reason": reason,
+            "pid": os.getpid(),
+        })
+        try:
+            conn.sock.setblocking(False)
+            # Consumir lo ya recibido para que close() no mande RST antes de la respuesta
+            while conn.sock.recv(65536):
+                pass
+        except OSError:
+            pass
+        try:
+            conn.sock.send(_SHED_RESPONSE)
+        except OSError:
+            pass
+        conn.close()
+
+    def _serve_connection(self, conn: _Connection) -> bool:
+        """
+        Atiende peticiones de la conexión mientras haya datos en el buffer.
+        Devuelve True si la conexión debe quedar abierta (keep-alive).
+        """
+        while True:
+            keep_alive = False
+            try:
+                conn.sock.settimeout(self.read_timeout)
+                req = conn.reader.read_request(_streamed_body)
+                if req is None:
+                    return False
+                method, path, version, headers, body = req
+                keep_alive = (
+                    self.keepalive_timeout > 0
+                    and conn.reader.requests < self.keepalive_max_requests
+                    and not self._stop.is_set()
+                    and wants_keep_alive(version, headers)
+                )
+                resp = route_request(method, path, headers, body, conn.peer_ip)
+                if isinstance(body, BodyStream) and body.remaining:
+                    keep_alive = False  # quedan bytes del body sin leer
+                if isinstance(resp, StreamResponse):
+                    keep_alive = False  # el socket pasa al hub de eventos
+            except Exception as e:
+                # ValueError: headers demasiado grandes / malformado / payload grande
+                resp, keep_alive = error_response(e), False
+
+            try:
+                send_response(conn.sock, set_connection_header(resp, keep_alive))
+            except Exception:
+                return False
+            if not keep_alive:
+                return False
+            if not conn.reader.has_buffered():
+                return True
 
     def _worker_loop(self):
         while not self._stop.is_set():
-            item = self._q.get()
-            if item is None:
-                self._q.task_done()
+            conn = self.scheduler.get()
+            if conn is None:
                 break
 
-            client_sock, client_addr = item
-            peer_ip = client_addr[0]
-
+            _WORKERS_BUSY.inc()
             try:
-                client_sock.settimeout(5.0)
-                method, path, headers, body = parse_http_request(client_sock)
-                resp = route_request(method, path, headers, body, peer_ip)
-            except ValueError as e:
-                # headers demasiado grandes / malformado / payload grande
-                msg = str(e).encode("utf-8", errors="ignore")
-                if b"payload too large" in msg:
-                    resp = build_response(413, {}, b"Payload Too Large")
-                else:
-                    resp = build_response(400, {}, b"Bad Request")
-            except Exception as e:
-                resp = build_response(500, {}, b"Internal Server Error")
+                keep = self._serve_connection(conn)
+            except Exception:
+                keep = False
             finally:
-                try:
-                    client_sock.sendall(resp)
-                except Exception:
-                    pass
-                try:
-                    client_sock.close()
-                except Exception:
-                    pass
-                self._q.task_done()
+                _WORKERS_BUSY.dec()
+
+            if keep:
+                self._idle.park(conn)
+            else:
+                conn.close()
+
+
+SERVER_MODES = ("threadpool", "asyncio")
+
+
+def _make_server(port: int, mode: str, sock: socket.socket | None = None):
+    if mode == "asyncio":
+        from .async_server import AsyncioHTTPServer
+
+        return AsyncioHTTPServer(
+            "0.0.0.0",
+            port,
+            handler=route_request,
+            workers=SERVER_WORKERS,
+            backlog=LISTEN_BACKLOG,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            keepalive_max_requests=KEEPALIVE_MAX_REQUESTS,
+            sock=sock,
+            streamed=_streamed_body,
+        )
+    if mode == "threadpool":
+        return ManualThreadPoolHTTPServer(
+            "0.0.0.0",
+            port,
+            workers=SERVER_WORKERS,
+            backlog=LISTEN_BACKLOG,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            keepalive_max_requests=KEEPALIVE_MAX_REQUESTS,
+            sock=sock,
+        )
+    raise ValueError(f"modo de servidor desconocido: {mode!r} (opciones: {', '.join(SERVER_MODES)})")
+
+
+def _serve(port: int, mode: str, sock: socket.socket | None = None) -> None:
+    """Arranca los servicios de fondo del proceso y el servidor (bloqueante)."""
+    server = _make_server(port, mode, sock)
+    STATIC.preload()
+    portal.start_session_reconciler()
+    portal.start_session_checkpointer()
+    try:
+        server.start()
+    finally:
+        portal.checkpoint_sessions()
+        # Los hijos pre-fork salen con os._exit: atexit no llega a vaciar la cola
+        ACCESS.close()
 
 
-def run_server(port: int) -> None:
-    srv = ManualThreadPoolHTTPServer("0.0.0.0", port, workers=10)
-    srv.start()
+def run_server(port: int, mode: str = SERVER_MODE, processes: int = PORTAL_PROCESSES) -> None:
+    """
+    Arranca el servidor en el modo indicado:
+    - "threadpool": ManualThreadPoolHTTPServer (accept + cola + N hilos)
+    - "asyncio": AsyncioHTTPServer (bucle de eventos + executor para route_request)
+
+    Con processes > 1 (0 = un proceso por núcleo) arranca un supervisor
+    pre-fork con N procesos, cada uno con su propio servidor del modo elegido.
+
+    Antes de escuchar se restauran las sesiones guardadas al parar (ver
+    session_store); SIGTERM para el servidor como Ctrl+C, para que las
+    vuelva a guardar.
+    """
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+    if mode not in SERVER_MODES:
+        raise ValueError(f"modo de servidor desconocido: {mode!r} (opciones: {', '.join(SERVER_MODES)})")
+
+    portal.restore_sessions()
+
+    if processes == 1:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        _serve(port, mode)
+        return
+
+    # Los hijos abren sus propios sockets/contextos del firewall
+    reset_backend()
+    supervisor = PreforkSupervisor(
+        lambda sock: _serve(port, mode, sock),
+        processes=processes,
+        host="0.0.0.0",
+        port=port,
+        backlog=LISTEN_BACKLOG,
+    )
+    supervisor.run()
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="app.main", description="Backend HTTP del portal cautivo")
+    parser.add_argument("port", nargs="?", type=int, default=8080, help="puerto (PORTAL_PORT tiene prioridad)")
+    parser.add_argument(
+        "--mode",
+        choices=SERVER_MODES,
+        default=SERVER_MODE,
+        help="modelo de concurrencia del servidor (por defecto: SERVER_MODE o threadpool)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=PORTAL_PROCESSES,
+        help="procesos pre-fork (1 = sin fork, 0 = uno por núcleo; por defecto: PORTAL_PROCESSES o 1)",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
+    args = _parse_args(sys.argv[1:])
     env_port = os.getenv("PORTAL_PORT")
-    if env_port:
-        port = int(env_port)
-    elif len(sys.argv) >= 2:
-        port = int(sys.argv[1])
-    else:
-        port = 8080
-    run_server(port)
+    port = int(env_port) if env_port else args.port
+    run_server(port, mode=args.mode, processes=args.processes)
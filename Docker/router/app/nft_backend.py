@@ -0,0 +1,228 @@
+# app/nft_backend.py
+"""
+Backend nftables del set de IPs autenticadas (FIREWALL_BACKEND=nft).
+
+El set lo crea entrypoint.sh: table <familia> <tabla>, set authed
+{ type ipv4_addr; flags timeout; }. Las órdenes se envían como script nft
+a un contexto de libnftables abierto una vez por proceso (ctypes), sin
+fork/exec por operación. Si la librería no se puede cargar (ni por
+find_library ni por su soname), _NftBinary ejecuta cada orden con un
+`nft -f -` nuevo: un proceso por lote, comprobación o listado (ver
+bench/bench_nft.py). No se usa un `nft -i` persistente: su salida no
+delimita dónde acaba cada orden y depende de la librería de línea de
+comandos con que se compiló nft.
+
+Un script nft se aplica como una única transacción: o se aplican todas
+sus líneas o ninguna. Un lote de altas/bajas es un solo script; si falla,
+se leen del error las líneas culpables, esas operaciones se marcan como
+fallidas y el resto se reenvía (no se aplicó nada).
+
+nft no renueva el timeout de un elemento existente con "add element", así
+que cada alta es "add; delete; add con timeout" dentro de la transacción.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import re
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .firewall import FirewallBackend
+from .ipset_batch import Op
+
+_NFT_CTX_OUTPUT_JSON = 1 << 4
+_ERROR_LINE = re.compile(r":(\d+):\d+(?:-\d+)?: Error")
+_NOT_FOUND = ("No such file or directory", "does not exist")
+_LIB_SONAME = "libnftables.so.1"
+
+Result = Tuple[int, str, str]  # (código de salida, salida, error)
+
+
+class _LibNftables:
+    """Contexto de libnftables reutilizado en todas las órdenes del proceso."""
+
+    def __init__(self, lib):
+        self._lib = lib
+        lib.nft_ctx_new.restype = ctypes.c_void_p
+        lib.nft_ctx_new.argtypes = [ctypes.c_uint32]
+        for name in ("nft_ctx_buffer_output", "nft_ctx_buffer_error"):
+            getattr(lib, name).argtypes = [ctypes.c_void_p]
+        for name in ("nft_ctx_get_output_buffer", "nft_ctx_get_error_buffer"):
+            getattr(lib, name).restype = ctypes.c_char_p
+            getattr(lib, name).argtypes = [ctypes.c_void_p]
+        lib.nft_ctx_output_get_flags.restype = ctypes.c_uint
+        lib.nft_ctx_output_get_flags.argtypes = [ctypes.c_void_p]
+        lib.nft_ctx_output_set_flags.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+        lib.nft_run_cmd_from_buffer.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.nft_ctx_free.argtypes = [ctypes.c_void_p]
+
+        self._ctx = lib.nft_ctx_new(0)
+        if not self._ctx:
+            raise OSError("nft_ctx_new falló")
+        lib.nft_ctx_buffer_output(self._ctx)
+        lib.nft_ctx_buffer_error(self._ctx)
+        self._flags = lib.nft_ctx_output_get_flags(self._ctx)
+
+    def close(self) -> None:
+        if self._ctx:
+            self._lib.nft_ctx_free(ctypes.c_void_p(self._ctx))
+            self._ctx = None
+
+    @classmethod
+    def load(cls) -> Optional["_LibNftables"]:
+        # find_library depende de ldconfig; sin él se prueba directamente el soname
+        error: Optional[Exception] = None
+        for path in dict.fromkeys(filter(None, (ctypes.util.find_library("nftables"), _LIB_SONAME))):
+            try:
+                return cls(ctypes.CDLL(path))
+            except (OSError, AttributeError) as e:
+                error = e
+        print(f"No se pudo cargar libnftables ({error}); usando el binario nft (un proceso por orden)")
+        return None
+
+    def run(self, script: str, json_output: bool = False) -> Result:
+        flags = self._flags | _NFT_CTX_OUTPUT_JSON if json_output else self._flags
+        self._lib.nft_ctx_output_set_flags(self._ctx, flags)
+        rc = self._lib.nft_run_cmd_from_buffer(self._ctx, script.encode())
+        # Leer los buffers los vacía para la orden siguiente
+        out = (self._lib.nft_ctx_get_output_buffer(self._ctx) or b"").decode(errors="replace")
+        err = (self._lib.nft_ctx_get_error_buffer(self._ctx) or b"").decode(errors="replace")
+        return rc, out, err
+
+
+class _NftBinary:
+    """
+    Alternativa a libnftables: cada orden es un `nft -f -` nuevo (o
+    `nft -j -f -` para los listados), con el script por stdin. El lote
+    sigue siendo una única transacción; el coste es un fork/exec y el
+    arranque de nft por orden, así que conviene dejar activos los lotes
+    (IPSET_BATCH_WINDOW_MS > 0).
+    """
+
+    def __init__(self, binary: str = "nft"):
+        # Ruta resuelta una vez, no en cada exec
+        self.binary = shutil.which(binary) or binary
+        self.runs = 0
+
+    def run(self, script: str, json_output: bool = False) -> Result:
+        cmd = [self.binary, "-j", "-f", "-"] if json_output else [self.binary, "-f", "-"]
+        self.runs += 1
+        try:
+            res = subprocess.run(cmd, input=script, capture_output=True, text=True)
+            return res.returncode, res.stdout, res.stderr
+        except OSError as e:
+            return 1, "", str(e)
+
+
+def parse_nft_set(text: str) -> Dict[str, int]:
+    """
+    Salida JSON de `nft -j list set ...` → {ip: segundos restantes}.
+    Los elementos con timeout vienen como {"elem": {"val": ip, "expires": s}},
+    los demás como la IP sola.
+    """
+    entries: Dict[str, int] = {}
+    for obj in json.loads(text).get("nftables", []):
+        for elem in obj.get("set", {}).get("elem", []) if isinstance(obj, dict) else []:
+            if isinstance(elem, dict) and "elem" in elem:
+                inner = elem["elem"]
+                entries[str(inner.get("val"))] = int(inner.get("expires", 0))
+            elif isinstance(elem, str):
+                entries[elem] = 0
+    return entries
+
+
+class NftBackend(FirewallBackend):
+    name = "nft"
+
+    def __init__(self, family: str = "inet", table: str = "portal", setname: str = "authed",
+                 runner=None):
+        self.target = f"{family} {table} {setname}"
+        self._lock = threading.Lock()  # un contexto de libnftables no admite llamadas concurrentes
+        # Sin runner, el contexto de libnftables se abre en el primer uso del
+        # proceso (no antes de un fork, ver reset)
+        self._runner = runner
+        self._lib: Optional[_LibNftables] = None
+        self._lib_loaded = runner is not None
+
+    def _run(self, script: str, json_output: bool = False) -> Result:
+        with self._lock:
+            if not self._lib_loaded:
+                self._lib = _LibNftables.load()
+                self._runner = self._lib.run if self._lib is not None else _NftBinary().run
+                self._lib_loaded = True
+            return self._runner(script, json_output)
+
+    def reset(self) -> None:
+        with self._lock:
+            if self._lib is not None:
+                self._lib.close()
+                self._lib = None
+                self._runner = None
+                self._lib_loaded = False
+
+    def _lines(self, op: Op) -> List[str]:
+        kind, ip, timeout = op
+        element = f"element {self.target} {{ {ip} }}"
+        if kind == "add":
+            return [f"add {element}", f"delete {element}",
+                    f"add element {self.target} {{ {ip} timeout {int(timeout)}s }}"]
+        return [f"delete {element}"]
+
+    def add(self, ip: str, timeout: int) -> bool:
+        return self.apply_batch([("add", ip, timeout)])[0]
+
+    def remove(self, ip: str) -> bool:
+        return self.apply_batch([("del", ip, None)])[0]
+
+    def test(self, ip: str) -> Optional[bool]:
+        rc, _, err = self._run(f"get element {self.target} {{ {ip} }}")
+        if rc == 0:
+            return True
+        if any(s in err for s in _NOT_FOUND):
+            return False
+        print(f"Error nft comprobando {ip}: {err.strip()}")
+        return None
+
+    def list_entries(self) -> Optional[Dict[str, int]]:
+        rc, out, err = self._run(f"list set {self.target}", json_output=True)
+        if rc != 0:
+            print(f"Error listando el set nft: {err.strip()}")
+            return None
+        try:
+            return parse_nft_set(out)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Salida de nft no válida: {e}")
+            return None
+
+    def apply_batch(self, ops: List[Op]) -> List[bool]:
+        results = [False] * len(ops)
+        pending = list(range(len(ops)))
+        while pending:
+            lines: List[str] = []
+            owner: List[int] = []  # línea del script (desde 0) -> índice de operación
+            for i in pending:
+                for line in self._lines(ops[i]):
+                    lines.append(line)
+                    owner.append(i)
+            rc, _, err = self._run("\n".join(lines) + "\n")
+            if rc == 0:
+                for i in pending:
+                    results[i] = True
+                break
+            failed = {owner[int(n) - 1] for n in _ERROR_LINE.findall(err) if 0 < int(n) <= len(owner)}
+            if not failed:
+                if len(pending) == 1:
+                    print(f"Error en nft para {ops[pending[0]][0]} {ops[pending[0]][1]}: {err.strip()}")
+                    break
+                # Sin número de línea: aplicar de una en una
+                for i in pending:
+                    results[i] = self.apply_batch([ops[i]])[0]
+                break
+            for i in sorted(failed):
+                print(f"Error en nft para {ops[i][0]} {ops[i][1]}: {err.strip()}")
+            # La transacción no se aplicó: reenviar las que no fallaron
+            pending = [i for i in pending if i not in failed]
+        return results
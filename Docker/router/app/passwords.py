@@ -0,0 +1,255 @@
+# app/passwords.py
+"""
+Hash de contraseñas con sal (hashlib.scrypt, o PBKDF2-SHA256 si el
+OpenSSL del sistema no trae scrypt) y verificación fuera de los hilos HTTP.
+
+- Formato almacenado en el campo "p" de users.json:
+    scrypt$<n>$<r>$<p>$<sal_b64>$<hash_b64>
+    pbkdf2_sha256$<iteraciones>$<sal_b64>$<hash_b64>
+  Cualquier otro valor se considera contraseña en claro (formato antiguo)
+  y se sigue aceptando hasta migrarla.
+- El hash es deliberadamente lento, así que se calcula en un pool de
+  procesos dedicado con un límite de peticiones en vuelo: los workers
+  HTTP solo esperan el resultado y un pico de logins no los satura.
+- Las verificaciones correctas recientes se guardan en una caché pequeña
+  con expiración, para que las peticiones HTTP Basic repetidas del panel
+  de administración no vuelvan a calcular el hash.
+
+Migración de users.json (desde Docker/router o /opt/captive-portal):
+    python3 -m app.passwords migrate          # reescribe USERS_FILE con hashes
+    python3 -m app.passwords hash <password>  # hash para USERS_JSON
+"""
+
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from .config import (
+    PASSWORD_CACHE_SIZE,
+    PASSWORD_CACHE_TTL,
+    PASSWORD_MAX_PENDING,
+    PASSWORD_WORKERS,
+)
+
+_SCRYPT_N = 2 ** 14
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+_PBKDF2_ITERATIONS = 600_000
+_SALT_BYTES = 16
+
+_HAS_SCRYPT = hasattr(hashlib, "scrypt")
+
+
+class PasswordBusyError(Exception):
+    """Demasiadas verificaciones en curso: el pool está saturado."""
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password: str) -> str:
+    """Calcula el hash con sal de password (lento; ver PasswordVerifier.hash)."""
+    salt = secrets.token_bytes(_SALT_BYTES)
+    pw = password.encode("utf-8")
+    if _HAS_SCRYPT:
+        dk = hashlib.scrypt(pw, salt=salt, n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P)
+        return f"scrypt${_SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}${_b64(salt)}${_b64(dk)}"
+    dk = hashlib.pbkdf2_hmac("sha256", pw, salt, _PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${_PBKDF2_ITERATIONS}${_b64(salt)}${_b64(dk)}"
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+
+def check_password(password: str, stored: str) -> bool:
+    """Compara password con el valor almacenado (hash o texto en claro)."""
+    pw = password.encode("utf-8")
+    try:
+        if stored.startswith("scrypt$"):
+            _, n, r, p, salt, expected = stored.split("$")
+            expected = base64.b64decode(expected)
+            dk = hashlib.scrypt(
+                pw, salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p), dklen=len(expected)
+            )
+            return hmac.compare_digest(dk, expected)
+        if stored.startswith("pbkdf2_sha256$"):
+            _, iterations, salt, expected = stored.split("$")
+            expected = base64.b64decode(expected)
+            dk = hashlib.pbkdf2_hmac(
+                "sha256", pw, base64.b64decode(salt), int(iterations), dklen=len(expected)
+            )
+            return hmac.compare_digest(dk, expected)
+    except (ValueError, TypeError):
+        return False
+    # Formato antiguo: contraseña en claro
+    return hmac.compare_digest(pw, stored.encode("utf-8"))
+
+
+class _VerifiedCache:
+    """
+    Caché LRU acotada de verificaciones correctas recientes.
+    La clave es un HMAC (con clave aleatoria del proceso) de usuario y
+    contraseña: la contraseña nunca se guarda. La entrada solo vale si el
+    valor almacenado no ha cambiado desde entonces y no ha expirado.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._entries: OrderedDict[bytes, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        msg = username.encode("utf-8") + b"\0" + password.encode("utf-8")
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def hit(self, username: str, password: str, stored: str) -> bool:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return False
+        k = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is None:
+                return False
+            cached_stored, expires = entry
+            if cached_stored != stored or expires < time.monotonic():
+                del self._entries[k]
+                return False
+            self._entries.move_to_end(k)
+            return True
+
+    def add(self, username: str, password: str, stored: str) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        k = self._digest(username, password)
+        with self._lock:
+            self._entries[k] = (stored, time.monotonic() + self.ttl)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class PasswordVerifier:
+    """
+    Verificación y hash de contraseñas en un pool de procesos dedicado.
+
+    workers=0 calcula el hash en el hilo que llama (sin pool).
+    max_pending limita las operaciones en vuelo; si se supera durante más
+    de wait_timeout segundos se lanza PasswordBusyError. Si un proceso del
+    pool muere (OOM, señal), el pool entero queda roto: se sustituye por
+    uno nuevo y la operación se reintenta una vez.
+    """
+
+    def __init__(self, *, workers: int, max_pending: int, cache_size: int, cache_ttl: float,
+                 wait_timeout: float = 5.0):
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._cache = _VerifiedCache(cache_size, cache_ttl)
+        self._pool: Optional[Executor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> Optional[Executor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # forkserver/spawn: no heredar los hilos del servidor en el fork
+                    methods = multiprocessing.get_all_start_methods()
+                    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    def _discard_pool(self, pool: Executor) -> None:
+        """Descarta pool (roto) si sigue siendo el actual; el siguiente _get_pool crea otro."""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                print("Pool de contraseñas roto (murió un proceso); se crea uno nuevo")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        pool = self._get_pool()
+        if pool is None:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise PasswordBusyError("demasiadas verificaciones de contraseña en curso")
+        try:
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+            return self._get_pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def verify(self, username: str, password: str, stored: Optional[str]) -> bool:
+        if stored is None:
+            return False
+        if not is_hashed(stored):
+            # Texto en claro (formato antiguo): comparación directa, sin pool
+            return check_password(password, stored)
+        if self._cache.hit(username, password, stored):
+            return True
+        ok = self._run(check_password, password, stored)
+        if ok:
+            self._cache.add(username, password, stored)
+        return ok
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_VERIFIER = PasswordVerifier(
+    workers=PASSWORD_WORKERS,
+    max_pending=PASSWORD_MAX_PENDING,
+    cache_size=PASSWORD_CACHE_SIZE,
+    cache_ttl=PASSWORD_CACHE_TTL,
+)
+
+
+def verify_password(username: str, password: str, stored: Optional[str]) -> bool:
+    """True si password corresponde al valor almacenado de username."""
+    return _VERIFIER.verify(username, password, stored)
+
+
+def make_password_hash(password: str) -> str:
+    """Hash con sal de password, calculado en el pool de verificación."""
+    return _VERIFIER.hash(password)
+
+
+def _migrate_users_file() -> int:
+    """Reescribe USERS_FILE con todas las contraseñas en claro convertidas a hash."""
+    from .users import migrate_plaintext_passwords
+
+    migrated = migrate_plaintext_passwords(hash_password)
+    print(f"{migrated} contraseñas migradas a hash")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        sys.exit(_migrate_users_file())
+    if len(sys.argv) >= 3 and sys.argv[1] == "hash":
+        print(hash_password(sys.argv[2]))
+        sys.exit(0)
+    print("Uso: python3 -m app.passwords migrate | hash <password>", file=sys.stderr)
+    sys.exit(2)
@@ -0,0 +1,179 @@
+# app/prefork.py
+"""
+Modo multiproceso (pre-fork) para aprovechar todos los núcleos.
+
+Un proceso supervisor lanza N procesos hijo; cada hijo ejecuta un servidor
+completo (threadpool o asyncio) sobre el mismo puerto:
+- con SO_REUSEPORT cada hijo abre su propio socket y el kernel reparte
+  las conexiones entrantes entre ellos;
+- sin SO_REUSEPORT el supervisor abre un único socket antes del fork y
+  los hijos lo heredan (todos hacen accept() sobre él).
+
+El supervisor reinicia los hijos que mueran y, al recibir SIGTERM/SIGINT,
+los detiene ordenadamente (SIGTERM, y SIGKILL si no salen a tiempo).
+Solo Linux/Unix (usa os.fork).
+"""
+
+import os
+import signal
+import socket
+import time
+from typing import Callable
+
+from .http_utils import log
+
+# Si un hijo muere antes de este tiempo se espera antes de relanzarlo,
+# para no entrar en un bucle de fork si falla al arrancar.
+_MIN_UPTIME = 1.0
+
+_SUPERVISOR_SIGNALS = (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+def create_listen_socket(host: str, port: int, backlog: int, *, reuseport: bool = False) -> socket.socket:
+    """Crea el socket servidor TCP (opcionalmente con SO_REUSEPORT)."""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    srv.bind((host, port))
+    srv.listen(backlog)
+    return srv
+
+
+def reuseport_available() -> bool:
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+class PreforkSupervisor:
+    """
+    Supervisor de procesos hijo. serve(sock) se ejecuta en cada hijo con el
+    socket de escucha ya creado y debe bloquear mientras el servidor viva.
+    """
+
+    def __init__(
+        self,
+        serve: Callable[[socket.socket], None],
+        *,
+        processes: int,
+        host: str,
+        port: int,
+        backlog: int = 128,
+        reuseport: bool = True,
+        grace: float = 10.0,
+    ):
+        self.serve = serve
+        self.processes = max(1, processes)
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.reuseport = reuseport and reuseport_available()
+        self.grace = grace
+        self._children: dict[int, tuple[int, float]] = {}  # pid -> (slot, started_at)
+        self._shared_sock: socket.socket | None = None
+        self._stopping = False
+
+    def run(self):
+        if not self.reuseport:
+            self._shared_sock = create_listen_socket(self.host, self.port, self.backlog)
+
+        # Las señales se atienden de forma síncrona con sigtimedwait
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SUPERVISOR_SIGNALS)
+
+        share = "SO_REUSEPORT" if self.reuseport else "socket heredado"
+        log(f"Supervisor pre-fork (pid={os.getpid()}) lanzando {self.processes} procesos en "
+            f"{self.host}:{self.port} ({share})")
+        for slot in range(self.processes):
+            self._spawn(slot)
+
+        try:
+            while not self._stopping:
+                info = signal.sigtimedwait(_SUPERVISOR_SIGNALS, 1.0)
+                if info is None or info.si_signo == signal.SIGCHLD:
+                    self._reap_and_respawn()
+                else:
+                    log(f"Supervisor: recibida señal {signal.Signals(info.si_signo).name}, deteniendo hijos")
+                    self._stopping = True
+        finally:
+            self._shutdown()
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            # Hijo: señales por defecto; SIGTERM se trata como Ctrl+C para
+            # que el servidor salga por su camino normal de parada.
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, _SUPERVISOR_SIGNALS)
+                sock = self._shared_sock
+                if sock is None:
+                    sock = create_listen_socket(self.host, self.port, self.backlog, reuseport=True)
+                self.serve(sock)
+            except KeyboardInterrupt:
+                pass
+            except BaseException as e:
+                log(f"Proceso {os.getpid()} terminó con error: {e!r}")
+                code = 1
+            finally:
+                os._exit(code)
+
+        self._children[pid] = (slot, time.monotonic())
+        log(f"Supervisor: proceso {slot + 1}/{self.processes} iniciado (pid={pid})")
+
+    def _reap_and_respawn(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot, started = self._children.pop(pid, (None, 0.0))
+            if slot is None:
+                continue
+            log(f"Supervisor: proceso pid={pid} terminó ({_describe_status(status)})")
+            if self._stopping:
+                continue
+            if time.monotonic() - started < _MIN_UPTIME:
+                time.sleep(_MIN_UPTIME)
+            self._spawn(slot)
+
+    def _shutdown(self):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._children.pop(pid, None)
+
+        deadline = time.monotonic() + self.grace
+        while self._children and time.monotonic() < deadline:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.05)
+                continue
+            self._children.pop(pid, None)
+
+        for pid in list(self._children):
+            log(f"Supervisor: pid={pid} no terminó a tiempo, enviando SIGKILL")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self._children.clear()
+
+        if self._shared_sock is not None:
+            self._shared_sock.close()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _SUPERVISOR_SIGNALS)
+        log("Supervisor detenido")
+
+
+def _describe_status(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f"señal {signal.Signals(os.WTERMSIG(status)).name}"
+    return f"código {os.waitstatus_to_exitcode(status)}"
@@ -0,0 +1,63 @@
+# app/ratelimit.py
+"""
+Limitación de peticiones por IP con token bucket (solo librerías estándar).
+
+Cada IP tiene un bucket de burst tokens que se rellena a rate tokens por
+segundo; cada petición gasta uno. Los buckets viven en una tabla LRU de
+tamaño fijo (max_entries): al llenarse se descarta la IP menos reciente,
+así que la memoria no crece con el número de IPs vistas. Una IP
+descartada vuelve con el bucket lleno, que es lo mismo que verá tras
+burst / rate segundos sin peticiones.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: int, max_entries: int = 10000):
+        self.rate = rate
+        self.burst = float(max(1, burst))
+        self.max_entries = max_entries
+        self._buckets: OrderedDict = OrderedDict()  # key -> [tokens, monotonic de la última recarga]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def check(self, key: str) -> float:
+        """
+        Gasta un token de key. Devuelve 0.0 si la petición pasa o, si no,
+        los segundos hasta que haya un token (para Retry-After).
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_entries:
+                    self._buckets.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                self.allowed += 1
+                return 0.0
+            self.rejected += 1
+            return (1.0 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "tracked": len(self._buckets),
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,162 @@
+# app/scheduler.py
+"""
+Cola de trabajo con clases de prioridad para el servidor threadpool.
+
+Cada conexión con una petición lista se clasifica por su línea de petición
+(leída con MSG_PEEK, sin consumirla; si aún no ha llegado la ruta entera se
+espera al resto) y entra en la cola de su clase:
+    fast   estáticos, /status, /status.json, /status/events y GET del login
+    auth   POST /login y /logout (hash de contraseña, ipset)
+    admin  /admin/* (renderiza la lista de usuarios)
+Cada clase tiene un máximo de conexiones en cola y un plazo (deadline).
+Los workers atienden primero la cabeza con el plazo más próximo (EDF), así
+que las clases con plazos cortos adelantan a las de plazos largos sin
+dejarlas sin servicio. Si la cola de una clase está llena, o una conexión
+supera su plazo esperando, se descarta con shed_fn(item, clase, motivo)
+(503 inmediato) en lugar de atenderla tarde.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_CLASS = "auth"
+
+_FAST_PATHS = ("/", "/login", "/status", "/status.json", "/status/events")
+
+
+class RequestClass(NamedTuple):
+    name: str
+    max_queue: int      # conexiones en cola (0 = sin límite)
+    deadline: float     # segundos máximos de espera en cola
+
+
+def classify(peek: bytes, final: bool = False) -> Optional[str]:
+    """
+    Clase de una petición a partir del inicio de su línea de petición, o
+    None si la ruta aún no ha llegado entera (línea partida entre segmentos
+    TCP, p. ej. "GET /adm"). Con final se clasifica con lo que haya.
+    """
+    line, crlf, _ = peek.lstrip(b"\r\n").partition(b"\r\n")
+    parts = line.split(b" ", 2)
+    if not (crlf or final or len(parts) == 3 or b"?" in line):
+        return None
+    if len(parts) < 2:
+        return DEFAULT_CLASS
+    method = parts[0]
+    path = parts[1].split(b"?", 1)[0].decode("latin-1")
+    if path.startswith("/admin"):
+        return "admin"
+    if method in (b"GET", b"HEAD") and (path.startswith("/static/") or path in _FAST_PATHS):
+        return "fast"
+    return DEFAULT_CLASS
+
+
+class _ClassQueue:
+    __slots__ = ("spec", "items", "enqueued", "served", "shed_full", "shed_deadline", "waits")
+
+    def __init__(self, spec: RequestClass, samples: int):
+        self.spec = spec
+        self.items: Deque[Tuple[float, object]] = deque()  # (monotonic de entrada, item)
+        self.enqueued = 0
+        self.served = 0
+        self.shed_full = 0
+        self.shed_deadline = 0
+        self.waits: Deque[float] = deque(maxlen=samples)  # segundos en cola de los últimos atendidos
+
+
+class PriorityScheduler:
+    def __init__(self, classes: List[RequestClass], shed_fn: Callable[[object, str, str], None],
+                 samples: int = 1024, on_wait: Optional[Callable[[str, float], None]] = None):
+        self.shed_fn = shed_fn
+        self.on_wait = on_wait  # on_wait(clase, segundos en cola) por cada item atendido
+        self._queues: Dict[str, _ClassQueue] = {c.name: _ClassQueue(c, samples) for c in classes}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item, cls: str) -> bool:
+        """Encola item en su clase; si la cola está llena lo descarta (shed_fn) y devuelve False."""
+        q = self._queues.get(cls) or self._queues[DEFAULT_CLASS]
+        with self._cond:
+            full = q.spec.max_queue > 0 and len(q.items) >= q.spec.max_queue
+            if full:
+                q.shed_full += 1
+            else:
+                q.items.append((time.monotonic(), item))
+                q.enqueued += 1
+                self._cond.notify()
+        if full:
+            self.shed_fn(item, q.spec.name, "cola llena")
+            return False
+        return True
+
+    def get(self) -> Optional[object]:
+        """Siguiente item a atender (bloquea); None tras close()."""
+        while True:
+            expired: List[Tuple[object, str]] = []
+            item = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        break
+                    now = time.monotonic()
+                    best: Optional[_ClassQueue] = None
+                    for q in self._queues.values():
+                        # Las cabezas que ya superaron su plazo se descartan
+                        while q.items and now - q.items[0][0] > q.spec.deadline:
+                            expired.append((q.items.popleft()[1], q.spec.name))
+                            q.shed_deadline += 1
+                        if q.items and (best is None or
+                                        q.items[0][0] + q.spec.deadline < best.items[0][0] + best.spec.deadline):
+                            best = q
+                    if best is not None:
+                        enqueued_at, item = best.items.popleft()
+                        best.served += 1
+                        best.waits.append(now - enqueued_at)
+                        served = (best.spec.name, now - enqueued_at)
+                        break
+                    if expired:
+                        break  # descartar fuera del lock antes de seguir esperando
+                    self._cond.wait()
+            for dropped, name in expired:
+                self.shed_fn(dropped, name, "plazo vencido")
+            if item is not None and self.on_wait is not None:
+                self.on_wait(*served)
+            if item is not None or self._closed:
+                return item
+
+    def close(self) -> None:
+        """Despierta a todos los workers; get() devuelve None a partir de aquí."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def drain(self) -> List[object]:
+        """Saca todo lo que quede en cola (al parar)."""
+        with self._cond:
+            items = [item for q in self._queues.values() for _, item in q.items]
+            for q in self._queues.values():
+                q.items.clear()
+        return items
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Por clase: profundidad, contadores y espera en cola (ms) de los últimos atendidos."""
+        out = {}
+        with self._cond:
+            for name, q in self._queues.items():
+                waits = sorted(q.waits)
+                n = len(waits)
+                out[name] = {
+                    "depth": len(q.items),
+                    "max_queue": q.spec.max_queue,
+                    "deadline_ms": q.spec.deadline * 1000.0,
+                    "enqueued": q.enqueued,
+                    "served": q.served,
+                    "shed_full": q.shed_full,
+                    "shed_deadline": q.shed_deadline,
+                    "wait_ms_avg": (sum(waits) / n * 1000.0) if n else 0.0,
+                    "wait_ms_p95": waits[min(n - 1, int(n * 0.95))] * 1000.0 if n else 0.0,
+                    "wait_ms_max": waits[-1] * 1000.0 if n else 0.0,
+                }
+        return out
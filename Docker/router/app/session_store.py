@@ -0,0 +1,162 @@
+# app/session_store.py
+"""
+Instantánea en disco de las sesiones autenticadas (SESSIONS_FILE), para
+que reiniciar el portal no deje sin acceso a todos los clientes a la vez.
+
+- Formato compacto, una sola línea JSON:
+    {"v":1,"saved":<epoch>,"sessions":[[ip,usuario|null,expira,login],...]}
+  con las horas en tiempo de reloj (epoch): el reloj monotónico de la
+  tabla de sesiones no sobrevive al reinicio.
+- SessionCheckpointer la escribe cada SESSION_CHECKPOINT_INTERVAL segundos
+  y al parar. Las IPs y los tiempos restantes salen del set 'authed' (que
+  incluye las sesiones de otros procesos pre-fork); el usuario, de la
+  tabla SESSIONS o, si este proceso no lo conoce, de la instantánea
+  anterior. Escritura atómica (temporal + rename) bajo flock.
+- restore() la lee al arrancar, antes de aceptar conexiones, y devuelve
+  al set las sesiones no expiradas en un único lote.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .sessions import SessionTable
+from .user_journal import atomic_write
+
+
+class SavedSession(NamedTuple):
+    ip: str
+    user: Optional[str]
+    expires: float   # time.time() de expiración
+    login_at: float  # time.time() del login
+
+
+def load(path: Path) -> List[SavedSession]:
+    """Sesiones de la instantánea (vacía si no existe o no se puede leer)."""
+    try:
+        data = json.loads(path.read_bytes())
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print(f"Instantánea de sesiones {path} ilegible ({e}); se ignora")
+        return []
+    sessions = []
+    for item in data.get("sessions", []) if isinstance(data, dict) else []:
+        try:
+            ip, user, expires, login_at = item
+            sessions.append(SavedSession(str(ip), user if isinstance(user, str) else None,
+                                         float(expires), float(login_at)))
+        except (TypeError, ValueError):
+            continue
+    return sessions
+
+
+def save(path: Path, sessions: List[SavedSession]) -> None:
+    data = {
+        "v": 1,
+        "saved": int(time.time()),
+        "sessions": [[s.ip, s.user, int(s.expires), int(s.login_at)] for s in sessions],
+    }
+    atomic_write(path, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Lock exclusivo entre procesos para leer y reescribir la instantánea."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path.with_name(path.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # libera el flock
+
+
+def collect(table: SessionTable, entries: Optional[Dict[str, int]],
+            previous: List[SavedSession]) -> List[SavedSession]:
+    """
+    Sesiones a guardar: las de entries ({ip: segundos restantes}, el set)
+    con usuario y hora de login de table o de previous. Si no se pudo leer
+    el set (entries None), las de la tabla.
+    """
+    now_mono = time.monotonic()
+    now = time.time()
+    known = {s.ip: s for s in table.active()}
+    prev = {s.ip: s for s in previous}
+    if entries is None:
+        entries = {ip: s.remaining(now_mono) for ip, s in known.items()}
+    sessions = []
+    for ip, remaining in entries.items():
+        if remaining <= 0:
+            continue  # sin timeout o a punto de expirar
+        s, p = known.get(ip), prev.get(ip)
+        if s is not None and s.user is not None:
+            user, login_at = s.user, s.login_at
+        elif p is not None:
+            user, login_at = p.user, p.login_at
+        else:
+            user, login_at = None, s.login_at if s is not None else now
+        sessions.append(SavedSession(ip, user, now + remaining, login_at))
+    return sessions
+
+
+def restore(path: Path, table: SessionTable,
+            restore_fn: Callable[[Dict[str, int]], List[bool]]) -> Tuple[int, int, int]:
+    """
+    Devuelve al set (restore_fn, un único lote) y a table las sesiones no
+    expiradas de la instantánea. Devuelve (restauradas, expiradas, fallidas).
+    """
+    saved = load(path)
+    now = time.time()
+    live = {s.ip: s for s in saved if s.expires - now >= 1}
+    results = restore_fn({ip: int(s.expires - now) for ip, s in live.items()})
+    restored = failed = 0
+    for s, ok in zip(live.values(), results):
+        if ok:
+            table.add(s.ip, s.user, int(s.expires - now), login_at=s.login_at)
+            restored += 1
+        else:
+            failed += 1
+    return restored, len(saved) - len(live), failed
+
+
+class SessionCheckpointer:
+    """Hilo daemon que guarda las sesiones en path cada interval segundos (0 = solo con checkpoint())."""
+
+    def __init__(self, table: SessionTable, list_fn: Callable[[], Optional[Dict[str, int]]],
+                 path: Path, interval: float):
+        self.table = table
+        self.list_fn = list_fn
+        self.path = Path(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def checkpoint(self) -> int:
+        """Escribe la instantánea ahora; devuelve cuántas sesiones guardó."""
+        entries = self.list_fn()
+        with _locked(self.path):
+            sessions = collect(self.table, entries, load(self.path))
+            save(self.path, sessions)
+        return len(sessions)
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="session-checkpoint", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except OSError as e:
+                print(f"Error guardando la instantánea de sesiones: {e}")
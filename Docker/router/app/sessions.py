@@ -0,0 +1,175 @@
+# app/sessions.py
+"""
+Tabla en memoria de las sesiones autenticadas del proceso.
+
+El portal sabe cuándo y con qué timeout añade cada IP al ipset, así que
+/status.json, el logout y el panel de administración se responden desde
+aquí sin preguntar al kernel. Las expiraciones se ordenan en un heap
+(borrado perezoso: una entrada del heap solo vale si coincide con la
+sesión actual de esa IP).
+
+Un hilo de reconciliación vuelve a sincronizar la tabla con el set
+'authed' cada SESSION_RECONCILE_INTERVAL segundos, para recoger cambios
+externos (ipset manual, reinicios, otros procesos en modo pre-fork).
+"""
+
+import heapq
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+class Session(NamedTuple):
+    ip: str
+    user: Optional[str]     # None si la sesión se descubrió en el ipset
+    login_at: float         # time.time() del login
+    expires: float          # time.monotonic() de expiración
+    added: float            # time.monotonic() de alta en la tabla
+
+    def remaining(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        return max(0, int(self.expires - now))
+
+
+class SessionTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Session] = {}
+        self._heap: List[tuple] = []  # (expires, ip)
+        self._removed: Dict[str, float] = {}  # ip -> monotonic de la baja (desde la última reconciliación)
+        self._listeners: List[Callable[[str], None]] = []
+        self.reconciles = 0
+
+    def add_listener(self, fn: Callable[[str], None]) -> None:
+        """fn(ip) se llama (fuera del lock) tras cada alta o baja explícita de ip."""
+        self._listeners.append(fn)
+
+    def _notify(self, ip: str) -> None:
+        for fn in self._listeners:
+            fn(ip)
+
+    def _purge(self, now: float) -> None:
+        """Elimina las sesiones expiradas (llamar con _lock)."""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, ip = heapq.heappop(heap)
+            s = self._sessions.get(ip)
+            if s is not None and s.expires == expires:
+                del self._sessions[ip]
+
+    def _put(self, session: Session) -> None:
+        self._sessions[session.ip] = session
+        heapq.heappush(self._heap, (session.expires, session.ip))
+
+    def add(self, ip: str, user: Optional[str], timeout: int, login_at: Optional[float] = None) -> Session:
+        """Alta de ip por timeout segundos; login_at (time.time()) solo al restaurar sesiones."""
+        now = time.monotonic()
+        session = Session(ip, user, time.time() if login_at is None else login_at, now + timeout, now)
+        with self._lock:
+            self._purge(now)
+            self._put(session)
+        self._notify(ip)
+        return session
+
+    def remove(self, ip: str) -> Optional[Session]:
+        with self._lock:
+            self._removed[ip] = time.monotonic()
+            session = self._sessions.pop(ip, None)
+        self._notify(ip)
+        return session
+
+    def get(self, ip: str) -> Optional[Session]:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            return self._sessions.get(ip)
+
+    def active(self) -> List[Session]:
+        """Sesiones vigentes, de la que expira antes a la que expira después."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            sessions = list(self._sessions.values())
+        sessions.sort(key=lambda s: s.expires)
+        return sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def reconcile(self, entries: Dict[str, int], started: float) -> None:
+        """
+        Sustituye la tabla por el contenido del ipset (entries: {ip: segundos
+        restantes}, leído a partir de started). Conserva usuario y hora de
+        login de las IPs conocidas y respeta las altas y bajas posteriores a
+        started, que el volcado puede no reflejar todavía.
+        """
+        now = time.monotonic()
+        wall = time.time()
+        with self._lock:
+            old = self._sessions
+            self._sessions = {}
+            self._heap = []
+            for ip, remaining in entries.items():
+                if self._removed.get(ip, -1.0) >= started:
+                    continue
+                prev = old.get(ip)
+                if prev is not None and prev.added >= started:
+                    session = prev  # re-login posterior al volcado
+                elif prev is not None:
+                    session = prev._replace(expires=now + remaining)
+                else:
+                    session = Session(ip, None, wall, now + remaining, now)
+                self._put(session)
+            for ip, prev in old.items():
+                if ip not in entries and prev.added >= started:
+                    self._put(prev)
+            self._removed.clear()
+            self._purge(now)
+            self.reconciles += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._heap.clear()
+            self._removed.clear()
+
+
+class SessionReconciler:
+    """Hilo daemon que llama a table.reconcile(list_fn()) cada interval segundos."""
+
+    def __init__(self, table: SessionTable, list_fn: Callable[[], Optional[Dict[str, int]]],
+                 interval: float):
+        self.table = table
+        self.list_fn = list_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sync(self) -> bool:
+        started = time.monotonic()
+        entries = self.list_fn()
+        if entries is None:
+            return False  # error leyendo el ipset: se mantiene la tabla
+        self.table.reconcile(entries, started)
+        return True
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="session-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error reconciliando sesiones con ipset: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+SESSIONS = SessionTable()
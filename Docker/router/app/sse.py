@@ -0,0 +1,284 @@
+# app/sse.py
+"""
+Server-Sent Events para el estado de la sesión (/status/events).
+
+Cada pestaña de /status mantiene una conexión abierta y el servidor solo
+escribe cuando cambia el estado de su IP:
+    status   estado inicial (y cambios de expiración, p. ej. re-login)
+    auth     la IP pasa a estar autenticada
+    warning  quedan menos de warning_seconds de sesión (una vez por sesión)
+    logout   la sesión terminó (reason: "logout" o "expired")
+El data de cada evento es el mismo JSON que /status.json.
+
+Las conexiones no ocupan workers. En modo threadpool el socket se entrega
+al hilo del StatusEventHub, que vigila todos los streams con un selector
+(solo para detectar cierres). En modo asyncio cada stream es una tarea
+que espera el cierre del cliente. En ambos casos el hub revisa el estado
+una vez por tick en memoria (tabla de sesiones, sin ipset), y al momento
+cuando la tabla avisa de un cambio. Cada heartbeat segundos manda un
+comentario para que proxies y clientes no den la conexión por muerta.
+"""
+
+import asyncio
+import json
+import selectors
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Set
+
+from .http_utils import StreamResponse
+
+StateFn = Callable[[str], Dict[str, object]]
+
+_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream; charset=utf-8\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"X-Accel-Buffering: no\r\n"  # nginx: no acumular el stream en el proxy
+    b"Connection: close\r\n"
+    b"\r\n"
+)
+
+
+def format_event(event: str, data: Dict[str, object]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+class _Stream(ABC):
+    """Estado de un stream: último estado enviado a su IP."""
+
+    __slots__ = ("ip", "authed", "expires", "warned", "last_write")
+
+    def __init__(self, ip: str, state: Dict[str, object]):
+        self.ip = ip
+        self.authed = bool(state.get("authenticated"))
+        self.expires = time.monotonic() + int(state.get("expires_in_seconds") or 0)
+        self.warned = False
+        self.last_write = time.monotonic()
+
+    @abstractmethod
+    def push(self, data: bytes) -> bool:
+        """Envía data sin bloquear; False si el stream debe cerrarse."""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Cierra la conexión del stream."""
+
+
+class _SocketStream(_Stream):
+    __slots__ = ("sock",)
+
+    def __init__(self, ip: str, state: Dict[str, object], sock: socket.socket):
+        super().__init__(ip, state)
+        self.sock = sock
+
+    def push(self, data: bytes) -> bool:
+        # Los eventos son pequeños: si el buffer del socket está lleno el
+        # cliente no está leyendo y se cierra el stream
+        try:
+            return self.sock.send(data) == len(data)
+        except OSError:
+            return False
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _AsyncStream(_Stream):
+    __slots__ = ("loop", "writer", "closed")
+
+    def __init__(self, ip: str, state: Dict[str, object], loop, writer):
+        super().__init__(ip, state)
+        self.loop = loop
+        self.writer = writer
+        self.closed = asyncio.Event()
+
+    def push(self, data: bytes) -> bool:
+        if self.closed.is_set():
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+            return True
+        except RuntimeError:  # bucle cerrado
+            return False
+
+    def close(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.closed.set)
+        except RuntimeError:
+            pass
+
+
+class StatusEventHub:
+    def __init__(self, state_fn: StateFn, *, tick: float = 1.0, heartbeat: float = 15.0,
+                 warning_seconds: int = 300, max_streams: int = 2000):
+        self.state_fn = state_fn  # estado de una IP solo desde memoria: se llama en cada tick
+        self.tick = tick
+        self.heartbeat = heartbeat
+        self.warning_seconds = warning_seconds
+        self.max_streams = max_streams
+        self._streams: Set[_Stream] = set()
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread: Optional[threading.Thread] = None
+        self.events_sent = 0
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def full(self) -> bool:
+        return len(self._streams) >= self.max_streams
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="sse-hub", daemon=True)
+                    self._thread.start()
+
+    def _wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def notify(self, ip: str) -> None:
+        """Aviso de cambio de sesión de ip: se revisan sus streams sin esperar al tick."""
+        if not self._streams:
+            return
+        with self._lock:
+            self._dirty.add(ip)
+        self._wake()
+
+    # -- altas -------------------------------------------------------------
+
+    def open(self, client_ip: str, state: Dict[str, object]) -> StreamResponse:
+        """Respuesta de /status/events para client_ip, empezando por state (estado actual)."""
+        first = b"retry: 5000\n\n" + format_event("status", state)
+        return StreamResponse(
+            _HEAD,
+            first,
+            lambda sock: self._attach_socket(client_ip, state, sock),
+            lambda reader, writer: self._serve_async(client_ip, state, reader, writer),
+        )
+
+    def _attach_socket(self, ip: str, state: Dict[str, object], sock: socket.socket) -> None:
+        sock.setblocking(False)
+        stream = _SocketStream(ip, state, sock)
+        self._ensure_thread()
+        with self._lock:
+            self._streams.add(stream)
+            try:
+                self._sel.register(sock, selectors.EVENT_READ, stream)
+            except (ValueError, OSError):
+                self._streams.discard(stream)
+                stream.close()
+                return
+        self._wake()
+
+    async def _serve_async(self, ip: str, state: Dict[str, object], reader, writer) -> None:
+        stream = _AsyncStream(ip, state, asyncio.get_running_loop(), writer)
+        self._ensure_thread()
+        with self._lock:
+            self._streams.add(stream)
+        try:
+            # Termina cuando el cliente cierra (read devuelve b"") o el hub cierra el stream
+            read = asyncio.ensure_future(reader.read(1024))
+            closed = asyncio.ensure_future(stream.closed.wait())
+            while True:
+                done, _ = await asyncio.wait({read, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if closed in done or (read in done and not read.result()):
+                    break
+                read = asyncio.ensure_future(reader.read(1024))
+            for fut in (read, closed):
+                fut.cancel()
+        finally:
+            stream.closed.set()
+            with self._lock:
+                self._streams.discard(stream)
+
+    # -- bucle del hub -----------------------------------------------------
+
+    def _drop(self, stream: _Stream) -> None:
+        with self._lock:
+            self._streams.discard(stream)
+            if isinstance(stream, _SocketStream):
+                try:
+                    self._sel.unregister(stream.sock)
+                except (KeyError, ValueError, OSError):
+                    pass
+        stream.close()
+
+    def _events_for(self, stream: _Stream, state: Dict[str, object], now: float) -> list:
+        authed = bool(state.get("authenticated"))
+        remaining = int(state.get("expires_in_seconds") or 0)
+        expires = now + remaining
+        events = []
+        if authed and not stream.authed:
+            events.append(("auth", state))
+            stream.warned = False
+        elif not authed and stream.authed:
+            reason = "expired" if stream.expires <= now + self.tick else "logout"
+            events.append(("logout", {**state, "reason": reason}))
+        elif authed and abs(expires - stream.expires) > 2:
+            events.append(("status", state))  # re-login / sesión ampliada
+            stream.warned = False
+        if authed and not stream.warned and 0 < remaining <= self.warning_seconds:
+            events.append(("warning", state))
+            stream.warned = True
+        stream.authed = authed
+        stream.expires = expires
+        return events
+
+    def _check(self, streams, now: float) -> None:
+        states: Dict[str, Dict[str, object]] = {}
+        for stream in streams:
+            state = states.get(stream.ip)
+            if state is None:
+                state = states[stream.ip] = self.state_fn(stream.ip)
+            data = b"".join(format_event(ev, d) for ev, d in self._events_for(stream, state, now))
+            if not data and now - stream.last_write >= self.heartbeat:
+                data = b": ping\n\n"
+            if not data:
+                continue
+            if stream.push(data):
+                stream.last_write = now
+                self.events_sent += data.count(b"event: ")
+            else:
+                self._drop(stream)
+
+    def _loop(self) -> None:
+        next_tick = time.monotonic() + self.tick
+        while True:
+            timeout = max(0.0, next_tick - time.monotonic())
+            for key, _ in self._sel.select(timeout=timeout):
+                stream = key.data
+                if stream is None:
+                    try:
+                        self._wake_r.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                # Datos o cierre del cliente: EventSource no envía nada, así que se cierra
+                self._drop(stream)
+
+            now = time.monotonic()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                if now >= next_tick:
+                    targets = list(self._streams)
+                else:
+                    targets = [s for s in self._streams if s.ip in dirty]
+            if targets:
+                self._check(targets, now)
+            if now >= next_tick:
+                next_tick = now + self.tick
@@ -0,0 +1,208 @@
+# app/static_cache.py
+"""
+Caché en memoria de los archivos de app/static.
+
+Cada archivo se indexa una vez (al arrancar o en el primer acceso) con su
+contenido, tipo MIME, ETag, Last-Modified y, si es texto, una variante
+gzip (la de disco "<archivo>.gz" si existe, o comprimida en memoria).
+Las peticiones solo hacen un stat() para detectar cambios de mtime/tamaño
+y responden con Cache-Control, 304 (If-None-Match / If-Modified-Since) y
+rangos de bytes (Range / If-Range).
+
+Los archivos de STATIC_SENDFILE_MIN_BYTES o más no se guardan en memoria:
+se envían con sendfile (ver http_utils.FileResponse).
+"""
+
+import gzip
+import mimetypes
+import os
+import stat
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from .http_utils import (
+    FileResponse,
+    accepts_encoding,
+    build_file_response,
+    build_response,
+    etag_matches,
+    http_date,
+    make_etag,
+    parse_http_date,
+)
+
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_GZIP_MIN_BYTES = 256
+
+
+class StaticAsset:
+    __slots__ = ("path", "ctype", "size", "mtime_ns", "etag", "last_modified", "data", "gzip_data", "gzip_etag")
+
+    def __init__(self, path: Path, st: os.stat_result, data: Optional[bytes]):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        ctype, _ = mimetypes.guess_type(str(path))
+        ctype = ctype or "application/octet-stream"
+        if ctype.startswith("text/") and "charset" not in ctype:
+            ctype += "; charset=utf-8"
+        self.ctype = ctype
+        self.data = data
+        self.last_modified = http_date(st.st_mtime)
+        if data is not None:
+            self.etag = make_etag(data)
+        else:
+            # Archivo grande: ETag por metadatos, sin leerlo entero
+            self.etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.gzip_data: Optional[bytes] = None
+        self.gzip_etag: Optional[str] = None
+
+    def compressible(self) -> bool:
+        return self.ctype.startswith(_COMPRESSIBLE)
+
+
+class StaticCache:
+    def __init__(self, root: Path, *, max_age: int, sendfile_min_bytes: int):
+        self.root = root.resolve()
+        self.max_age = max_age
+        self.sendfile_min_bytes = sendfile_min_bytes
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    # -- índice -----------------------------------------------------------
+
+    def _resolve(self, rel: str) -> Optional[Path]:
+        # Evita traversal básico (igual que antes) y rutas fuera de root
+        if not rel or ".." in rel or "\\" in rel or rel.startswith("/"):
+            return None
+        return self.root / rel
+
+    def _load(self, path: Path, st: os.stat_result) -> StaticAsset:
+        data = None
+        if st.st_size < self.sendfile_min_bytes:
+            data = path.read_bytes()
+        asset = StaticAsset(path, st, data)
+        if data is not None and asset.compressible() and asset.size >= _GZIP_MIN_BYTES:
+            gz_path = path.with_name(path.name + ".gz")
+            try:
+                gz_st = gz_path.stat()
+                gz = gz_path.read_bytes() if gz_st.st_mtime_ns >= st.st_mtime_ns else None
+            except OSError:
+                gz = None
+            if gz is None:
+                gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < asset.size:
+                asset.gzip_data = gz
+                asset.gzip_etag = asset.etag[:-1] + '-gzip"'
+        return asset
+
+    def lookup(self, rel: str) -> Optional[StaticAsset]:
+        path = self._resolve(rel)
+        if path is None:
+            return None
+        try:
+            st = path.stat()
+        except OSError:
+            self._assets.pop(rel, None)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        asset = self._assets.get(rel)
+        if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            return asset
+        with self._lock:
+            asset = self._load(path, st)
+            self._assets[rel] = asset
+        return asset
+
+    def preload(self) -> int:
+        """Indexa todos los archivos de root (arranque). Devuelve cuántos."""
+        count = 0
+        for path in self.root.rglob("*"):
+            if path.is_file() and not path.name.endswith(".gz"):
+                if self.lookup(path.relative_to(self.root).as_posix()) is not None:
+                    count += 1
+        return count
+
+    # -- respuestas -------------------------------------------------------
+
+    def _not_modified(self, asset: StaticAsset, headers, etag: str) -> bool:
+        inm = headers.get("If-None-Match")
+        if inm is not None:
+            return etag_matches(inm, etag)
+        since = parse_http_date(headers.get("If-Modified-Since"))
+        return since is not None and int(asset.mtime_ns // 1_000_000_000) <= since
+
+    @staticmethod
+    def _parse_range(value: str, size: int):
+        """
+        Un único rango "bytes=a-b" / "bytes=a-" / "bytes=-n".
+        Devuelve (inicio, fin_inclusivo), "unsatisfiable" o None (ignorar).
+        """
+        unit, _, spec = value.partition("=")
+        if unit.strip().lower() != "bytes" or "," in spec:
+            return None
+        first, sep, last = spec.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                n = int(last)
+                if n <= 0:
+                    return "unsatisfiable"
+                return max(0, size - n), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if start >= size or start > end:
+            return "unsatisfiable"
+        return start, min(end, size - 1)
+
+    def respond(self, rel: str, headers, method: str = "GET") -> "bytes | FileResponse":
+        asset = self.lookup(rel)
+        if asset is None:
+            return build_response(404, {}, b"Not Found")
+
+        use_gzip = asset.gzip_data is not None and accepts_encoding(headers.get("Accept-Encoding"), "gzip")
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        common = {
+            "ETag": etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": f"public, max-age={self.max_age}",
+        }
+        if asset.gzip_data is not None:
+            common["Vary"] = "Accept-Encoding"
+
+        if self._not_modified(asset, headers, etag):
+            return build_response(304, common, b"")
+
+        # Rangos: solo sobre la representación sin comprimir
+        range_header = headers.get("Range")
+        if range_header and method == "GET":
+            if_range = headers.get("If-Range")
+            if if_range is None or if_range.strip() == asset.etag:
+                rng = self._parse_range(range_header, asset.size)
+                if rng == "unsatisfiable":
+                    return build_response(416, {"Content-Range": f"bytes */{asset.size}"}, b"")
+                if rng is not None:
+                    start, end = rng
+                    h = {
+                        "Content-Type": asset.ctype,
+                        "Content-Range": f"bytes {start}-{end}/{asset.size}",
+                        "Accept-Ranges": "bytes",
+                        **common,
+                        "ETag": asset.etag,
+                    }
+                    if asset.data is None:
+                        return build_file_response(206, h, asset.path, start, end - start + 1)
+                    return build_response(206, h, asset.data[start:end + 1])
+
+        h = {"Content-Type": asset.ctype, "Accept-Ranges": "bytes", **common}
+        if use_gzip:
+            h["Content-Encoding"] = "gzip"
+            return build_response(200, h, asset.gzip_data)
+        if asset.data is None:
+            return build_file_response(200, h, asset.path, 0, asset.size)
+        return build_response(200, h, asset.data)
@@ -0,0 +1,100 @@
+# app/templating.py
+"""
+Plantillas HTML precompiladas (solo librerías estándar).
+
+Sintaxis de las plantillas (app/templates/*.html):
+    {{nombre}}    valor escapado con html.escape
+    {{!nombre}}   HTML ya construido, se inserta tal cual
+
+Cada plantilla se compila una vez en una lista de segmentos estáticos ya
+codificados a UTF-8 y huecos con nombre; render() solo codifica los
+valores. Una plantilla sin huecos se sirve directamente desde sus bytes
+(Template.static) con un ETag fuerte calculado al compilar.
+
+Con TEMPLATE_RELOAD=1 (desarrollo) se comprueba el mtime del archivo en
+cada uso y se recompila si ha cambiado.
+"""
+
+import html
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .config import TEMPLATE_RELOAD
+from .http_utils import make_etag
+
+TEMPLATES_ROOT = Path(__file__).resolve().parent / "templates"
+
+_SLOT_RE = re.compile(r"\{\{(!?)\s*(\w+)\s*\}\}")
+
+Segment = Union[bytes, Tuple[str, bool]]  # bytes estáticos o (nombre, raw)
+
+
+class Template:
+    def __init__(self, source: str, name: str = "<string>"):
+        self.name = name
+        self.segments: List[Segment] = []
+        pos = 0
+        for m in _SLOT_RE.finditer(source):
+            if m.start() > pos:
+                self.segments.append(source[pos:m.start()].encode("utf-8"))
+            self.segments.append((m.group(2), m.group(1) == "!"))
+            pos = m.end()
+        if pos < len(source):
+            self.segments.append(source[pos:].encode("utf-8"))
+
+        self.slots = {seg[0] for seg in self.segments if isinstance(seg, tuple)}
+        self.static: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        if not self.slots:
+            self.static = b"".join(self.segments)
+            self.etag = make_etag(self.static)
+
+    def render(self, **values) -> bytes:
+        if self.static is not None:
+            return self.static
+        out = []
+        for seg in self.segments:
+            if isinstance(seg, bytes):
+                out.append(seg)
+                continue
+            name, raw = seg
+            value = str(values.get(name, ""))
+            out.append((value if raw else html.escape(value)).encode("utf-8"))
+        return b"".join(out)
+
+
+class TemplateLoader:
+    """Carga y cachea plantillas de root; con reload=True las recompila si cambia su mtime."""
+
+    def __init__(self, root: Path = TEMPLATES_ROOT, reload: bool = TEMPLATE_RELOAD):
+        self.root = root
+        self.reload = reload
+        self._cache: Dict[str, Tuple[int, Template]] = {}
+        self._lock = threading.Lock()
+
+    def _compile(self, name: str) -> Tuple[int, Template]:
+        path = self.root / name
+        mtime = path.stat().st_mtime_ns
+        return mtime, Template(path.read_text(encoding="utf-8"), name)
+
+    def get(self, name: str) -> Template:
+        entry = self._cache.get(name)
+        if entry is not None and not self.reload:
+            return entry[1]
+        if entry is not None and (self.root / name).stat().st_mtime_ns == entry[0]:
+            return entry[1]
+        with self._lock:
+            entry = self._compile(name)
+            self._cache[name] = entry
+        return entry[1]
+
+    def preload(self) -> None:
+        """Compila todas las plantillas del directorio (arranque)."""
+        for path in sorted(self.root.glob("*.html")):
+            self.get(path.name)
+
+
+TEMPLATES = TemplateLoader()
+TEMPLATES.preload()
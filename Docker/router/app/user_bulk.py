@@ -0,0 +1,326 @@
+# app/user_bulk.py
+"""
+Alta masiva y exportación de usuarios (POST /admin/users/import y
+GET /admin/users/export), solo librería estándar.
+
+Importar:
+- El body se procesa por trozos a medida que llega (http_parser.BodyStream):
+  se parte en líneas y cada fila se valida en cuanto está completa. En
+  memoria quedan solo las filas válidas (usuario -> hash), no el archivo.
+- Formatos: CSV de dos columnas usuario,contraseña (una fila por línea,
+  separador ',' o ';', cabecera opcional) o JSONL ({"u": ..., "p": ...}
+  o {"username": ..., "password": ...} por línea).
+- Las contraseñas en claro se convierten a hash en el pool de contraseñas,
+  varias a la vez, mientras se sigue leyendo; las que ya son un hash
+  (scrypt$ / pbkdf2_sha256$) se guardan tal cual.
+- Al final todas las filas válidas se escriben de una vez (users.bulk_write:
+  una instantánea nueva o una transacción SQLite). Con on_error=abort
+  (por defecto) cualquier fila errónea anula la importación completa.
+- La fila de 'admin' se omite sin error (la exportación la incluye: un
+  archivo exportado se puede volver a importar tal cual).
+- El informe (JSON) lista los errores por número de línea.
+
+Exportar: el CSV/JSONL se genera por lotes del almacén (users.iter_users)
+y se envía con Transfer-Encoding: chunked, sin construirlo entero.
+"""
+
+import csv
+import io
+import json
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .config import PASSWORD_MAX_PENDING, PASSWORD_WORKERS
+from .passwords import PasswordBusyError, is_hashed, make_password_hash
+from .users import bulk_write, get_password, iter_users, validate_username
+
+FORMATS = ("csv", "jsonl")
+
+# Longitud máxima de una línea del archivo importado
+MAX_LINE_BYTES = 64 * 1024
+# Errores detallados en el informe (el resto solo se cuentan)
+MAX_REPORTED_ERRORS = 1000
+# Tamaño aproximado de cada chunk de la exportación
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+_CSV_HEADERS = {("username", "password"), ("u", "p"), ("usuario", "contraseña")}
+
+# (línea, usuario, contraseña, error): con error, usuario/contraseña pueden ser None
+Row = Tuple[int, Optional[str], Optional[str], Optional[str]]
+
+
+def content_format(content_type: Optional[str]) -> str:
+    """Formato según Content-Type: JSONL si menciona json, si no CSV."""
+    return "jsonl" if content_type and "json" in content_type.lower() else "csv"
+
+
+# ----------------------------
+# Lectura por líneas
+# ----------------------------
+
+def _decode(line: bytes, lineno: int) -> Tuple[Optional[str], Optional[str]]:
+    if line.endswith(b"\r"):
+        line = line[:-1]
+    if lineno == 1 and line.startswith(b"\xef\xbb\xbf"):
+        line = line[3:]  # BOM de UTF-8 (Excel)
+    try:
+        return line.decode("utf-8"), None
+    except UnicodeDecodeError:
+        return None, "la línea no es UTF-8 válido"
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    (número de línea, texto, error) de un body que llega por trozos. Una
+    línea de más de MAX_LINE_BYTES se descarta (con su error) sin
+    acumularla.
+    """
+    buf = bytearray()
+    lineno = 0
+    skipping = False
+    for chunk in chunks:
+        buf += chunk
+        start = 0
+        while True:
+            nl = buf.find(b"\n", start)
+            if nl < 0:
+                break
+            lineno += 1
+            if skipping:
+                skipping = False
+                yield lineno, None, "línea demasiado larga"
+            else:
+                yield (lineno, *_decode(bytes(buf[start:nl]), lineno))
+            start = nl + 1
+        del buf[:start]
+        if skipping or len(buf) > MAX_LINE_BYTES:
+            skipping = True
+            buf.clear()
+    if skipping:
+        yield lineno + 1, None, "línea demasiado larga"
+    elif buf:
+        yield (lineno + 1, *_decode(bytes(buf), lineno + 1))
+
+
+def parse_csv(lines: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> Iterator[Row]:
+    delimiter = None
+    first = True
+    for lineno, text, error in lines:
+        if error:
+            yield lineno, None, None, error
+            continue
+        if not text.strip():
+            continue
+        if delimiter is None:
+            delimiter = ";" if ";" in text and "," not in text else ","
+        try:
+            fields = next(csv.reader([text], delimiter=delimiter))
+        except csv.Error as e:
+            yield lineno, None, None, f"CSV inválido: {e}"
+            continue
+        if first:
+            first = False
+            if tuple(f.strip().casefold() for f in fields) in _CSV_HEADERS:
+                continue
+        if len(fields) != 2:
+            yield lineno, None, None, f"se esperaban 2 columnas (usuario, contraseña) y hay {len(fields)}"
+            continue
+        yield lineno, fields[0], fields[1], None
+
+
+def parse_jsonl(lines: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> Iterator[Row]:
+    for lineno, text, error in lines:
+        if error:
+            yield lineno, None, None, error
+            continue
+        if not text.strip():
+            continue
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            yield lineno, None, None, "JSON inválido"
+            continue
+        if not isinstance(obj, dict):
+            yield lineno, None, None, "se esperaba un objeto JSON"
+            continue
+        u = obj.get("u", obj.get("username"))
+        p = obj.get("p", obj.get("password"))
+        if not isinstance(u, str) or not isinstance(p, str):
+            yield lineno, None, None, 'faltan "u" y "p" (texto)'
+            continue
+        yield lineno, u, p, None
+
+
+# ----------------------------
+# Importación
+# ----------------------------
+
+class ImportReport:
+    def __init__(self, fmt: str, mode: str, on_error: str, dry_run: bool):
+        self.format = fmt
+        self.mode = mode
+        self.on_error = on_error
+        self.dry_run = dry_run
+        self.rows = 0
+        self.valid = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.applied = False
+        self.errors: List[Dict[str, object]] = []
+        self.error_count = 0
+
+    def error(self, line: int, username: Optional[str], message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            entry: Dict[str, object] = {"line": line, "error": message}
+            if username:
+                entry["user"] = username
+            self.errors.append(entry)
+
+    def to_json(self) -> bytes:
+        return json.dumps({
+            "format": self.format,
+            "mode": self.mode,
+            "on_error": self.on_error,
+            "dry_run": self.dry_run,
+            "rows": self.rows,
+            "valid": self.valid,
+            "applied": self.applied,
+            "created": self.created,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "errors_total": self.error_count,
+            "errors": self.errors,
+        }, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+class _Hasher:
+    """
+    Hashes de las filas en el pool de contraseñas, varios en vuelo a la vez
+    (como mucho window) mientras se sigue leyendo el body. done() devuelve
+    en orden las filas ya calculadas.
+    """
+
+    def __init__(self, window: int):
+        self.window = max(1, window)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Deque[Tuple[int, str, Future]] = deque()
+
+    def submit(self, lineno: int, username: str, password: str) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.window, thread_name_prefix="import-hash")
+        self._queue.append((lineno, username, self._executor.submit(make_password_hash, password)))
+
+    def done(self, wait_all: bool = False) -> Iterator[Tuple[int, str, Optional[str], Optional[str]]]:
+        """(línea, usuario, hash, error) de las filas terminadas (o de todas con wait_all)."""
+        while self._queue and (wait_all or len(self._queue) >= self.window or self._queue[0][2].done()):
+            lineno, username, fut = self._queue.popleft()
+            try:
+                yield lineno, username, fut.result(), None
+            except PasswordBusyError:
+                yield lineno, username, None, "servidor ocupado calculando contraseñas"
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def import_users(chunks: Iterable[bytes], *, fmt: str = "csv", mode: str = "create",
+                 on_error: str = "abort", dry_run: bool = False) -> ImportReport:
+    """
+    Valida e importa los usuarios de un body que llega por trozos.
+    mode: "create" (un usuario existente es un error) o "upsert" (se le
+    cambia la contraseña). on_error: "abort" (no se aplica nada si hay
+    algún error) o "skip" (se aplican las filas válidas). dry_run solo
+    valida (sin calcular hashes ni escribir).
+    """
+    report = ImportReport(fmt, mode, on_error, dry_run)
+    overwrite = mode == "upsert"
+    parse = parse_jsonl if fmt == "jsonl" else parse_csv
+    valid: Dict[str, str] = {}
+    seen: Dict[str, int] = {}  # usuario -> línea (duplicados dentro del archivo)
+    hasher = _Hasher(min(max(1, PASSWORD_WORKERS) * 2, max(1, PASSWORD_MAX_PENDING // 2)))
+
+    def collect(done):
+        for lineno, username, stored, error in done:
+            if error:
+                report.error(lineno, username, error)
+            else:
+                valid[username] = stored
+
+    try:
+        for lineno, username, password, error in parse(iter_lines(chunks)):
+            report.rows += 1
+            if error is None:
+                username = username.strip()
+                error = validate_username(username)
+            if error is None and username == "admin":
+                report.skipped += 1  # no se modifica por importación
+                continue
+            if error is None:
+                if username in seen:
+                    error = f"usuario repetido (ya en la línea {seen[username]})"
+                elif not password:
+                    error = "la contraseña está vacía"
+                elif not overwrite and get_password(username) is not None:
+                    error = "el usuario ya existe"
+            if error:
+                report.error(lineno, username, error)
+                continue
+            seen[username] = lineno
+            if dry_run:
+                valid[username] = ""
+            elif is_hashed(password):
+                valid[username] = password
+            else:
+                hasher.submit(lineno, username, password)
+                collect(hasher.done())
+        collect(hasher.done(wait_all=True))
+    finally:
+        hasher.close()
+
+    report.valid = len(valid)
+    if dry_run or not valid or (report.error_count and on_error == "abort"):
+        return report
+
+    try:
+        created, updated, conflicts = bulk_write(valid, overwrite=overwrite, atomic=on_error == "abort")
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error guardando la importación de usuarios: {e}")
+        report.error(0, None, "no se pudo guardar la importación; no se ha aplicado ningún cambio")
+        return report
+    for username in conflicts:
+        # Creado por otra vía mientras se leía el archivo
+        report.error(seen[username], username, "el usuario ya existe")
+    report.created, report.updated = created, updated
+    report.applied = bool(created or updated)
+    return report
+
+
+# ----------------------------
+# Exportación
+# ----------------------------
+
+def export_chunks(fmt: str = "csv") -> Iterator[bytes]:
+    """Todos los usuarios (usuario y valor almacenado) en CSV o JSONL, por trozos."""
+    out = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(("username", "password"))
+    for batch in iter_users():
+        if writer is not None:
+            writer.writerows(batch)
+        else:
+            for u, p in batch:
+                out.write(json.dumps({"u": u, "p": p}, ensure_ascii=False, separators=(",", ":")))
+                out.write("\n")
+        if out.tell() >= EXPORT_CHUNK_BYTES:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue().encode("utf-8")
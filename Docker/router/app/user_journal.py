@@ -0,0 +1,245 @@
+# app/user_journal.py
+"""
+Persistencia de users.json como instantánea + journal de cambios.
+
+- La instantánea es el propio USERS_FILE (lista [{"u": ..., "p": ...}], el
+  formato de siempre, sin indentar). Se escribe completa solo al compactar,
+  con escritura atómica: archivo temporal + fsync + rename.
+- Cada alta/baja/cambio se añade al journal (USERS_FILE + ".journal") como
+  una línea JSON: {"op": "create"|"update"|"delete", "u": ..., "p": ...}.
+  Las líneas de varios hilos se agrupan: un write y un fsync por lote
+  (group commit); cada llamada espera solo a que su línea sea durable.
+- La primera línea del journal identifica la instantánea a la que se
+  aplica (inode, tamaño, mtime). Si users.json se sustituye por fuera (un
+  import manual), el journal deja de corresponder y se ignora.
+- Escritores de varios procesos (pre-fork) se serializan con flock sobre
+  <journal>.lock. Los lectores no toman el lock: compactar escribe primero
+  la instantánea y después el journal nuevo, y un journal cuya cabecera no
+  corresponde a la instantánea leída se descarta, así que nunca se mezclan.
+- Una última línea a medias (caída durante un write) se ignora al leer y
+  se recorta antes de la siguiente escritura.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Record = Dict[str, str]
+Signature = Optional[Tuple[int, int, int]]  # (inode, tamaño, mtime_ns)
+
+
+def file_signature(st: Optional[os.stat_result]) -> Signature:
+    return (st.st_ino, st.st_size, st.st_mtime_ns) if st is not None else None
+
+
+def stat_signature(path: Path) -> Signature:
+    try:
+        return file_signature(os.stat(path))
+    except OSError:
+        return None
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Escribe data en path de forma atómica (temporal + fsync + rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def apply_record(mapping: Dict[str, str], record: Record) -> None:
+    op = record.get("op")
+    if op in ("create", "update"):
+        mapping[str(record["u"])] = str(record["p"])
+    elif op == "delete":
+        mapping.pop(str(record["u"]), None)
+
+
+class _Pending:
+    __slots__ = ("line", "done", "error")
+
+    def __init__(self, line: bytes):
+        self.line = line
+        self.done = False
+        self.error: Optional[OSError] = None
+
+
+class UserJournal:
+    def __init__(self, path: Path, snapshot: Path, *, fsync: bool = True):
+        self.path = Path(path)
+        self.snapshot = Path(snapshot)
+        self.fsync = fsync
+        self._lock_path = self.path.with_name(self.path.name + ".lock")
+        self._cond = threading.Condition()
+        self._pending: List[_Pending] = []
+        self._flushing = False
+        self.appends = 0
+        self.batches = 0
+        self.resets = 0
+
+    # -- lectura ------------------------------------------------------------
+
+    def read(self, snapshot_sig: Signature, offset: int = 0) -> Tuple[List[Record], int]:
+        """
+        Registros completos desde offset y offset del final leído. Con
+        offset 0 se comprueba la cabecera: si no corresponde a snapshot_sig
+        (la instantánea ya leída) el journal se ignora.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = data.rfind(b"\n") + 1  # una línea a medias (escritura en curso o caída) se ignora
+        lines = data[:end].splitlines()
+        if offset == 0 and lines:
+            header = self._parse(lines[0])
+            if header is None or _header_sig(header) != snapshot_sig:
+                print(f"{self.path.name} no corresponde a {self.snapshot.name} (¿reemplazado a mano?); se ignora")
+                return [], end
+            lines = lines[1:]
+        records = []
+        for line in lines:
+            rec = self._parse(line)
+            if rec is not None and "op" in rec:
+                records.append(rec)
+        return records, offset + end
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[dict]:
+        try:
+            rec = json.loads(line)
+            return rec if isinstance(rec, dict) else None
+        except ValueError:
+            return None
+
+    def busy(self) -> bool:
+        """Hay registros de este proceso encolados o escribiéndose."""
+        return bool(self._pending) or self._flushing
+
+    def size(self) -> int:
+        try:
+            return os.stat(self.path).st_size
+        except OSError:
+            return 0
+
+    # -- escritura ------------------------------------------------------------
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Lock exclusivo entre procesos para escribir en el journal o compactar."""
+        self._lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # libera el flock
+
+    def submit(self, record: Record) -> _Pending:
+        """
+        Encola un registro. El orden de submit es el orden en el journal:
+        llamarlo dentro de la misma sección crítica que aplica el cambio en
+        memoria, y esperar con wait() fuera de ella.
+        """
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        pending = _Pending(line)
+        with self._cond:
+            self._pending.append(pending)
+        return pending
+
+    def wait(self, pending: _Pending) -> None:
+        """Espera a que el registro esté escrito (y en disco); OSError si falló."""
+        with self._cond:
+            while not pending.done:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                # Sin escritura en curso: este hilo escribe todo lo pendiente
+                batch, self._pending = self._pending, []
+                self._flushing = True
+                self._cond.release()
+                error = None
+                try:
+                    self._write(b"".join(p.line for p in batch))
+                except OSError as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                for p in batch:
+                    p.error = error
+                    p.done = True
+                self.batches += 1
+                self.appends += len(batch)
+                self._cond.notify_all()
+        if pending.error is not None:
+            raise pending.error
+
+    def _write(self, data: bytes) -> None:
+        with self.locked():
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                if not self._header_ok(fd):
+                    os.close(fd)
+                    fd = -1
+                    self.reset_locked()
+                    fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+                self._drop_torn_tail(fd)
+                os.write(fd, data)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                if fd >= 0:
+                    os.close(fd)
+
+    def _drop_torn_tail(self, fd: int) -> None:
+        """
+        Recorta una última línea a medias (escritor caído a mitad de un
+        write): si no, el registro siguiente quedaría pegado a ella y se
+        perdería al leer. Con locked() ningún otro escritor está en curso.
+        """
+        size = os.fstat(fd).st_size
+        if size == 0 or os.pread(fd, 1, size - 1) == b"\n":
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        os.truncate(self.path, data.rfind(b"\n") + 1)
+
+    def _header_ok(self, fd: int) -> bool:
+        if os.fstat(fd).st_size == 0:
+            return False
+        with open(self.path, "rb") as f:
+            header = self._parse(f.readline())
+        return header is not None and _header_sig(header) == stat_signature(self.snapshot)
+
+    def reset_locked(self) -> None:
+        """
+        Sustituye el journal por uno vacío para la instantánea actual
+        (llamar con locked(), después de escribir la instantánea).
+        """
+        header = {"journal": 1, "snapshot": stat_signature(self.snapshot)}
+        atomic_write(self.path, json.dumps(header).encode("utf-8") + b"\n")
+        self.resets += 1
+
+
+def _header_sig(header: dict) -> Signature:
+    sig = header.get("snapshot")
+    return tuple(sig) if isinstance(sig, list) and len(sig) == 3 else None
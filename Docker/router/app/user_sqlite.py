@@ -0,0 +1,247 @@
+# app/user_sqlite.py
+"""
+Almacén de usuarios en SQLite (USERS_BACKEND=sqlite), solo librería estándar.
+
+- Tabla users(username PRIMARY KEY, password, folded) sin rowid, más un
+  índice (folded, username) para listar por páginas y buscar por prefijo
+  sin distinguir mayúsculas, como el índice de UserStore. Las páginas
+  siguientes se piden por clave (after/before), no con OFFSET, y el total
+  de coincidencias se cuenta una vez por prefijo y cambio de la base.
+- Una conexión por hilo (y por proceso: tras un fork se abre otra). Las
+  consultas usan siempre el mismo texto SQL, así que sqlite3 las reutiliza
+  ya preparadas de su caché de sentencias.
+- journal_mode=WAL: los lectores (logins, is_admin) no se bloquean
+  mientras el panel de administración escribe; synchronous=NORMAL.
+
+Importar desde users.json / USERS_JSON (desde Docker/router o /app):
+    python3 -m app.user_sqlite import [archivo.json]
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    folded   TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS users_folded ON users (folded, username);
+"""
+
+_GET = "SELECT password FROM users WHERE username = ?"
+_INSERT = "INSERT INTO users (username, password, folded) VALUES (?, ?, ?)"
+_UPSERT = ("INSERT INTO users (username, password, folded) VALUES (?, ?, ?) "
+           "ON CONFLICT (username) DO UPDATE SET password = excluded.password")
+_DELETE = "DELETE FROM users WHERE username = ?"
+_INSERT_NEW = _INSERT + " ON CONFLICT (username) DO NOTHING"
+_ORDERED = "SELECT username, password, folded FROM users {} ORDER BY folded, username LIMIT ?"
+_COUNT_CACHE = 256  # prefijos con el total guardado, por conexión
+
+
+class SqliteUserStore:
+    def __init__(self, path: Path, *, busy_timeout: float = 5.0):
+        self.path = Path(path)
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        conn = sqlite3.connect(str(self.path), timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        self._local.counts = {}  # prefijo -> (versión de la base, total); ver _matches
+        return conn
+
+    # -- lecturas -------------------------------------------------------------
+
+    def get_password(self, username: str) -> Optional[str]:
+        row = self._conn().execute(_GET, (username,)).fetchone()
+        return row[0] if row else None
+
+    def is_empty(self) -> bool:
+        return self._conn().execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT count(*) FROM users").fetchone()[0]
+
+    def page(self, prefix: str = "", offset: int = 0, limit: int = 50,
+             descending: bool = False, *, after: Optional[str] = None,
+             before: Optional[str] = None) -> Tuple[List[str], int]:
+        """
+        Como UserStore.page: (nombres de la página, total de coincidencias).
+        Con after/before la página empieza por clave en el índice,
+        (folded, username) > / < la del cursor, en lugar de saltar offset filas.
+        """
+        folded = prefix.casefold()
+        upper = folded + "\U0010ffff"
+        total = self._matches(folded, upper)
+        if limit <= 0:
+            return [], total
+        cursor = after if after is not None else before
+        backwards = descending != (before is not None)  # sentido del recorrido del índice
+        order = "DESC" if backwards else "ASC"
+        low, high = ("folded >= ?", [folded]), ("folded < ?", [upper])
+        if cursor is not None:
+            # El cursor sustituye al límite del rango por el que empieza el
+            # recorrido, para que SQLite busque en el índice desde él
+            key = (cursor.casefold(), cursor)
+            if backwards and key < (upper,):
+                high = ("(folded, username) < (?, ?)", list(key))
+            elif not backwards and key >= (folded,):
+                low = ("(folded, username) > (?, ?)", list(key))
+            offset = 0
+        where, args = f"{low[0]} AND {high[0]}", low[1] + high[1]
+        rows = self._conn().execute(
+            f"SELECT username FROM users WHERE {where} "
+            f"ORDER BY folded {order}, username {order} LIMIT ? OFFSET ?",
+            (*args, limit, max(0, offset)),
+        ).fetchall()
+        names = [r[0] for r in rows]
+        return (names[::-1] if before is not None else names), total
+
+    def _matches(self, folded: str, upper: str) -> int:
+        """
+        Usuarios con el prefijo folded. El count(*) recorre todo el rango del
+        índice, así que se guarda por prefijo hasta que la base cambia:
+        data_version cambia con los commits de otras conexiones (otros hilos
+        y procesos) y total_changes con los de esta.
+        """
+        conn = self._conn()
+        version = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        counts = self._local.counts
+        hit = counts.get(folded)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+        total = conn.execute(
+            "SELECT count(*) FROM users WHERE folded >= ? AND folded < ?", (folded, upper)
+        ).fetchone()[0]
+        if len(counts) >= _COUNT_CACHE:
+            counts.clear()
+        counts[folded] = (version, total)
+        return total
+
+    def all(self) -> List[Dict[str, str]]:
+        rows = self._conn().execute("SELECT username, password FROM users ORDER BY folded, username")
+        return [{"u": u, "p": p} for u, p in rows]
+
+    def iter_batches(self, size: int = 1000) -> Iterator[List[Tuple[str, str]]]:
+        """
+        Como UserStore.iter_batches: paginación por clave (folded, username).
+        Cada lote usa la conexión del hilo que lo pide (el generador puede
+        continuar en otro hilo, p. ej. en el executor del modo asyncio).
+        """
+        rows = self._conn().execute(_ORDERED.format(""), (size,)).fetchall()
+        while rows:
+            yield [(u, p) for u, p, _ in rows]
+            name, _, folded = rows[-1]
+            rows = self._conn().execute(_ORDERED.format("WHERE (folded, username) > (?, ?)"),
+                                        (folded, name, size)).fetchall()
+
+    # -- escrituras -----------------------------------------------------------
+
+    def create(self, username: str, password: str) -> bool:
+        """Añade el usuario; False si ya existe."""
+        try:
+            self._conn().execute(_INSERT, (username, password, username.casefold()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def delete(self, username: str) -> bool:
+        """Elimina el usuario; False si no existía."""
+        return self._conn().execute(_DELETE, (username,)).rowcount > 0
+
+    def upsert_many(self, users: Iterable[Tuple[str, str]]) -> int:
+        """Crea o actualiza (usuario, password) en una sola transacción."""
+        conn = self._conn()
+        count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for u, p in users:
+                conn.execute(_UPSERT, (u, p, u.casefold()))
+                count += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def bulk_write(self, users: Iterable[Tuple[str, str]], *, overwrite: bool,
+                   atomic: bool) -> Tuple[int, int, List[str]]:
+        """Como users.bulk_write, en una transacción: (creados, actualizados, conflictos)."""
+        conn = self._conn()
+        created = updated = 0
+        conflicts: List[str] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for u, p in users:
+                if conn.execute(_INSERT_NEW, (u, p, u.casefold())).rowcount:
+                    created += 1
+                elif overwrite:
+                    conn.execute(_UPSERT, (u, p, u.casefold()))
+                    updated += 1
+                else:
+                    conflicts.append(u)
+            if conflicts and atomic:
+                conn.execute("ROLLBACK")
+                return 0, 0, conflicts
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return created, updated, conflicts
+
+    def replace_all(self, users: Iterable[Tuple[str, str]], *, only_if_empty: bool = False) -> Optional[int]:
+        """
+        Sustituye todos los usuarios en una transacción. Con only_if_empty no
+        hace nada (y devuelve None) si la tabla ya tiene usuarios.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if only_if_empty and not self.is_empty():
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("DELETE FROM users")
+            count = 0
+            for u, p in users:
+                conn.execute(_UPSERT, (u, p, u.casefold()))
+                count += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    from .config import USERS_DB
+    from .users import _clean_users, _load_state
+
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "import":
+        if len(sys.argv) == 3:
+            _, mapping = _clean_users(json.loads(Path(sys.argv[2]).read_text(encoding="utf-8")))
+            source = sys.argv[2]
+        else:
+            mapping, _ = _load_state()
+            source = "USERS_JSON" if os.getenv("USERS_JSON") else "USERS_FILE (con su journal)"
+        n = SqliteUserStore(USERS_DB).upsert_many(mapping.items())
+        print(f"{n} usuarios importados de {source} a {USERS_DB}")
+        sys.exit(0)
+    print("Uso: python3 -m app.user_sqlite import [archivo.json]", file=sys.stderr)
+    sys.exit(2)
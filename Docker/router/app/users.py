@@ -1,14 +1,30 @@
 # app/users.py
+import bisect
 import json
 import os
+import sqlite3
 import threading
-from typing import List, Dict, Tuple
-
-from .config import USERS_FILE
-
-# Lock global: protege operaciones críticas de lectura+escritura del users.json
+from pathlib import Path
+from types import MappingProxyType
+from typing import Iterator, List, Dict, Mapping, Optional, Tuple
+
+from .config import (
+    USERS_BACKEND,
+    USERS_DB,
+    USERS_FILE,
+    USERS_JOURNAL_FILE,
+    USERS_JOURNAL_FSYNC,
+    USERS_JOURNAL_MAX_BYTES,
+)
+from .metrics import REGISTRY
+from .passwords import PasswordBusyError, is_hashed, make_password_hash
+from .user_journal import UserJournal, apply_record, atomic_write, file_signature, stat_signature
+
+# Lock global: ordena los cambios de usuarios del proceso (memoria + journal)
 _USERS_LOCK = threading.Lock()
 
+_JOURNAL = UserJournal(USERS_JOURNAL_FILE, USERS_FILE, fsync=USERS_JOURNAL_FSYNC)
+
 
 def _load_from_env() -> List[Dict[str, str]]:
     """
@@ -29,30 +45,46 @@ def _load_from_env() -> List[Dict[str, str]]:
     return []
 
 
-def load_users() -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+def _read_users() -> Tuple[List[Dict[str, str]], Optional[tuple]]:
     """
-    Carga usuarios desde:
+    Lee los usuarios en bruto desde:
       1) USERS_JSON (si existe)
       2) Archivo USERS_FILE
       3) Fallback: admin/admin
-
-    Devuelve:
-      (lista_de_usuarios, mapping_usuario->password)
-
-    Donde cada usuario es {"u": "...", "p": "..."}.
+    junto con la firma del USERS_FILE leído (para validar el journal).
     """
     data = _load_from_env()
+    file_sig = None
 
     if not data:
-        if USERS_FILE.exists():
-            try:
-                data = json.loads(USERS_FILE.read_text(encoding="utf-8"))
-            except json.JSONDecodeError:
-                print("users.json mal formado, usando fallback.")
-                data = []
+        try:
+            with open(USERS_FILE, "rb") as f:
+                file_sig = file_signature(os.fstat(f.fileno()))
+                data = json.loads(f.read().decode("utf-8"))
+        except FileNotFoundError:
+            data = []
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print("users.json mal formado, usando fallback.")
+            data = []
         if not data:
             data = [{"u": "admin", "p": "admin"}]
+    else:
+        file_sig = stat_signature(USERS_FILE)
+
+    return data, file_sig
+
 
+def _load_state() -> Tuple[Dict[str, str], int]:
+    """Usuarios actuales (fuente + journal) y offset del journal leído."""
+    data, file_sig = _read_users()
+    _, mapping = _clean_users(data)
+    records, offset = _JOURNAL.read(file_sig)
+    for rec in records:
+        apply_record(mapping, rec)
+    return mapping, offset
+
+
+def _clean_users(data) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
     cleaned: List[Dict[str, str]] = []
     mapping: Dict[str, str] = {}
 
@@ -74,49 +106,472 @@ def load_users() -> Tuple[List[Dict[str, str]], Dict[str, str]]:
     return cleaned, mapping
 
 
+class UserStore:
+    """
+    Caché en memoria de los usuarios, compartida por todo el proceso.
+
+    Se carga una vez y responde búsquedas en O(1). Mantiene además un
+    índice ordenado de nombres (sin distinguir mayúsculas) para listar por
+    páginas y buscar por prefijo con bisect, en O(log n + página), sin
+    recorrer todos los usuarios.
+
+    Antes de cada consulta compara una firma barata de la fuente
+    (USERS_JSON, inode/tamaño/mtime de USERS_FILE e inode/tamaño del
+    journal). Si solo ha crecido el journal (cambios de otro proceso) se
+    aplican las líneas nuevas; si cambió la instantánea (compactación,
+    edición a mano) se recarga todo. Los cambios de este proceso se aplican
+    en memoria al momento; volver a leerlos del journal es idempotente.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mapping: Dict[str, str] = {}
+        self._index: List[Tuple[str, str]] = []  # (nombre.casefold(), nombre), ordenado
+        self._signature: Optional[tuple] = None
+        self._offset = 0  # bytes del journal ya aplicados
+        self.reloads = 0
+
+    @staticmethod
+    def _current_signature() -> tuple:
+        journal_sig = stat_signature(_JOURNAL.path)
+        return os.getenv("USERS_JSON"), stat_signature(USERS_FILE), journal_sig and journal_sig[:2]
+
+    def _ensure_fresh(self) -> None:
+        sig = self._current_signature()
+        if sig == self._signature:
+            return
+        if self._signature is not None and _JOURNAL.busy():
+            # Hay cambios propios ya en memoria pero aún no en el journal:
+            # releer ahora los desharía un momento. Se relee tras escribirlos.
+            return
+        with self._lock:
+            if sig == self._signature:
+                return
+            old = self._signature
+            if (old is not None and old[:2] == sig[:2] and old[2] and sig[2]
+                    and old[2][0] == sig[2][0] and sig[2][1] >= self._offset):
+                # Mismo journal, más largo: aplicar solo la cola
+                records, self._offset = _JOURNAL.read(sig[1], self._offset)
+                for rec in records:
+                    self._apply(rec)
+            else:
+                mapping, self._offset = _load_state()
+                self._mapping = mapping
+                self._index = sorted((u.casefold(), u) for u in mapping)
+                self.reloads += 1
+            self._signature = sig
+
+    def _apply(self, rec: Dict[str, str]) -> None:
+        username = str(rec.get("u"))
+        if rec.get("op") == "delete":
+            self._remove(username)
+        else:
+            self._add(username, str(rec.get("p")))
+
+    def invalidate(self) -> None:
+        """Fuerza una recarga completa en la próxima consulta (p. ej. tras un error de escritura)."""
+        with self._lock:
+            self._signature = None
+
+    # -- lecturas -------------------------------------------------------
+
+    def get_password(self, username: str) -> Optional[str]:
+        self._ensure_fresh()
+        return self._mapping.get(username)
+
+    def snapshot(self) -> Tuple[List[Dict[str, str]], Mapping[str, str]]:
+        """
+        (lista nueva, mapping de solo lectura), copiados bajo el lock: las
+        escrituras posteriores no cambian lo ya devuelto.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            mapping = dict(self._mapping)
+        return [{"u": u, "p": p} for u, p in mapping.items()], MappingProxyType(mapping)
+
+    def page(self, prefix: str = "", offset: int = 0, limit: int = 50,
+             descending: bool = False, *, after: Optional[str] = None,
+             before: Optional[str] = None) -> Tuple[List[str], int]:
+        """
+        Nombres que empiezan por prefix (sin distinguir mayúsculas), en orden
+        alfabético (o inverso), desde offset y como mucho limit. Con after
+        (o before), los limit siguientes (o anteriores) a ese nombre en el
+        orden pedido, sin contar posiciones.
+        Devuelve (nombres, total de coincidencias).
+        """
+        self._ensure_fresh()
+        folded = prefix.casefold()
+        with self._lock:
+            index = self._index
+            lo = bisect.bisect_left(index, (folded,))
+            hi = bisect.bisect_left(index, (folded + "\U0010ffff",), lo) if folded else len(index)
+            total = hi - lo
+            cursor = after if after is not None else before
+            if cursor is not None:
+                key = (cursor.casefold(), cursor)
+                if descending != (before is not None):  # claves menores que el cursor
+                    end = bisect.bisect_left(index, key, lo, hi)
+                    rows = index[max(lo, end - max(0, limit)):end]
+                else:
+                    start = bisect.bisect_right(index, key, lo, hi)
+                    rows = index[start:min(hi, start + max(0, limit))]
+                if descending:
+                    rows = rows[::-1]
+                return [name for _, name in rows], total
+            offset = max(0, offset)
+            if descending:
+                end = hi - offset
+                rows = index[max(lo, end - limit):end][::-1] if end > lo else []
+            else:
+                rows = index[lo + offset:min(hi, lo + offset + limit)]
+        return [name for _, name in rows], total
+
+    def iter_batches(self, size: int = 1000) -> Iterator[List[Tuple[str, str]]]:
+        """
+        Todos los (usuario, valor almacenado) en el orden del índice, en
+        lotes de size. Cada lote continúa tras la última clave del anterior
+        (no por posición), así que los cambios entre lotes no saltan ni
+        repiten usuarios.
+        """
+        last: Optional[Tuple[str, str]] = None
+        while True:
+            self._ensure_fresh()
+            with self._lock:
+                index = self._index
+                lo = bisect.bisect_right(index, last) if last is not None else 0
+                keys = index[lo:lo + size]
+                batch = [(name, self._mapping[name]) for _, name in keys]
+            if not keys:
+                return
+            last = keys[-1]
+            yield batch
+
+    # -- escrituras (llamar con _USERS_LOCK) -----------------------------
+
+    def add(self, username: str, password: str) -> None:
+        with self._lock:
+            self._add(username, password)
+
+    def remove(self, username: str) -> None:
+        with self._lock:
+            self._remove(username)
+
+    def _add(self, username: str, password: str) -> None:
+        if username not in self._mapping:
+            bisect.insort(self._index, (username.casefold(), username))
+        self._mapping[username] = password
+
+    def _remove(self, username: str) -> None:
+        if self._mapping.pop(username, None) is None:
+            return
+        key = (username.casefold(), username)
+        i = bisect.bisect_left(self._index, key)
+        if i < len(self._index) and self._index[i] == key:
+            del self._index[i]
+
+
+_STORE = UserStore()
+
+# Con USERS_BACKEND=sqlite las funciones de este módulo usan la base de datos
+# en lugar de _STORE/_JOURNAL (ver user_sqlite)
+_DB = None
+if USERS_BACKEND == "sqlite":
+    from .user_sqlite import SqliteUserStore
+
+    _DB = SqliteUserStore(USERS_DB)
+    # Base nueva: se llena con los usuarios de USERS_FILE/USERS_JSON (una vez)
+    _seeded = _DB.replace_all(_load_state()[0].items(), only_if_empty=True) if _DB.is_empty() else None
+    if _seeded:
+        print(f"Base de usuarios {USERS_DB} creada con {_seeded} usuarios de {USERS_FILE}")
+elif USERS_BACKEND != "file":
+    print(f"USERS_BACKEND desconocido: {USERS_BACKEND!r}; usando file")
+
+
+@REGISTRY.collector
+def _store_metrics():
+    return [
+        ("portal_user_store_reloads_total", "counter", "Recargas de la fuente de usuarios",
+         [({}, _STORE.reloads)]),
+        ("portal_users", "gauge", "Usuarios cargados",
+         [({}, _DB.count() if _DB is not None else len(_STORE._mapping))]),
+        ("portal_user_journal_records_total", "counter", "Cambios de usuarios añadidos al journal",
+         [({}, _JOURNAL.appends)]),
+        ("portal_user_journal_fsyncs_total", "counter", "Lotes escritos (un fsync por lote) en el journal",
+         [({}, _JOURNAL.batches)]),
+        ("portal_user_journal_compactions_total", "counter", "Compactaciones del journal en users.json",
+         [({}, _JOURNAL.resets)]),
+        ("portal_user_journal_bytes", "gauge", "Tamaño del journal de usuarios", [({}, _JOURNAL.size())]),
+    ]
+
+
+def load_users() -> Tuple[List[Dict[str, str]], Mapping[str, str]]:
+    """
+    Devuelve los usuarios desde la caché del proceso (ver UserStore), que
+    se recarga de:
+      1) USERS_JSON (si existe)
+      2) Archivo USERS_FILE
+      3) Fallback: admin/admin
+    solo cuando la fuente cambia.
+
+    Devuelve:
+      (lista_de_usuarios, mapping_usuario->password)
+
+    Donde cada usuario es {"u": "...", "p": "..."} y "p" es el hash con sal
+    (ver passwords) o, en cuentas antiguas sin migrar, la contraseña en
+    claro. El mapping es de solo lectura; para buscar un usuario es
+    preferible get_password().
+    """
+    if _DB is not None:
+        users = _DB.all()
+        return users, MappingProxyType({u["u"]: u["p"] for u in users})
+    return _STORE.snapshot()
+
+
+def get_password(username: str) -> Optional[str]:
+    """Valor almacenado (hash o texto en claro) de username (O(1)), o None si no existe."""
+    if _DB is not None:
+        return _DB.get_password(username)
+    return _STORE.get_password(username)
+
+
+def page_users(prefix: str = "", offset: int = 0, limit: int = 50, descending: bool = False, *,
+               after: Optional[str] = None, before: Optional[str] = None) -> Tuple[List[str], int]:
+    """Página de nombres de usuario filtrada por prefijo (ver UserStore.page)."""
+    if _DB is not None:
+        return _DB.page(prefix, offset, limit, descending, after=after, before=before)
+    return _STORE.page(prefix, offset, limit, descending, after=after, before=before)
+
+
+def iter_users(batch: int = 1000) -> Iterator[List[Tuple[str, str]]]:
+    """Todos los (usuario, valor almacenado) por orden alfabético, en lotes (para exportar)."""
+    if _DB is not None:
+        return _DB.iter_batches(batch)
+    return _STORE.iter_batches(batch)
+
+
 def save_users(users_list: List[Dict[str, str]]) -> None:
     """
-    Guarda la lista de usuarios en USERS_FILE.
-    NOTA: debe llamarse desde una sección protegida por _USERS_LOCK
-    cuando el server está en multihilo.
+    Escribe users_list como nueva instantánea completa de USERS_FILE
+    (escritura atómica) y vacía el journal. Con SQLite, sustituye todos
+    los usuarios de la base en una transacción.
     """
-    USERS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    USERS_FILE.write_text(
-        json.dumps(users_list, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
+    if _DB is not None:
+        _DB.replace_all((u["u"], u["p"]) for u in users_list)
+        return
+    with _JOURNAL.locked():
+        _write_snapshot_locked(users_list)
+    _STORE.invalidate()
+
+
+def _write_snapshot_locked(users_list: List[Dict[str, str]]) -> None:
+    data = json.dumps(users_list, ensure_ascii=False, separators=(",", ":"))
+    atomic_write(USERS_FILE, data.encode("utf-8"))
+    _JOURNAL.reset_locked()
+
+
+def compact_users() -> int:
+    """
+    Vuelca instantánea + journal en un USERS_FILE nuevo y empieza un
+    journal vacío. Lee de disco, no de la caché: no incluye cambios aún no
+    escritos. Devuelve el número de usuarios. Con SQLite no hay nada que
+    compactar.
+    """
+    if _DB is not None:
+        return _DB.count()
+    with _JOURNAL.locked():
+        mapping, _ = _load_state()
+        _write_snapshot_locked([{"u": u, "p": p} for u, p in mapping.items()])
+    return len(mapping)
+
+
+_compacting = threading.Lock()
+
+
+def _maybe_compact() -> None:
+    """Compacta en segundo plano si el journal pasa de USERS_JOURNAL_MAX_BYTES."""
+    if USERS_JOURNAL_MAX_BYTES <= 0 or _JOURNAL.size() <= USERS_JOURNAL_MAX_BYTES:
+        return
+    if not _compacting.acquire(blocking=False):
+        return  # ya hay una compactación en curso
+
+    def run():
+        try:
+            count = compact_users()
+            print(f"Journal de usuarios compactado ({count} usuarios)")
+        except (OSError, ValueError) as e:
+            print(f"Error compactando el journal de usuarios: {e}")
+        finally:
+            _compacting.release()
+
+    threading.Thread(target=run, name="users-compact", daemon=True).start()
+
+
+def _commit(record: Dict[str, str], pending) -> Optional[str]:
+    """Espera a que el registro sea durable; mensaje de error si no se pudo escribir."""
+    try:
+        _JOURNAL.wait(pending)
+    except OSError as e:
+        print(f"Error escribiendo el journal de usuarios ({record['op']} {record['u']}): {e}")
+        _STORE.invalidate()  # la caché ya tenía el cambio: volver a lo que hay en disco
+        return "No se pudo guardar el cambio; inténtalo de nuevo."
+    _maybe_compact()
+    return None
+
+
+def validate_username(username: str) -> Optional[str]:
+    """Mensaje de error si username (ya sin espacios alrededor) no es válido."""
+    if not username or " " in username:
+        return "El nombre de usuario no puede estar vacío ni contener espacios."
+    return None
 
 
 def create_user(username: str, password: str) -> Tuple[bool, str]:
     username = username.strip()
 
-    if not username or " " in username:
-        return False, "El nombre de usuario no puede estar vacío ni contener espacios."
+    error = validate_username(username)
+    if error:
+        return False, error
 
-    with _USERS_LOCK:
-        users, mapping = load_users()
-        if username in mapping:
+    # El hash es lento: se calcula (en el pool de contraseñas) fuera del lock
+    try:
+        stored = make_password_hash(str(password))
+    except PasswordBusyError:
+        return False, "El servidor está ocupado; inténtalo de nuevo en unos segundos."
+
+    if _DB is not None:
+        try:
+            created = _DB.create(username, stored)
+        except sqlite3.Error as e:
+            print(f"Error SQLite creando el usuario {username}: {e}")
+            return False, "No se pudo guardar el cambio; inténtalo de nuevo."
+        if not created:
             return False, f"El usuario '{username}' ya existe."
+        return True, f"Usuario '{username}' creado correctamente."
 
-        users.append({"u": username, "p": str(password)})
-        save_users(users)
+    record = {"op": "create", "u": username, "p": stored}
+    with _USERS_LOCK:
+        if _STORE.get_password(username) is not None:
+            return False, f"El usuario '{username}' ya existe."
+        pending = _JOURNAL.submit(record)
+        _STORE.add(username, stored)
 
+    # El fsync se espera fuera del lock: las altas concurrentes comparten lote
+    error = _commit(record, pending)
+    if error:
+        return False, error
     return True, f"Usuario '{username}' creado correctamente."
 
 
 def delete_user(username: str) -> Tuple[bool, str]:
     username = username.strip()
 
-    with _USERS_LOCK:
-        users, mapping = load_users()
-
-        if username == "admin":
-            return False, "No se puede eliminar la cuenta 'admin'."
+    if username == "admin":
+        return False, "No se puede eliminar la cuenta 'admin'."
 
-        if username not in mapping:
+    if _DB is not None:
+        try:
+            deleted = _DB.delete(username)
+        except sqlite3.Error as e:
+            print(f"Error SQLite eliminando el usuario {username}: {e}")
+            return False, "No se pudo guardar el cambio; inténtalo de nuevo."
+        if not deleted:
             return False, f"El usuario '{username}' no existe."
+        return True, f"Usuario '{username}' eliminado correctamente."
 
-        new_users = [u for u in users if u.get("u") != username]
-        save_users(new_users)
+    record = {"op": "delete", "u": username}
+    with _USERS_LOCK:
+        if _STORE.get_password(username) is None:
+            return False, f"El usuario '{username}' no existe."
+        pending = _JOURNAL.submit(record)
+        _STORE.remove(username)
 
+    error = _commit(record, pending)
+    if error:
+        return False, error
     return True, f"Usuario '{username}' eliminado correctamente."
+
+
+def bulk_write(rows: Dict[str, str], *, overwrite: bool, atomic: bool) -> Tuple[int, int, List[str]]:
+    """
+    Crea (y con overwrite, actualiza) los usuarios de rows (usuario ->
+    valor almacenado) en una única escritura: una instantánea nueva de
+    USERS_FILE (temporal + rename, con el journal ya aplicado) o una
+    transacción SQLite. Sin overwrite, los que ya existen son conflictos;
+    con atomic, un conflicto anula toda la escritura.
+    Devuelve (creados, actualizados, conflictos). OSError / sqlite3.Error
+    si no se pudo escribir (no se aplica nada).
+    """
+    if _DB is not None:
+        return _DB.bulk_write(rows.items(), overwrite=overwrite, atomic=atomic)
+
+    created = updated = 0
+    with _USERS_LOCK, _JOURNAL.locked():
+        mapping, _ = _load_state()
+        conflicts = [u for u in rows if u in mapping] if not overwrite else []
+        if conflicts and atomic:
+            return 0, 0, conflicts
+        for u, p in rows.items():
+            if u not in mapping:
+                created += 1
+            elif overwrite:
+                updated += 1
+            else:
+                continue
+            mapping[u] = p
+        if created or updated:
+            _write_snapshot_locked([{"u": u, "p": p} for u, p in mapping.items()])
+    _STORE.invalidate()
+    return created, updated, conflicts
+
+
+def migrate_plaintext_passwords(hash_fn) -> int:
+    """
+    Convierte a hash (hash_fn) todas las contraseñas en claro de USERS_FILE
+    (con el journal ya aplicado) y lo reescribe. Devuelve cuántas se migraron.
+    Con SQLite, actualiza las filas de la base.
+    """
+    if _DB is not None:
+        changed = [(u["u"], hash_fn(u["p"])) for u in _DB.all() if not is_hashed(u["p"])]
+        return _DB.upsert_many(changed) if changed else 0
+
+    with _USERS_LOCK, _JOURNAL.locked():
+        mapping, _ = _load_state()
+        migrated = 0
+        for u, p in mapping.items():
+            if not is_hashed(p):
+                mapping[u] = hash_fn(p)
+                migrated += 1
+        if migrated:
+            _write_snapshot_locked([{"u": u, "p": p} for u, p in mapping.items()])
+    _STORE.invalidate()
+    return migrated
+
+
+def export_users(path: Path) -> int:
+    """Escribe todos los usuarios en path con el formato de users.json. Devuelve cuántos."""
+    users, _ = load_users()
+    atomic_write(path, json.dumps(users, indent=2, ensure_ascii=False).encode("utf-8"))
+    return len(users)
+
+
+def import_users(path: Path) -> int:
+    """Sustituye todos los usuarios por los de path (formato users.json). Devuelve cuántos."""
+    users, _ = _clean_users(json.loads(Path(path).read_text(encoding="utf-8")))
+    with _USERS_LOCK:
+        save_users(users)
+    return len(users)
+
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "compact":
+        print(f"{compact_users()} usuarios en {USERS_FILE}")
+    elif cmd == "export" and len(sys.argv) == 3:
+        print(f"{export_users(Path(sys.argv[2]))} usuarios exportados a {sys.argv[2]}")
+    elif cmd == "import" and len(sys.argv) == 3:
+        print(f"{import_users(Path(sys.argv[2]))} usuarios importados de {sys.argv[2]}")
+    else:
+        print("Uso: python3 -m app.users compact | export <archivo> | import <archivo>", file=sys.stderr)
+        sys.exit(2)
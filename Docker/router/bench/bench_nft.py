@@ -0,0 +1,83 @@
+# bench/bench_nft.py
+"""
+Benchmark del backend nft cuando no hay libnftables: cada orden es un
+`nft -f -` nuevo (app.nft_backend._NftBinary).
+
+Mide con NftBackend, por llamada:
+    add        alta suelta (un script de 3 líneas)
+    test       comprobación de una IP (lo que hace cada petición al portal)
+    list       listado JSON del set
+    batch_64   un lote de 64 altas (lo que envía IpsetBatcher)
+con el binario nft (--nft, necesita root y la tabla de entrypoint.sh) o,
+por defecto, con un nft falso que solo lee el script: así se mide el
+fork/exec y la parte Python, sin el arranque del nft real. Como
+referencia, lo mismo con un runner en proceso (lo que cuesta la parte
+Python con libnftables, sin el trabajo de la librería).
+
+Uso (desde Docker/router):
+    python3 -m bench.bench_nft [--calls 200] [--nft /usr/sbin/nft]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from app.nft_backend import NftBackend, _NftBinary
+
+_FAKE_NFT = """#!/bin/sh
+cat > /dev/null
+[ "$1" = "-j" ] && echo '{"nftables": []}'
+exit 0
+"""
+
+
+def _in_process(script: str, json_output: bool = False):
+    return 0, '{"nftables": []}' if json_output else "", ""
+
+
+def measure(backend: NftBackend, calls: int) -> dict:
+    batch = [("add", f"10.1.{i // 256}.{i % 256}", 300) for i in range(64)]
+    cases = {
+        "add": lambda i: backend.add(f"10.0.{i // 256}.{i % 256}", 300),
+        "test": lambda i: backend.test("10.0.0.1"),
+        "list": lambda i: backend.list_entries(),
+        "batch_64": lambda i: backend.apply_batch(batch),
+    }
+    out = {}
+    for name, fn in cases.items():
+        t = time.perf_counter()
+        for i in range(calls):
+            fn(i)
+        out[f"{name}_us"] = round((time.perf_counter() - t) / calls * 1e6, 1)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--nft", help="binario nft real (por defecto, uno falso)")
+    parser.add_argument("--family", default="inet")
+    parser.add_argument("--table", default="portal")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="portal-bench-nft-") as tmp:
+        binary = args.nft
+        if binary is None:
+            binary = str(Path(tmp) / "nft")
+            Path(binary).write_text(_FAKE_NFT)
+            os.chmod(binary, 0o755)
+        runner = _NftBinary(binary)
+        results = {
+            "nft_binary": measure(NftBackend(args.family, args.table, runner=runner.run), args.calls),
+            "in_process": measure(NftBackend(args.family, args.table, runner=_in_process), args.calls),
+        }
+        results["nft_binary"]["processes"] = runner.runs
+    results["binary"] = args.nft or "falso"
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# bench/bench_parser.py
+"""
+Benchmark del parser HTTP: parser original (bytes += chunk) frente a
+app.http_parser.RequestParser (bytearray preasignado + recv_into).
+
+1) Comprueba que ambos parsers devuelven lo mismo para un conjunto de
+   peticiones (mismo comportamiento, mismos errores).
+2) Mide tiempo y memoria en escenarios de headers troceados y bodies
+   grandes: pico de tracemalloc y bytes asignados para buffers (suma de
+   cada concatenación en el original; buffer + body preasignado en el nuevo).
+
+Uso (desde Docker/router):
+    python3 -m bench.bench_parser [--repeat N]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from app.http_parser import RequestParser
+
+
+class FakeSocket:
+    """Socket en memoria que entrega los datos en trozos fijos (como un cliente lento)."""
+
+    def __init__(self, data: bytes, chunk: int):
+        self._data = memoryview(data)
+        self._pos = 0
+        self._chunk = chunk
+
+    def _next(self, n: int) -> memoryview:
+        n = min(n, self._chunk, len(self._data) - self._pos)
+        out = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return out
+
+    def recv(self, n: int) -> bytes:
+        return bytes(self._next(n))
+
+    def recv_into(self, buf, nbytes: int = 0) -> int:
+        piece = self._next(nbytes or len(buf))
+        buf[:len(piece)] = piece
+        return len(piece)
+
+
+# ----------------------------
+# Parser original (referencia)
+# ----------------------------
+
+def _legacy_recv_until(sock, marker: bytes, max_bytes: int, stats: dict) -> bytes:
+    data = b""
+    while marker not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        stats["allocated"] += len(data)
+        if len(data) > max_bytes:
+            raise ValueError("header too large")
+    return data
+
+
+def legacy_parse(sock, stats: dict | None = None) -> tuple[str, str, dict, bytes]:
+    """Copia del parser original; stats["allocated"] suma los bytes de cada concatenación."""
+    stats = stats if stats is not None else {"allocated": 0}
+    raw = _legacy_recv_until(sock, b"\r\n\r\n", 128 * 1024, stats)
+    if b"\r\n\r\n" not in raw:
+        raise ValueError("incomplete headers")
+    head, rest = raw.split(b"\r\n\r\n", 1)
+    lines = head.split(b"\r\n")
+    parts = lines[0].decode("iso-8859-1", errors="replace").split()
+    if len(parts) < 2:
+        raise ValueError("bad request line")
+    method, path = parts[0].upper(), parts[1]
+    headers: dict[str, str] = {}
+    for ln in lines[1:]:
+        s = ln.decode("iso-8859-1", errors="replace")
+        if ":" in s:
+            k, v = s.split(":", 1)
+            headers[k.strip()] = v.strip()
+    body = b""
+    cl = headers.get("Content-Length") or headers.get("content-length")
+    if cl:
+        try:
+            n = int(cl)
+        except ValueError:
+            raise ValueError("bad content-length")
+        if n > 2 * 1024 * 1024:
+            raise ValueError("payload too large")
+        body = rest
+        while len(body) < n:
+            chunk = sock.recv(min(4096, n - len(body)))
+            if not chunk:
+                break
+            body += chunk
+            stats["allocated"] += len(body)
+        body = body[:n]
+    return method, path, headers, body
+
+
+def new_parse(sock, stats: dict | None = None) -> tuple[str, str, dict, bytes]:
+    """RequestParser; stats["allocated"] suma el buffer y el body preasignado."""
+    parser = RequestParser(sock)
+    req = parser.read_request()
+    if req is None:
+        raise ValueError("incomplete headers")
+    method, path, _, headers, body = req
+    if stats is not None:
+        stats["allocated"] += len(parser._buf) + (len(body) if isinstance(body, bytearray) else 0)
+    return method, path, headers, body
+
+
+# ----------------------------
+# Equivalencia
+# ----------------------------
+
+def _request(path="/", headers=(), body=b"", method="GET") -> bytes:
+    lines = [f"{method} {path} HTTP/1.1", "Host: portal"]
+    lines += [f"{k}: {v}" for k, v in headers]
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + body
+
+
+CORPUS = [
+    _request("/login"),
+    _request("/status.json", [("X-Real-IP", "10.0.0.15")]),
+    _request("/login", [("Content-Type", "application/x-www-form-urlencoded")],
+             b"username=alice&password=1234", method="POST"),
+    _request("/admin/users", [("authorization", "Basic YWRtaW46YWRtaW4=")]),
+    _request("/x", [("X-Long", "a" * 20000)]),
+    _request("/upload", body=b"x" * 300_000, method="POST"),
+    b"POST /login HTTP/1.1\r\ncontent-length: 10\r\n\r\nabc",       # body truncado
+    b"GET / HTTP/1.1\r\nContent-Length: nope\r\n\r\n",               # content-length inválido
+    b"GET / HTTP/1.1\r\nContent-Length: 99999999\r\n\r\n",           # payload too large
+    b"GARBAGE\r\n\r\n",                                              # request line inválida
+    b"GET / HTTP/1.1\r\nHost: x\r\n",                                # headers incompletos
+    b"GET / HTTP/1.1\r\nX: " + b"a" * (200 * 1024) + b"\r\n\r\n",    # header too large
+]
+
+
+def _outcome(parse, data: bytes, chunk: int):
+    try:
+        method, path, headers, body = parse(FakeSocket(data, chunk))
+        return ("ok", (method, path, dict(headers), bytes(body)))
+    except ValueError as e:
+        return ("error", str(e))
+
+
+def check_equivalence() -> int:
+    checked = 0
+    for data in CORPUS:
+        for chunk in (1, 7, 4096, 1 << 20):
+            if chunk == 1 and len(data) > 50_000:
+                continue
+            old, new = _outcome(legacy_parse, data, chunk), _outcome(new_parse, data, chunk)
+            if old != new:
+                raise AssertionError(f"diferencia en {data[:40]!r} (chunk={chunk}): {old!r} != {new!r}")
+            checked += 1
+    return checked
+
+
+# ----------------------------
+# Medición
+# ----------------------------
+
+SCENARIOS = {
+    # headers de 32 KB llegando de 64 en 64 bytes (cliente lento)
+    "trickled_headers_32k": (_request("/login", [(f"X-H{i}", "v" * 100) for i in range(300)]), 64),
+    # POST con body de 1 MB en trozos de 4 KB
+    "body_1m": (_request("/upload", body=b"b" * (1 << 20), method="POST"), 4096),
+    # petición típica del portal en un solo recv
+    "small_get": (_request("/status.json", [("X-Real-IP", "10.0.0.15")]), 1 << 16),
+}
+
+
+def _measure(parse, data: bytes, chunk: int, repeat: int) -> dict:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        parse(FakeSocket(data, chunk))
+    elapsed = time.perf_counter() - t0
+
+    stats = {"allocated": 0}
+    tracemalloc.start()
+    parse(FakeSocket(data, chunk), stats)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "us_per_request": round(elapsed / repeat * 1e6, 1),
+        "peak_bytes": peak,
+        "buffer_bytes_allocated": stats["allocated"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {"equivalence_cases": check_equivalence(), "scenarios": {}}
+    for name, (data, chunk) in SCENARIOS.items():
+        repeat = args.repeat * (100 if name == "small_get" else 1)
+        results["scenarios"][name] = {
+            "legacy": _measure(legacy_parse, data, chunk, repeat),
+            "request_parser": _measure(new_parse, data, chunk, repeat),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench/bench_users.py
+"""
+Benchmark de los almacenes de usuarios: users.json (UserStore en memoria)
+frente a SQLite (app.user_sqlite), con --sizes usuarios (por defecto 1k,
+100k y 1M).
+
+Por almacén y tamaño, en un proceso hijo aparte (USERS_FILE/USERS_DB
+propios):
+    load_s       primera consulta (parseo de users.json / apertura de la base)
+    lookup_us    get_password de usuarios existentes y de inexistentes
+                 (p50/p99, un hilo)
+    lookups_s    consultas/s con --threads hilos a la vez
+    page_ms      página de 50 con prefijo (lo que hace /admin/users): la
+                 siguiente a otra (cursor after) y, en page_offset_ms,
+                 saltando 100 por posición (enlace directo a una página);
+                 page_count_ms, el primer total de ese prefijo (SQLite lo
+                 guarda hasta la siguiente escritura)
+    rss_mb       memoria residente del proceso tras cargar
+
+Uso (desde Docker/router):
+    python3 -m bench.bench_users [--sizes 1000,100000,1000000] [--lookups 20000]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROUTER_DIR = Path(__file__).resolve().parent.parent
+
+# Todas las cuentas comparten un hash: generar millones de scrypt no aporta nada aquí
+_HASH = "scrypt$16384$8$1$c2FsdHNhbHRzYWx0c2FsdA==$aGFzaGhhc2hoYXNoaGFzaGhhc2hoYXNoaGFzaGhhc2g="
+
+
+def _name(i: int) -> str:
+    return f"user{i:07d}"
+
+
+def _prepare(workdir: Path, size: int) -> Dict[str, str]:
+    """users.json y users.db con size usuarios; devuelve el entorno para los hijos."""
+    users_file = workdir / f"users-{size}.json"
+    users_db = workdir / f"users-{size}.db"
+    users = [{"u": "admin", "p": _HASH}] + [{"u": _name(i), "p": _HASH} for i in range(size)]
+    users_file.write_text(json.dumps(users, separators=(",", ":")), encoding="utf-8")
+
+    from app.user_sqlite import SqliteUserStore
+
+    SqliteUserStore(users_db).replace_all((u["u"], u["p"]) for u in users)
+    return {"USERS_FILE": str(users_file), "USERS_DB": str(users_db),
+            "USERS_JOURNAL_FILE": str(workdir / f"users-{size}.journal")}
+
+
+def _rss_mb() -> float:
+    """Memoria residente actual (ru_maxrss arrastra el pico del padre tras fork+exec)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    values.sort()
+    n = len(values)
+    return {
+        "p50": round(values[n // 2] * 1e6, 2),
+        "p99": round(values[min(n - 1, int(n * 0.99))] * 1e6, 2),
+    }
+
+
+def measure(size: int, lookups: int, threads: int) -> dict:
+    """Proceso hijo: mide el almacén de USERS_BACKEND."""
+    t0 = time.perf_counter()
+    from app import users
+
+    users.get_password("admin")
+    load_s = time.perf_counter() - t0
+
+    rng = random.Random(1)
+    hits = [_name(rng.randrange(size)) for _ in range(lookups)]
+    misses = [f"nadie{i}" for i in range(lookups)]
+    out: Dict[str, object] = {"load_s": round(load_s, 3)}
+    for label, names in (("hit", hits), ("miss", misses)):
+        lat = []
+        for name in names:
+            t = time.perf_counter()
+            users.get_password(name)
+            lat.append(time.perf_counter() - t)
+        out[f"lookup_us_{label}"] = _percentiles(lat)
+
+    per_thread = max(1, lookups // threads)
+
+    def worker(seed: int):
+        r = random.Random(seed)
+        for _ in range(per_thread):
+            users.get_password(_name(r.randrange(size)))
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    t = time.perf_counter()
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    out["lookups_s"] = round(per_thread * threads / (time.perf_counter() - t))
+
+    t = time.perf_counter()
+    users.page_users("user05", limit=0)
+    out["page_count_ms"] = round((time.perf_counter() - t) * 1000, 3)
+    for label, kwargs in (("page_ms", {"after": _name(550_000)}), ("page_offset_ms", {"offset": 100})):
+        t = time.perf_counter()
+        for _ in range(20):
+            users.page_users("user05", limit=50, **kwargs)
+        out[label] = round((time.perf_counter() - t) / 20 * 1000, 3)
+    out["rss_mb"] = _rss_mb()
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.lookups, args.threads)))
+        return
+
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="portal-bench-users-") as tmp:
+        for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+            print(f"{size} usuarios...", file=sys.stderr)
+            env = dict(os.environ, **_prepare(Path(tmp), size))
+            env.pop("USERS_JSON", None)
+            results[str(size)] = {}
+            for backend in ("file", "sqlite"):
+                res = subprocess.run(
+                    [sys.executable, "-m", "bench.bench_users", "--child", str(size),
+                     "--lookups", str(args.lookups), "--threads", str(args.threads)],
+                    cwd=ROUTER_DIR, env=dict(env, USERS_BACKEND=backend),
+                    capture_output=True, text=True, check=True,
+                )
+                results[str(size)][backend] = json.loads(res.stdout.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
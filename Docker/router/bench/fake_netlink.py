@@ -0,0 +1,227 @@
+# bench/fake_netlink.py
+"""
+Kernel ipset falso para probar app.ipset_netlink sin root.
+
+FakeIpsetKernel mantiene los sets en memoria y responde a los mensajes
+netlink (ADD/DEL/TEST/LIST) con el mismo formato que el kernel: ACK o
+NLMSG_ERROR con el errno de ipset, y dumps troceados en varios mensajes
+terminados en NLMSG_DONE. kernel.socket() devuelve un objeto con la
+interfaz de socket que usa IpsetNetlink (send/recv/settimeout/close).
+
+Uso (desde Docker/router):
+    python3 -m bench.fake_netlink [--ops N]
+
+Ejecuta la API de app.ipset_utils contra el kernel falso, comprueba los
+resultados y mide el coste por operación de la codificación netlink, una
+a una y agrupadas con IpsetBatcher desde varios hilos a la vez.
+"""
+
+import argparse
+import errno
+import json
+import struct
+import threading
+import time
+from collections import deque
+
+from app import ipset_netlink as nl
+
+_ENTRIES_PER_MESSAGE = 64
+
+
+class FakeIpsetKernel:
+    def __init__(self, sets=("authed",)):
+        self._sets: dict[str, dict[str, float]] = {name: {} for name in sets}
+        self._lock = threading.Lock()
+        self.messages = 0
+
+    def socket(self) -> "FakeNetlinkSocket":
+        return FakeNetlinkSocket(self)
+
+    # -- procesamiento de mensajes --------------------------------------
+
+    def handle(self, data: bytes) -> list[bytes]:
+        """Procesa un datagrama de petición y devuelve los datagramas de respuesta."""
+        replies: list[bytes] = []
+        for mtype, flags, seq, payload in nl.iter_messages(data):
+            self.messages += 1
+            header = data[:16]
+            try:
+                replies.extend(self._dispatch(mtype & 0xFF, flags, seq, payload))
+                if flags & nl.NLM_F_ACK:
+                    replies.append(self._error(seq, 0, header))
+            except OSError as e:
+                replies.append(self._error(seq, e.errno, header))
+        return replies
+
+    def _dispatch(self, cmd: int, flags: int, seq: int, payload: bytes) -> list[bytes]:
+        attrs = nl.parse_attrs(payload, 4)
+        setname = attrs[nl.IPSET_ATTR_SETNAME][0].rstrip(b"\0").decode("ascii")
+        with self._lock:
+            members = self._sets.get(setname)
+            if members is None:
+                raise OSError(errno.ENOENT, "set inexistente")
+
+            if cmd == nl.IPSET_CMD_LIST:
+                self._expire(members)
+                return self._dump(setname, members, seq)
+
+            elem = nl.parse_attrs(attrs[nl.IPSET_ATTR_DATA][0])
+            ipv4 = nl.parse_attrs(elem[nl.IPSET_ATTR_IP][0])[nl.IPSET_ATTR_IPADDR_IPV4][0]
+            ip = ".".join(str(b) for b in ipv4)
+            if members.get(ip, float("inf")) <= time.monotonic():
+                del members[ip]
+
+            if cmd == nl.IPSET_CMD_ADD:
+                if ip in members and flags & nl.NLM_F_EXCL:
+                    raise OSError(nl.IPSET_ERR_EXIST, "ya existe")
+                timeout = 0
+                if nl.IPSET_ATTR_TIMEOUT in elem:
+                    timeout = struct.unpack(">I", elem[nl.IPSET_ATTR_TIMEOUT][0])[0]
+                members[ip] = time.monotonic() + timeout if timeout else float("inf")
+            elif cmd in (nl.IPSET_CMD_DEL, nl.IPSET_CMD_TEST):
+                if ip not in members:
+                    raise OSError(nl.IPSET_ERR_EXIST, "no existe")
+                if cmd == nl.IPSET_CMD_DEL:
+                    del members[ip]
+            else:
+                raise OSError(errno.EOPNOTSUPP, "comando no soportado")
+        return []
+
+    @staticmethod
+    def _expire(members: dict[str, float]) -> None:
+        now = time.monotonic()
+        for ip in [ip for ip, exp in members.items() if exp <= now]:
+            del members[ip]
+
+    @staticmethod
+    def _message(mtype: int, flags: int, seq: int, payload: bytes) -> bytes:
+        return struct.pack("=IHHII", 16 + len(payload), mtype, flags, seq, 0) + payload
+
+    def _error(self, seq: int, err: int, header: bytes) -> bytes:
+        return self._message(nl.NLMSG_ERROR, 0, seq, struct.pack("=i", -err) + header)
+
+    def _dump(self, setname: str, members: dict[str, float], seq: int) -> list[bytes]:
+        now = time.monotonic()
+        items = list(members.items())
+        out = []
+        for start in range(0, len(items), _ENTRIES_PER_MESSAGE) or [0]:
+            entries = []
+            for ip, exp in items[start:start + _ENTRIES_PER_MESSAGE]:
+                timeout = 0 if exp == float("inf") else max(0, int(exp - now))
+                entries.append(nl.nl_nested(nl.IPSET_ATTR_DATA, nl.ip_attr(ip), nl.timeout_attr(timeout)))
+            payload = (
+                struct.pack("=BBH", 2, 0, 0)
+                + nl.nl_attr(nl.IPSET_ATTR_PROTOCOL, bytes([nl.IPSET_PROTOCOL]))
+                + nl.setname_attr(setname)
+                + nl.nl_nested(nl.IPSET_ATTR_ADT, *entries)
+            )
+            out.append(self._message((nl.NFNL_SUBSYS_IPSET << 8) | nl.IPSET_CMD_LIST, 0x2, seq, payload))
+        out.append(self._message(nl.NLMSG_DONE, 0x2, seq, struct.pack("=i", 0)))
+        return out
+
+
+class FakeNetlinkSocket:
+    """Socket de un proceso contra FakeIpsetKernel: cada recv entrega un datagrama."""
+
+    def __init__(self, kernel: FakeIpsetKernel):
+        self._kernel = kernel
+        self._pending: deque[bytes] = deque()
+
+    def settimeout(self, timeout) -> None:
+        pass
+
+    def send(self, data: bytes) -> int:
+        self._pending.extend(self._kernel.handle(bytes(data)))
+        return len(data)
+
+    def recv(self, bufsize: int) -> bytes:
+        if not self._pending:
+            raise TimeoutError("timed out")
+        return self._pending.popleft()[:bufsize]
+
+    def close(self) -> None:
+        self._pending.clear()
+
+
+# ----------------------------
+# Comprobación y medición
+# ----------------------------
+
+def check_api() -> int:
+    from app import ipset_utils
+
+    kernel = FakeIpsetKernel()
+    ipset_utils.use_netlink_client(nl.IpsetNetlink(sock_factory=kernel.socket))
+    checks = [
+        (ipset_utils.check_ipset("10.0.0.1"), False),
+        (ipset_utils.add_to_ipset("10.0.0.15"), True),
+        (ipset_utils.add_to_ipset("10.0.0.15"), True),          # -exist
+        (ipset_utils.check_ipset("10.0.0.15"), True),
+        (ipset_utils.check_ipset("10.0.0.1"), False),           # IP prefijo de otra
+        (ipset_utils.get_remaining_timeout("10.0.0.1"), 0),
+        (0 < ipset_utils.get_remaining_timeout("10.0.0.15") <= ipset_utils.AUTH_TIMEOUT, True),
+        (ipset_utils.remove_from_ipset("10.0.0.15"), True),
+        (ipset_utils.remove_from_ipset("10.0.0.15"), False),
+        (ipset_utils.check_ipset("10.0.0.15"), False),
+    ]
+    # Dump de más de un mensaje
+    for i in range(200):
+        ipset_utils.add_to_ipset(f"10.1.{i // 250}.{i % 250}")
+    checks.append((len(ipset_utils._get_netlink().list_entries("authed")), 200))
+    checks.append((ipset_utils.get_remaining_timeout("10.1.0.199") > 0, True))
+
+    for i, (got, expected) in enumerate(checks):
+        if got != expected:
+            raise AssertionError(f"comprobación {i}: {got!r} != {expected!r}")
+    return len(checks)
+
+
+def measure(ops: int) -> dict:
+    kernel = FakeIpsetKernel()
+    client = nl.IpsetNetlink(sock_factory=kernel.socket)
+    t0 = time.perf_counter()
+    for i in range(ops):
+        ip = f"10.2.{(i >> 8) & 255}.{i & 255}"
+        client.add("authed", ip, 3600)
+        client.test("authed", ip)
+    elapsed = time.perf_counter() - t0
+    return {"ops": ops * 2, "us_per_op": round(elapsed / (ops * 2) * 1e6, 2)}
+
+
+def measure_batch(ops: int, threads: int = 32) -> dict:
+    from app.ipset_batch import IpsetBatcher
+
+    kernel = FakeIpsetKernel()
+    client = nl.IpsetNetlink(sock_factory=kernel.socket)
+    batcher = IpsetBatcher(
+        lambda batch: [err == 0 for err in client.batch("authed", batch)], window=0.005, max_ops=64
+    )
+
+    def worker(t: int) -> None:
+        for i in range(t, ops, threads):
+            batcher.submit("add", f"10.4.{(i >> 8) & 255}.{i & 255}", 3600)
+
+    t0 = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+    return {"ops": ops, "threads": threads, "ops_per_s": round(ops / elapsed), **batcher.stats()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps({
+        "api_checks": check_api(),
+        "fake_kernel": measure(args.ops),
+        "fake_kernel_batched": measure_batch(args.ops),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
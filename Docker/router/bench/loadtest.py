@@ -0,0 +1,343 @@
+# bench/loadtest.py
+"""
+Prueba de carga de extremo a extremo del backend del portal.
+
+Arranca el servidor (app.main, por defecto ManualThreadPoolHTTPServer) en
+un proceso aparte, con un users.json generado de --users usuarios y el
+kernel ipset falso de bench.fake_netlink, y lanza contra él --clients
+hilos cliente con conexiones keep-alive durante --duration segundos por
+escenario:
+
+    login_storm     POST /login con usuarios distintos desde IPs distintas
+    status_polling  GET /status.json desde --ips IPs (la mitad autenticadas)
+    static          GET /static/base.css con Accept-Encoding: gzip
+    admin           GET /admin/users con credenciales de administrador
+
+Imprime (o guarda con --out) un JSON por escenario con peticiones/s,
+latencias p50/p95/p99/máx en ms, errores y status recibidos, más el commit
+y la configuración, para comparar ejecuciones entre commits.
+
+Uso (desde Docker/router):
+    python3 -m bench.loadtest [--users 1000] [--clients 32] [--duration 10]
+                              [--scenarios login_storm,status_polling] [--out r.json]
+
+Con --firewall memory el servidor usa el backend en memoria (ver
+app.firewall) en lugar del ipset falso.
+
+Los límites por IP (LOGIN_RATE_LIMIT, STATUS_RATE_LIMIT) se desactivan en
+el servidor de prueba salvo con --rate-limits, y el log de acceso salvo
+con --access-log. Las demás variables de entorno (SERVER_WORKERS,
+PASSWORD_WORKERS, ...) se pasan tal cual al servidor.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+ROUTER_DIR = Path(__file__).resolve().parent.parent
+
+USER_PASSWORD = "bench-password"
+ADMIN_PASSWORD = "bench-admin"
+
+Request = Tuple[str, str, Dict[str, str], bytes]  # (método, ruta, headers, body)
+
+
+def _ip(n: int, base: int = 10) -> str:
+    return f"{base}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+
+
+# ----------------------------
+# Escenarios
+# ----------------------------
+
+class Scenario(NamedTuple):
+    description: str
+    make: Callable[[int, int, argparse.Namespace], Request]  # (cliente, n, args) -> petición
+    expect: Tuple[int, ...]
+
+
+def _login(client: int, n: int, args) -> Request:
+    seq = n * args.clients + client
+    user = f"user{seq % args.users:05d}"
+    body = urllib.parse.urlencode({"username": user, "password": USER_PASSWORD}).encode()
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "X-Real-IP": _ip(seq % (1 << 24), 10),
+    }
+    return "POST", "/login", headers, body
+
+
+def _status(client: int, n: int, args) -> Request:
+    ip = _ip((n * args.clients + client) % args.ips, 172)
+    return "GET", "/status.json", {"X-Real-IP": ip}, b""
+
+
+def _static(client: int, n: int, args) -> Request:
+    return "GET", "/static/base.css", {"Accept-Encoding": "gzip"}, b""
+
+
+def _admin(client: int, n: int, args) -> Request:
+    token = base64.b64encode(f"admin:{ADMIN_PASSWORD}".encode()).decode()
+    return "GET", "/admin/users", {"Authorization": f"Basic {token}"}, b""
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "login_storm": Scenario("POST /login, usuario e IP distintos en cada petición", _login, (302,)),
+    "status_polling": Scenario("GET /status.json desde un conjunto fijo de IPs", _status, (200,)),
+    "static": Scenario("GET /static/base.css (gzip)", _static, (200,)),
+    "admin": Scenario("GET /admin/users con Basic auth", _admin, (200,)),
+}
+
+
+# ----------------------------
+# Servidor bajo prueba (proceso hijo)
+# ----------------------------
+
+def write_users_file(path: Path, count: int) -> None:
+    """users.json con admin + count usuarios; todos comparten un hash (generarlo es caro)."""
+    from app.passwords import hash_password
+
+    user_hash = hash_password(USER_PASSWORD)
+    users = [{"u": "admin", "p": hash_password(ADMIN_PASSWORD)}]
+    users.extend({"u": f"user{i:05d}", "p": user_hash} for i in range(count))
+    path.write_text(json.dumps(users), encoding="utf-8")
+
+
+def serve(port_file: str, mode: str, authed_ips: int, firewall: str) -> None:
+    """Proceso hijo: servidor de app.main con el kernel ipset falso o el backend en memoria."""
+    from app import ipset_netlink, ipset_utils, main
+    from app.firewall import MemoryBackend
+    from app.prefork import create_listen_socket
+    from bench.fake_netlink import FakeIpsetKernel
+
+    if firewall == "memory":
+        backend = MemoryBackend()
+        for n in range(authed_ips):
+            backend.add(_ip(n, 172), 3600)
+        ipset_utils.use_backend(backend)
+    else:
+        kernel = FakeIpsetKernel()
+        client = ipset_netlink.IpsetNetlink(sock_factory=kernel.socket)
+        for n in range(authed_ips):
+            client.add("authed", _ip(n, 172), 3600)
+        ipset_utils.use_netlink_client(client)
+
+    sock = create_listen_socket("127.0.0.1", 0, 1024)
+    port = sock.getsockname()[1]
+    # Las conexiones esperan en el backlog hasta que _serve empieza a aceptar
+    Path(port_file).write_text(str(port))
+    main._serve(port, mode, sock)
+
+
+def start_server(args, workdir: Path) -> Tuple[subprocess.Popen, int]:
+    users_file = workdir / "users.json"
+    write_users_file(users_file, args.users)
+    port_file = workdir / "port"
+    env = dict(os.environ, USERS_FILE=str(users_file), PYTHONUNBUFFERED="1")
+    if not args.rate_limits:
+        env.update(LOGIN_RATE_LIMIT="0", STATUS_RATE_LIMIT="0")
+    if not args.access_log:
+        env["ACCESS_LOG"] = "0"
+    cmd = [sys.executable, "-m", "bench.loadtest", "--serve", str(port_file),
+           "--mode", args.mode, "--ips", str(args.ips), "--firewall", args.firewall]
+    # Sesión propia: al parar se señaliza todo el grupo (incluidos los procesos de contraseñas)
+    proc = subprocess.Popen(cmd, cwd=ROUTER_DIR, env=env, stdout=subprocess.DEVNULL,
+                            start_new_session=True)
+    deadline = time.monotonic() + 30
+    while not port_file.exists() or not port_file.read_text():
+        if proc.poll() is not None or time.monotonic() > deadline:
+            stop_server(proc)
+            raise RuntimeError("el servidor de prueba no arrancó")
+        time.sleep(0.05)
+    return proc, int(port_file.read_text())
+
+
+def stop_server(proc: subprocess.Popen) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+# ----------------------------
+# Generador de carga
+# ----------------------------
+
+class _ClientResult:
+    __slots__ = ("latencies", "statuses", "errors")
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+
+
+def _client_loop(port: int, scenario: Scenario, client: int, args, start_at: float,
+                 record_from: float, stop_at: float, out: _ClientResult) -> None:
+    conn: Optional[http.client.HTTPConnection] = None
+    n = 0
+    while time.monotonic() < start_at:
+        time.sleep(0.001)
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        method, path, headers, body = scenario.make(client, n, args)
+        n += 1
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.timeout)
+            conn.request(method, path, body=body or None, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+            if resp.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            status = None
+            if conn is not None:
+                conn.close()
+            conn = None
+        elapsed = time.perf_counter() - t0
+        if now < record_from:
+            continue  # calentamiento
+        out.latencies.append(elapsed)
+        key = str(status) if status is not None else "exception"
+        out.statuses[key] = out.statuses.get(key, 0) + 1
+        if status not in scenario.expect:
+            out.errors += 1
+    if conn is not None:
+        conn.close()
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def run_scenario(port: int, name: str, args) -> dict:
+    scenario = SCENARIOS[name]
+    results = [_ClientResult() for _ in range(args.clients)]
+    start_at = time.monotonic() + 0.2
+    record_from = start_at + args.warmup
+    stop_at = record_from + args.duration
+    threads = [
+        threading.Thread(target=_client_loop,
+                         args=(port, scenario, c, args, start_at, record_from, stop_at, results[c]))
+        for c in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies = sorted(lat for r in results for lat in r.latencies)
+    statuses: Dict[str, int] = {}
+    for r in results:
+        for k, v in r.statuses.items():
+            statuses[k] = statuses.get(k, 0) + v
+    total = len(latencies)
+    errors = sum(r.errors for r in results)
+    return {
+        "description": scenario.description,
+        "requests": total,
+        "rps": round(total / args.duration, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROUTER_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return res.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000, help="usuarios del users.json generado")
+    parser.add_argument("--ips", type=int, default=1000, help="IPs distintas en status_polling")
+    parser.add_argument("--clients", type=int, default=32, help="hilos cliente concurrentes")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos medidos por escenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="segundos sin medir al empezar")
+    parser.add_argument("--timeout", type=float, default=10.0, help="timeout por petición")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="lista separada por comas")
+    parser.add_argument("--mode", default="threadpool", choices=("threadpool", "asyncio"))
+    parser.add_argument("--firewall", default="ipset", choices=("ipset", "memory"),
+                        help="ipset con kernel falso o backend en memoria")
+    parser.add_argument("--rate-limits", action="store_true", help="mantener los límites por IP")
+    parser.add_argument("--access-log", action="store_true", help="mantener el log de acceso")
+    parser.add_argument("--out", help="guardar el JSON en este archivo")
+    parser.add_argument("--serve", metavar="PORT_FILE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.mode, args.ips // 2, args.firewall)
+        return
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(unknown)} (opciones: {', '.join(SCENARIOS)})")
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "mode": args.mode,
+            "firewall": args.firewall,
+            "users": args.users,
+            "ips": args.ips,
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "server_workers": os.getenv("SERVER_WORKERS", "10"),
+            "password_workers": os.getenv("PASSWORD_WORKERS", "2"),
+            "rate_limits": args.rate_limits,
+            "access_log": args.access_log,
+        },
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="portal-loadtest-") as tmp:
+        proc, port = start_server(args, Path(tmp))
+        try:
+            for name in names:
+                print(f"escenario {name}...", file=sys.stderr)
+                report["scenarios"][name] = run_scenario(port, name, args)
+        finally:
+            stop_server(proc)
+
+    out = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(out + "\n", encoding="utf-8")
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,16 @@ set -euo pipefail
 : "${LAN_IP:=10.200.0.254}"            # IP router LAN
 : "${LAN_CIDR:=10.200.0.0/24}"         # Subred LAN
 : "${PORTAL_PORT:=8080}"               # Puerto backend Python
+: "${SERVER_MODE:=threadpool}"         # Modo del backend: threadpool | asyncio
+: "${PORTAL_PROCESSES:=1}"             # Procesos pre-fork del backend (0 = uno por núcleo)
 : "${NGINX_HTTP_PORT:=80}"             # Puerto HTTP (redirige a HTTPS)
 : "${NGINX_HTTPS_PORT:=443}"           # Puerto HTTPS
 : "${DNS_CACHE_SIZE:=1000}"
 : "${AUTH_TIMEOUT:=3600}"              # Timeout ipset
+: "${FIREWALL_BACKEND:=ipset}"          # Set de autenticados: ipset | nft | memory
+: "${NFT_FAMILY:=inet}"                 # Tabla nftables del backend nft
+: "${NFT_TABLE:=portal}"
+: "${USERS_IMPORT_MAX_BYTES:=67108864}"  # Tamaño máximo de /admin/users/import
 : "${CERT_CN:=portal.hastalap}"        # Nombre del certificado TLS
 : "${BROWSER_URL:=}"                   # noVNC (opcional)
 
@@ -106,9 +112,36 @@ pgrep -x dnsmasq >/dev/null \
   dnsmasq --keep-in-foreground --conf-dir=/etc/dnsmasq.d >/tmp/dnsmasq.log 2>&1 &
 
 #####################################
-#     IPSET + IPTABLES (PORTAL)
+#  SET DE AUTENTICADOS (PORTAL)
 #####################################
 
+# Permitir backend Python en LAN
+iptables -C INPUT -i "$LAN_IF" -p tcp --dport "$PORTAL_PORT" -j ACCEPT 2>/dev/null || \
+iptables -A INPUT -i "$LAN_IF" -p tcp --dport "$PORTAL_PORT" -j ACCEPT
+
+if [ "$FIREWALL_BACKEND" = "nft" ]; then
+
+# Set + reglas en nftables, en una sola transacción. Se reutilizan tabla y
+# set si ya existen (las IPs autenticadas sobreviven a un reinicio).
+log "Creando set nftables ${NFT_FAMILY} ${NFT_TABLE} authed"
+nft -f - <<EOF
+add table ${NFT_FAMILY} ${NFT_TABLE}
+add set ${NFT_FAMILY} ${NFT_TABLE} authed { type ipv4_addr; flags timeout; timeout ${AUTH_TIMEOUT}s; }
+add chain ${NFT_FAMILY} ${NFT_TABLE} prerouting { type nat hook prerouting priority dstnat; policy accept; }
+add chain ${NFT_FAMILY} ${NFT_TABLE} forward { type filter hook forward priority filter; policy accept; }
+flush chain ${NFT_FAMILY} ${NFT_TABLE} prerouting
+flush chain ${NFT_FAMILY} ${NFT_TABLE} forward
+add rule ${NFT_FAMILY} ${NFT_TABLE} prerouting iifname "${LAN_IF}" tcp dport ${NGINX_HTTP_PORT} ip saddr != @authed dnat ip to ${LAN_IP}:${NGINX_HTTP_PORT}
+add rule ${NFT_FAMILY} ${NFT_TABLE} forward iifname "${LAN_IF}" oifname "${UPLINK_IF}" ip saddr @authed accept
+add rule ${NFT_FAMILY} ${NFT_TABLE} forward iifname "${LAN_IF}" oifname "${UPLINK_IF}" reject
+EOF
+
+elif [ "$FIREWALL_BACKEND" = "memory" ]; then
+
+log "FIREWALL_BACKEND=memory: el portal no controla el tráfico (solo pruebas)"
+
+else
+
 log "Creando ipset authed"
 ipset create authed hash:ip timeout "${AUTH_TIMEOUT}" -exist
 
@@ -118,10 +151,6 @@ iptables -N CP_FILTER 2>/dev/null || true
 iptables -t nat -F CP_REDIRECT || true
 iptables -F CP_FILTER || true
 
-# Permitir backend Python en LAN
-iptables -C INPUT -i "$LAN_IF" -p tcp --dport "$PORTAL_PORT" -j ACCEPT 2>/dev/null || \
-iptables -A INPUT -i "$LAN_IF" -p tcp --dport "$PORTAL_PORT" -j ACCEPT
-
 # Redirigir NO autenticados HTTP 80 -> portal
 iptables -t nat -C PREROUTING -i "$LAN_IF" -p tcp --dport "$NGINX_HTTP_PORT" \
   -m set ! --match-set authed src -j CP_REDIRECT 2>/dev/null \
@@ -144,13 +173,15 @@ iptables -I FORWARD 1 -i "$LAN_IF" -o "$UPLINK_IF" -m set --match-set authed src
 # Esta regla bloquea TODO: HTTPS, HTTP (excepto el redirigido), ICMP, UDP, etc.
 iptables -I FORWARD 2 -i "$LAN_IF" -o "$UPLINK_IF" -m set ! --match-set authed src -j REJECT
 
+fi
+
 #####################################
 #        BACKEND PYTHON
 #####################################
 
 log "Iniciando backend Python en puerto ${PORTAL_PORT}"
 cd /app
-python3 -u -m app.main "${PORTAL_PORT}" &
+python3 -u -m app.main "${PORTAL_PORT}" --mode "${SERVER_MODE}" --processes "${PORTAL_PROCESSES}" &
 PORTAL_PID=$!
 
 #####################################
@@ -173,6 +204,14 @@ if [[ ! -f "$TLS_KEY" || ! -f "$TLS_CERT" ]]; then
 fi
 
 cat >/etc/nginx/conf.d/portal.conf <<EOF
+# Backend Python con conexiones persistentes (keep-alive).
+# keepalive_timeout debe ser menor que KEEPALIVE_TIMEOUT del backend.
+upstream portal_backend {
+    server 127.0.0.1:${PORTAL_PORT};
+    keepalive 32;
+    keepalive_timeout 10s;
+}
+
 server {
     listen ${NGINX_HTTP_PORT} default_server;
     server_name _;
@@ -229,9 +268,25 @@ server {
     ssl_protocols TLSv1.2 TLSv1.3;
     ssl_ciphers HIGH:!aNULL:!MD5;
 
+    # Alta masiva de usuarios: archivos grandes y respuesta lenta si hay
+    # que calcular muchos hashes (ver /admin/users/import)
+    location = /admin/users/import {
+        client_max_body_size ${USERS_IMPORT_MAX_BYTES};
+        proxy_read_timeout 600s;
+        proxy_pass http://portal_backend;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+    }
+
     # Proxy al backend Python
     location / {
-        proxy_pass http://127.0.0.1:${PORTAL_PORT};
+        proxy_pass http://portal_backend;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
@@ -258,4 +313,7 @@ fi
 
 log "Router listo. Portal en https://${CERT_CN}"
 
+# docker stop: reenviar SIGTERM al backend para que guarde las sesiones
+trap 'kill -TERM "$PORTAL_PID" 2>/dev/null; wait "$PORTAL_PID"' TERM INT
+
 wait "$PORTAL_PID"
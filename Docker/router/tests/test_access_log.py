@@ -0,0 +1,38 @@
+# tests/test_access_log.py
+"""
+Contadores del log de acceso (app.access_log.AccessLog) con varios
+workers registrando a la vez.
+
+Uso (desde Docker/router):
+    python3 -m unittest discover tests
+"""
+
+import threading
+import unittest
+
+from app.access_log import AccessLog
+
+
+class AccessLogCountersTest(unittest.TestCase):
+    def test_counters_are_exact_with_concurrent_workers(self):
+        threads, per_thread = 8, 20_000
+        log = AccessLog(sample=[("/status.json", 0.0)], queue_size=1)
+        log._thread = threading.current_thread()  # sin escritor: la cola se llena con el primero
+
+        def worker():
+            for _ in range(per_thread):
+                log.record({"status": 200, "path": "/status.json"})  # descartado por muestreo
+                log.record({"status": 500, "path": "/login"})        # cola llena
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        stats = log.stats()
+        self.assertEqual(stats["sampled_out"], threads * per_thread)
+        self.assertEqual(stats["dropped"] + stats["queued"], threads * per_thread)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# tests/test_http_parser.py
+"""
+Parser HTTP incremental (app.http_parser.RequestParser) y lectura de
+peticiones del modo asyncio (AsyncioHTTPServer._read_request).
+
+La equivalencia con el parser original usa el mismo corpus que
+bench/bench_parser.py, entregado en trozos de distintos tamaños.
+
+Uso (desde Docker/router):
+    python3 -m unittest discover tests
+"""
+
+import asyncio
+import unittest
+
+from app.async_server import AsyncioHTTPServer
+from app.http_parser import BodyStream, RequestParser
+from bench.bench_parser import CORPUS, FakeSocket, _outcome, _request, legacy_parse, new_parse
+
+CHUNK_SIZES = (1, 7, 4096, 1 << 20)
+
+
+def _parser(data: bytes, chunk: int = 1 << 20) -> RequestParser:
+    return RequestParser(FakeSocket(data, chunk))
+
+
+class EquivalenceTest(unittest.TestCase):
+    def test_same_result_as_original_parser(self):
+        for data in CORPUS:
+            for chunk in CHUNK_SIZES:
+                if chunk == 1 and len(data) > 50_000:
+                    continue  # byte a byte es demasiado lento para los bodies grandes
+                with self.subTest(request=data[:40], chunk=chunk):
+                    self.assertEqual(_outcome(new_parse, data, chunk), _outcome(legacy_parse, data, chunk))
+
+
+class RequestParserTest(unittest.TestCase):
+    def test_pipelined_requests_are_read_in_order(self):
+        data = (_request("/login", [("Content-Type", "application/x-www-form-urlencoded")],
+                         b"username=a&password=b", method="POST")
+                + _request("/status.json") + b"\r\n" + _request("/static/base.css"))
+        for chunk in CHUNK_SIZES:
+            with self.subTest(chunk=chunk):
+                parser = _parser(data, chunk)
+                seen = []
+                while True:
+                    req = parser.read_request()
+                    if req is None:
+                        break
+                    method, path, _, _, body = req
+                    seen.append((method, path, bytes(body)))
+                self.assertEqual(seen, [("POST", "/login", b"username=a&password=b"),
+                                        ("GET", "/status.json", b""),
+                                        ("GET", "/static/base.css", b"")])
+                self.assertEqual(parser.requests, 3)
+
+    def test_clean_close_between_requests(self):
+        parser = _parser(_request("/"))
+        self.assertIsNotNone(parser.read_request())
+        self.assertIsNone(parser.read_request())
+        self.assertFalse(parser.has_buffered())
+
+    def test_transfer_encoding_is_rejected(self):
+        for name in ("Transfer-Encoding", "transfer-encoding"):
+            data = (f"POST /login HTTP/1.1\r\n{name}: chunked\r\n\r\n".encode()
+                    + b"5\r\nGET /\r\n0\r\n\r\n")
+            with self.subTest(header=name), self.assertRaisesRegex(ValueError, "length required"):
+                _parser(data).read_request()
+
+    def test_iter_body_keeps_the_next_request(self):
+        body = b"b" * 300_000
+        data = _request("/upload", body=body, method="POST") + _request("/status.json")
+        parser = _parser(data, 4096)
+        _, _, _, headers = parser.read_head()
+        chunks = [bytes(c) for c in parser.iter_body(int(headers["Content-Length"]))]
+        self.assertEqual(b"".join(chunks), body)
+        self.assertTrue(all(len(c) <= 64 * 1024 for c in chunks))
+        self.assertEqual(parser.read_request()[1], "/status.json")
+
+    def test_streamed_body_is_read_by_the_handler(self):
+        body = b"u,p\n" * 50_000
+        data = _request("/admin/users/import", body=body, method="POST") + _request("/status.json")
+        parser = _parser(data, 4096)
+        _, _, _, _, stream = parser.read_request(lambda m, p: 1 << 20 if p.startswith("/admin") else None)
+        self.assertIsInstance(stream, BodyStream)
+        self.assertEqual(stream.length, len(body))
+        self.assertEqual(b"".join(bytes(c) for c in stream), body)
+        self.assertEqual(stream.remaining, 0)
+        self.assertEqual(parser.read_request()[1], "/status.json")
+
+    def test_streamed_body_over_limit(self):
+        data = _request("/admin/users/import", body=b"x" * 2048, method="POST")
+        with self.assertRaisesRegex(ValueError, "payload too large"):
+            _parser(data).read_request(lambda m, p: 1024)
+
+
+class AsyncReadRequestTest(unittest.TestCase):
+    """El modo asyncio aplica las mismas reglas de framing que RequestParser."""
+
+    def _read_all(self, data: bytes):
+        server = AsyncioHTTPServer("127.0.0.1", 0, handler=lambda *a: b"")
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            out = []
+            while True:
+                req = await server._read_request(reader)
+                if req is None:
+                    return out
+                out.append(req)
+
+        return asyncio.run(run())
+
+    def test_same_requests_as_request_parser(self):
+        for data in CORPUS:
+            with self.subTest(request=data[:40]):
+                try:
+                    expected = ("ok", [(m, p, h, bytes(b)) for m, p, _, h, b in [_parser(data).read_request()]])
+                except ValueError as e:
+                    expected = ("error", str(e))
+                try:
+                    got = ("ok", [(m, p, h, bytes(b)) for m, p, _, h, b in self._read_all(data)])
+                except ValueError as e:
+                    got = ("error", str(e))
+                self.assertEqual(got, expected)
+
+    def test_transfer_encoding_is_rejected(self):
+        data = b"POST /login HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nGET /\r\n0\r\n\r\n"
+        with self.assertRaisesRegex(ValueError, "length required"):
+            self._read_all(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
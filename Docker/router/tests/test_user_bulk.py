@@ -0,0 +1,102 @@
+# tests/test_user_bulk.py
+"""
+Exportación y alta masiva de usuarios (app.user_bulk): lo exportado se
+puede volver a importar tal cual, con users.json y con SQLite.
+
+Como en test_user_journal, app.users lee su configuración al importarse:
+cada caso corre en un proceso hijo con USERS_FILE/USERS_DB propios.
+
+Uso (desde Docker/router):
+    python3 -m unittest discover tests
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+
+ROUTER_DIR = Path(__file__).resolve().parent.parent
+
+# Hash ya calculado: la importación lo guarda tal cual (sin pasar por scrypt)
+_HASH = "scrypt$16384$8$1$c2FsdHNhbHRzYWx0c2FsdA==$aGFzaGhhc2hoYXNoaGFzaGhhc2hoYXNoaGFzaGhhc2g="
+
+_CHILD = """
+import json, sys
+from app import user_bulk, users
+
+def export(fmt):
+    return b"".join(user_bulk.export_chunks(fmt))
+
+def import_(data, **kw):
+    report = user_bulk.import_users([data[i:i + 1000] for i in range(0, len(data), 1000)], **kw)
+    return json.loads(report.to_json())
+"""
+
+
+class ExportImportRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="portal-test-bulk-")
+        self.dir = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _run(self, store: str, backend: str, code: str) -> dict:
+        users_file = self.dir / f"{store}.json"
+        if not users_file.exists():
+            users_file.write_text('[{"u":"admin","p":"admin"}]', encoding="utf-8")
+        env = dict(os.environ, USERS_FILE=str(users_file), USERS_DB=str(self.dir / f"{store}.db"),
+                   USERS_BACKEND=backend, USERS_JOURNAL_FSYNC="0", PASSWORD_WORKERS="0")
+        env.pop("USERS_JSON", None)
+        env.pop("USERS_JOURNAL_FILE", None)
+        proc = subprocess.run([sys.executable, "-c", _CHILD + textwrap.dedent(code)], cwd=ROUTER_DIR,
+                              env=env, capture_output=True, text=True, timeout=120)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def _round_trip(self, backend: str, fmt: str) -> None:
+        names = [f"alumno{i:03d}" for i in range(50)]
+        seeded = self._run("origen", backend, f"""
+            rows = {{u: {_HASH!r} for u in {names!r}}}
+            print(json.dumps(users.bulk_write(rows, overwrite=False, atomic=True)[:2]))
+        """)
+        self.assertEqual(seeded, [len(names), 0])
+
+        exported = self._run("origen", backend, f"""
+            data = export({fmt!r})
+            print(json.dumps({{"data": data.decode(), "again": import_(data, fmt={fmt!r}, mode="upsert")}}))
+        """)
+        self.assertIn("admin", exported["data"])  # la exportación incluye admin
+        again = exported["again"]
+        self.assertEqual(again["errors_total"], 0, again["errors"])
+        self.assertTrue(again["applied"])
+        self.assertEqual((again["created"], again["updated"], again["skipped"]), (0, len(names), 1))
+
+        restored = self._run("destino", backend, f"""
+            report = import_({exported["data"].encode()!r}, fmt={fmt!r})
+            print(json.dumps({{"report": report, "users": [u for b in users.iter_users() for u, _ in b],
+                              "hash": users.get_password("alumno007"), "admin": users.get_password("admin")}}))
+        """)
+        report = restored["report"]
+        self.assertEqual(report["errors_total"], 0, report["errors"])
+        self.assertEqual((report["created"], report["skipped"]), (len(names), 1))
+        self.assertEqual(sorted(restored["users"]), sorted(names + ["admin"]))
+        self.assertEqual(restored["hash"], _HASH)
+        self.assertEqual(restored["admin"], "admin")  # admin del destino sin tocar
+
+    def test_csv_round_trip_file(self):
+        self._round_trip("file", "csv")
+
+    def test_jsonl_round_trip_file(self):
+        self._round_trip("file", "jsonl")
+
+    def test_csv_round_trip_sqlite(self):
+        self._round_trip("sqlite", "csv")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+# tests/test_user_journal.py
+"""
+Persistencia de usuarios: instantánea + journal (app.user_journal) y su
+uso desde app.users (recuperación tras una caída, compactación, varios
+procesos escribiendo a la vez).
+
+app.users lee su configuración del entorno al importarse, así que las
+pruebas de extremo a extremo se hacen en procesos hijo con USERS_FILE
+propio.
+
+Uso (desde Docker/router):
+    python3 -m unittest discover tests
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+from pathlib import Path
+
+from app.user_journal import UserJournal, atomic_write
+
+ROUTER_DIR = Path(__file__).resolve().parent.parent
+
+
+def _record(op: str, u: str, p: str = "h") -> dict:
+    return {"op": op, "u": u, "p": p}
+
+
+class UserJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="portal-test-journal-")
+        self.dir = Path(self._tmp.name)
+        self.snapshot = self.dir / "users.json"
+        atomic_write(self.snapshot, b'[{"u":"admin","p":"admin"}]')
+        self.journal = UserJournal(self.dir / "users.json.journal", self.snapshot, fsync=False)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _append(self, *records: dict) -> None:
+        for rec in records:
+            self.journal.wait(self.journal.submit(rec))
+
+    def _read(self):
+        return self.journal.read(self._sig())[0]
+
+    def _sig(self):
+        st = os.stat(self.snapshot)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def test_records_round_trip(self):
+        records = [_record("create", "ana"), _record("update", "ana", "h2"), _record("delete", "ana")]
+        self._append(*records)
+        self.assertEqual(self._read(), records)
+
+    def test_read_from_offset_returns_only_new_records(self):
+        self._append(_record("create", "ana"))
+        _, offset = self.journal.read(self._sig())
+        self._append(_record("create", "bea"))
+        records, end = self.journal.read(self._sig(), offset)
+        self.assertEqual(records, [_record("create", "bea")])
+        self.assertEqual(end, self.journal.size())
+
+    def test_torn_last_record_is_ignored(self):
+        self._append(_record("create", "ana"))
+        with open(self.journal.path, "ab") as f:
+            f.write(b'{"op":"create","u":"be')  # caída a mitad de escritura
+        self.assertEqual(self._read(), [_record("create", "ana")])
+
+    def test_append_after_torn_record_is_readable(self):
+        self._append(_record("create", "ana"))
+        with open(self.journal.path, "ab") as f:
+            f.write(b'{"op":"create","u":"be')
+        self._append(_record("create", "carla"))
+        self.assertEqual(self._read(), [_record("create", "ana"), _record("create", "carla")])
+
+    def test_journal_of_replaced_snapshot_is_ignored(self):
+        self._append(_record("create", "ana"))
+        atomic_write(self.snapshot, b'[{"u":"admin","p":"otra"},{"u":"x","p":"y"}]')
+        with _quiet():
+            self.assertEqual(self._read(), [])
+
+    def test_reset_starts_empty_journal_for_new_snapshot(self):
+        self._append(_record("create", "ana"))
+        with self.journal.locked():
+            atomic_write(self.snapshot, b'[{"u":"admin","p":"admin"},{"u":"ana","p":"h"}]')
+            self.journal.reset_locked()
+        self.assertEqual(self._read(), [])
+        self._append(_record("create", "bea"))
+        self.assertEqual(self._read(), [_record("create", "bea")])
+
+    def test_concurrent_appends_are_group_committed(self):
+        threads, per_thread = 8, 50
+
+        def worker(n: int):
+            for i in range(per_thread):
+                self._append(_record("create", f"u{n}-{i}"))
+
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        names = [r["u"] for r in self._read()]
+        self.assertEqual(len(names), threads * per_thread)
+        self.assertEqual(len(set(names)), threads * per_thread)
+        for n in range(threads):
+            # El orden de cada hilo se conserva
+            mine = [u for u in names if u.startswith(f"u{n}-")]
+            self.assertEqual(mine, [f"u{n}-{i}" for i in range(per_thread)])
+        self.assertEqual(self.journal.appends, threads * per_thread)
+        self.assertLessEqual(self.journal.batches, self.journal.appends)
+
+
+class _quiet:
+    """Silencia los print() del código probado (avisos esperados)."""
+
+    def __enter__(self):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+_CHILD_PRELUDE = """
+import json, sys
+from app import users
+"""
+
+
+class UsersStoreTest(unittest.TestCase):
+    """app.users con USERS_FILE y journal propios, en procesos hijo."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="portal-test-users-")
+        self.dir = Path(self._tmp.name)
+        self.users_file = self.dir / "users.json"
+        self.users_file.write_text('[{"u":"admin","p":"admin"}]', encoding="utf-8")
+        self.env = dict(os.environ, USERS_FILE=str(self.users_file), USERS_BACKEND="file",
+                        USERS_JOURNAL_FSYNC="0", USERS_JOURNAL_MAX_BYTES="0", PASSWORD_WORKERS="0")
+        self.env.pop("USERS_JSON", None)
+        self.env.pop("USERS_JOURNAL_FILE", None)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _spawn(self, code: str) -> subprocess.Popen:
+        return subprocess.Popen(
+            [sys.executable, "-c", _CHILD_PRELUDE + textwrap.dedent(code)],
+            cwd=ROUTER_DIR, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+
+    def _run(self, code: str) -> str:
+        proc = self._spawn(code)
+        out, err = proc.communicate(timeout=60)
+        self.assertEqual(proc.returncode, 0, err)
+        return out
+
+    def _users(self) -> dict:
+        out = self._run("print(json.dumps(users._load_state()[0]))")
+        return json.loads(out.strip().splitlines()[-1])
+
+    def test_changes_survive_restart_without_compaction(self):
+        self._run("""
+            users.create_user("ana", "pass-ana")
+            users.create_user("bea", "pass-bea")
+            users.delete_user("ana")
+        """)
+        self.assertEqual(json.loads(self.users_file.read_text(encoding="utf-8")),
+                         [{"u": "admin", "p": "admin"}])  # todo está en el journal
+        self.assertEqual(sorted(self._users()), ["admin", "bea"])
+
+    def test_replay_after_compaction(self):
+        self._run("""
+            users.create_user("ana", "pass-ana")
+            users.compact_users()
+            users.create_user("bea", "pass-bea")
+            users.delete_user("ana")
+        """)
+        snapshot = {u["u"] for u in json.loads(self.users_file.read_text(encoding="utf-8"))}
+        self.assertEqual(snapshot, {"admin", "ana"})
+        self.assertEqual(sorted(self._users()), ["admin", "bea"])
+
+    def test_torn_journal_tail_after_crash(self):
+        self._run('users.create_user("ana", "pass-ana")')
+        with open(f"{self.users_file}.journal", "ab") as f:
+            f.write(b'{"op":"create","u":"medio')
+        self.assertEqual(sorted(self._users()), ["admin", "ana"])
+        self._run('users.create_user("carla", "pass-carla")')
+        self.assertEqual(sorted(self._users()), ["admin", "ana", "carla"])
+
+    def test_snapshot_is_not_changed_by_later_writes(self):
+        out = self._run("""
+            users.create_user("ana", "pass-ana")
+            users_list, mapping = users.load_users()
+            users.create_user("bea", "pass-bea")
+            users.delete_user("ana")
+            print(json.dumps([sorted(mapping), sorted(u["u"] for u in users_list)]))
+        """)
+        self.assertEqual(json.loads(out.strip().splitlines()[-1]), [["admin", "ana"], ["admin", "ana"]])
+
+    def test_two_processes_appending_at_once(self):
+        per_process = 40
+        code = """
+            for i in range({n}):
+                ok, msg = users.create_user("{prefix}" + str(i), "h")
+                assert ok, msg
+        """
+        procs = [self._spawn(code.format(n=per_process, prefix=prefix)) for prefix in ("p1-", "p2-")]
+        for proc in procs:
+            _, err = proc.communicate(timeout=120)
+            self.assertEqual(proc.returncode, 0, err)
+        names = self._users()
+        self.assertEqual(len(names), 1 + 2 * per_process)
+        for prefix in ("p1-", "p2-"):
+            self.assertTrue(all(f"{prefix}{i}" in names for i in range(per_process)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# tests/test_user_pages.py
+"""
+Listado por páginas de /admin/users: las páginas pedidas por cursor
+(after/before) coinciden con las pedidas por posición, en los dos
+almacenes, y el total guardado de SqliteUserStore sigue a las escrituras.
+
+Uso (desde Docker/router):
+    python3 -m unittest discover tests
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from app.user_sqlite import SqliteUserStore
+
+ROUTER_DIR = Path(__file__).resolve().parent.parent
+
+# Mayúsculas mezcladas: el orden es el de (casefold, nombre)
+NAMES = [f"{'Al' if i % 3 == 0 else 'al'}umno{i:03d}" for i in range(53)] + ["bea", "Carla", "admin"]
+
+
+def walk(page, prefix, limit, descending):
+    """Todas las páginas por posición, por after y, hacia atrás, por before."""
+    by_offset, by_cursor, back = [], [], []
+    total = page(prefix, 0, 0)[1]
+    for offset in range(0, total, limit):
+        by_offset.append(page(prefix, offset, limit, descending)[0])
+    rows = page(prefix, 0, limit, descending)[0]
+    while rows:
+        by_cursor.append(rows)
+        rows = page(prefix, 0, limit, descending, after=rows[-1])[0]
+    rows = by_cursor[-1] if by_cursor else []
+    while rows:
+        back.append(rows)
+        rows = page(prefix, 0, limit, descending, before=rows[0])[0]
+    return total, by_offset, by_cursor, back[::-1]
+
+
+class PageCursorTest(unittest.TestCase):
+    def _check(self, walked, expected_total):
+        total, by_offset, by_cursor, back = walked
+        self.assertEqual(total, expected_total)
+        self.assertEqual(by_cursor, by_offset)
+        self.assertEqual(back, by_offset)
+        self.assertEqual(sum(len(p) for p in by_offset), total)
+
+    def _cases(self):
+        for prefix, expected in (("", len(NAMES)), ("al", 53), ("ALUMNO04", 10), ("zz", 0)):
+            for descending in (False, True):
+                yield prefix, expected, descending
+
+    def test_sqlite_cursor_pages_match_offset_pages(self):
+        with tempfile.TemporaryDirectory(prefix="portal-test-pages-") as tmp:
+            store = SqliteUserStore(Path(tmp) / "users.db")
+            store.upsert_many((u, "h") for u in NAMES)
+            for prefix, expected, descending in self._cases():
+                with self.subTest(prefix=prefix, descending=descending):
+                    self._check(walk(store.page, prefix, 7, descending), expected)
+
+    def test_file_store_cursor_pages_match_offset_pages(self):
+        with tempfile.TemporaryDirectory(prefix="portal-test-pages-") as tmp:
+            users_file = Path(tmp) / "users.json"
+            users_file.write_text(json.dumps([{"u": u, "p": "h"} for u in NAMES]), encoding="utf-8")
+            env = dict(os.environ, USERS_FILE=str(users_file), USERS_BACKEND="file", PASSWORD_WORKERS="0")
+            env.pop("USERS_JSON", None)
+            env.pop("USERS_JOURNAL_FILE", None)
+            cases = [[p, d] for p, _, d in self._cases()]
+            code = ("import json\nfrom app import users\nfrom tests.test_user_pages import walk\n"
+                    f"print(json.dumps([walk(users._STORE.page, p, 7, d) for p, d in {cases!r}]))")
+            proc = subprocess.run([sys.executable, "-c", code], cwd=ROUTER_DIR, env=env,
+                                  capture_output=True, text=True, timeout=60)
+            self.assertEqual(proc.returncode, 0, proc.stderr)
+            results = json.loads(proc.stdout.strip().splitlines()[-1])
+        for (prefix, expected, descending), walked in zip(self._cases(), results):
+            with self.subTest(prefix=prefix, descending=descending):
+                self._check(walked, expected)
+
+    def test_sqlite_cached_total_follows_writes(self):
+        with tempfile.TemporaryDirectory(prefix="portal-test-pages-") as tmp:
+            store = SqliteUserStore(Path(tmp) / "users.db")
+            store.upsert_many((u, "h") for u in NAMES)
+            self.assertEqual(store.page("al", 0, 0)[1], 53)
+            store.create("alumno999", "h")  # misma conexión
+            self.assertEqual(store.page("al", 0, 0)[1], 54)
+            other = threading.Thread(target=store.delete, args=("Alumno000",))  # otra conexión
+            other.start()
+            other.join()
+            self.assertEqual(store.page("al", 0, 0)[1], 53)
+            SqliteUserStore(Path(tmp) / "users.db").create("alba", "h")  # como otro proceso
+            self.assertEqual(store.page("al", 0, 0)[1], 54)
+
+
+if __name__ == "__main__":
+    unittest.main()
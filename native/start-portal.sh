@@ -23,6 +23,8 @@ source "$CONFIG_FILE"
 : "${LAN_IP:=192.168.100.1}"
 : "${LAN_CIDR:=192.168.100.0/24}"
 : "${PORTAL_PORT:=8080}"
+: "${SERVER_MODE:=threadpool}"
+: "${PORTAL_PROCESSES:=1}"
 : "${NGINX_HTTP_PORT:=80}"
 : "${NGINX_HTTPS_PORT:=443}"
 : "${AUTH_TIMEOUT:=3600}"
@@ -166,13 +168,17 @@ ensure_rule iptables -C FORWARD -i "$LAN_IF" -o "$UPLINK_IF" -j REJECT || { log_
 # Backend Python
 # =========================
 [[ -f "$APP_DIR/app/main.py" ]] || { echo "Error: no existe $APP_DIR/app/main.py"; exit 1; }
+# SIGTERM: el backend anterior guarda sus sesiones (SESSIONS_FILE) antes de salir
 pkill -f "python3.*app.main" || true
-sleep 1
+for _ in $(seq 1 20); do
+  pgrep -f "python3.*app.main" >/dev/null || break
+  sleep 0.5
+done
 
 export AUTH_TIMEOUT="$AUTH_TIMEOUT"
 export USERS_FILE="$USERS_FILE"
 cd "$APP_DIR"
-python3 -u -m app.main "$PORTAL_PORT" >> /var/log/captive-portal/backend.log 2>&1 &
+python3 -u -m app.main "$PORTAL_PORT" --mode "$SERVER_MODE" --processes "$PORTAL_PROCESSES" >> /var/log/captive-portal/backend.log 2>&1 &
 PORTAL_PID=$!
 echo "$PORTAL_PID" > /var/run/captive-portal-backend.pid
 
@@ -192,6 +198,14 @@ fi
 rm -f /etc/nginx/sites-enabled/* 2>/dev/null || true
 
 cat > /etc/nginx/sites-available/captive-portal <<EOF
+# Backend Python con conexiones persistentes (keep-alive).
+# keepalive_timeout debe ser menor que KEEPALIVE_TIMEOUT del backend.
+upstream portal_backend {
+    server 127.0.0.1:${PORTAL_PORT};
+    keepalive 32;
+    keepalive_timeout 10s;
+}
+
 # Portal Cautivo - HTTP (detección y redirección)
 server {
     listen ${NGINX_HTTP_PORT} default_server;
@@ -236,7 +250,9 @@ server {
     ssl_protocols TLSv1.2 TLSv1.3;
 
     location / {
-        proxy_pass http://127.0.0.1:${PORTAL_PORT};
+        proxy_pass http://portal_backend;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
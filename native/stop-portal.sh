@@ -13,6 +13,11 @@ if [[ -f /var/run/captive-portal-backend.pid ]]; then
   PID=$(cat /var/run/captive-portal-backend.pid)
   kill "$PID" 2>/dev/null || true
   rm -f /var/run/captive-portal-backend.pid
+  # Tiempo para guardar las sesiones (SESSIONS_FILE) antes de forzar la salida
+  for _ in $(seq 1 20); do
+    kill -0 "$PID" 2>/dev/null || break
+    sleep 0.5
+  done
 fi
 pkill -f "python3.*app.main" || true
 